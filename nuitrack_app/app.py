@@ -1,5 +1,7 @@
+import sqlite3
 import time
 import tkinter as tk
+from tkinter import ttk
 import custom_messagebox as messagebox
 import sys
 import os
@@ -7,11 +9,17 @@ import os
 from session import start_session, stop_session, toggle_exercise
 from theme import ModernTheme, ModernWidget
 
-from utils.nuitrack_runner import update_timer_display, run_nuitrack
-from utils.calibration import perform_calibration
+from utils.nuitrack_runner import run_nuitrack
+from utils.calibration import REQUIRED_SAMPLES, begin_calibration, finish_calibration
+from utils.exercise_logic import get_step_plan, user_tracker
+from utils.step_compiler import compile_thresholds
+from utils.user_profiles import PROFILE_VERIFY_DURATION, apply_profile, metrics_drift, profile_store
 
 import globals
 
+# Интервал на повторен опит за проверка на профила, докато потребителят не е пред камерата (ms)
+PROFILE_VERIFY_RETRY_MS = 500
+
 # ===== GUI SETUP =====
 class ModernExerciseApp:
     """Модерен редизайн на приложението за упражнения"""
@@ -94,7 +102,7 @@ class ModernExerciseApp:
         self.start_btn = self.widget_factory.create_button(
             button_frame,
             "Стартиране на сесия",
-            command=lambda: start_session(update_timer_display, run_nuitrack, self),
+            command=lambda: start_session(run_nuitrack, self),
             variant="success"
         )
         self.start_btn.pack(side=tk.LEFT, padx=(0, 8))
@@ -116,6 +124,24 @@ class ModernExerciseApp:
         )
         self.calibrate_btn.pack(side=tk.LEFT, padx=(8, 0))
 
+        # Избор на потребителски профил - запазените метрики заместват калибрирането
+        profile_frame = tk.Frame(session_content, bg=self.theme.colors['card'])
+        profile_frame.pack(fill=tk.X, pady=(12, 0))
+
+        profile_label = self.widget_factory.create_label(
+            profile_frame,
+            "Профил на потребителя:",
+            style="body_medium"
+        )
+        profile_label.pack(side=tk.LEFT, padx=(0, 8))
+
+        # Ново име се въвежда ръчно и се запазва след успешно калибриране
+        self.profile_var = tk.StringVar()
+        self.profile_menu = ttk.Combobox(profile_frame, textvariable=self.profile_var, values=self._profile_names(), width=28)
+        self.profile_menu.pack(side=tk.LEFT)
+        self.profile_menu.bind("<<ComboboxSelected>>", self._select_profile)
+        self._verifying_profile = False
+
         # Карта за упражнение
         exercise_card = self.widget_factory.create_card(main_container)
         exercise_card.pack(fill=tk.X, pady=(0, 16))
@@ -162,22 +188,123 @@ class ModernExerciseApp:
         self.exercise_btn.pack(anchor=tk.W, pady=(0, 16))
         self.exercise_btn.configure(state="disabled")
 
+        # Състояние на упражнението (напр. завършено)
+        self.accuracy_label = self.widget_factory.create_label(
+            exercise_content,
+            "",
+            style="body_medium"
+        )
+        self.accuracy_label.pack(anchor=tk.W)
+
     def start_calibration(self):
-        """Започва процеса на калибриране."""
+        """Започва процеса на калибриране - кадрите се подават от потока на сесията във фонов режим."""
         if not globals.session_running:
             messagebox.showwarning("Грешка", "Моля, стартирайте сесия преди калибриране!")
             return
-        if globals.calibration_completed:
-            messagebox.showinfo("Информация", "Калибрирането вече е извършено!")
+        if globals.calibration_active:
             return
-        globals.calibration_active = True
-        globals.calibration_start_time = time.time()
-        result = perform_calibration(globals.nuitrack_instance)
-        if result:
+        self._verifying_profile = False
+        begin_calibration()
+        self.calibrate_btn.configure(state="disabled", text="Калибриране... 0%")
+
+    def on_calibration_progress(self, progress):
+        """Обновява напредъка на калибрирането (вика се чрез root.after от етапа за анализ)."""
+        if globals.calibration_active and not self._verifying_profile:
+            self.calibrate_btn.configure(text=f"Калибриране... {progress}%")
+
+    def on_calibration_finished(self, result):
+        """Проверява резултата от калибрирането в Tk нишката и показва съобщение."""
+        self.calibrate_btn.configure(state="normal", text="Стартиране на калибриране")
+        if not globals.session_running:
+            return
+        if finish_calibration(result):
             globals.calibration_completed = True
-            messagebox.showinfo("Успех", "Калибрирането е успешно завършено!", False)
+            globals.user_thresholds = compile_thresholds(globals.user_metrics)
+            user_tracker.set_metrics(globals.primary_user_id, globals.user_metrics, globals.user_thresholds)
+            message = f"Калибрирането е успешно завършено!\nКачество: {globals.calibration_quality:.0f}%"
+            if self._save_profile():
+                message += f"\nПрофилът „{globals.user_profile}“ е запазен."
+            messagebox.showinfo("Успех", message, False)
+            self.exercise_btn.configure(state="normal")
+
+    def _profile_names(self):
+        try:
+            return profile_store.names()
+        except sqlite3.Error as e:
+            globals.logger.error(f"Could not read user profiles: {e}")
+            return []
+
+    def _save_profile(self):
+        """Запазва калибрирането в профила с въведеното име. Връща True при успешен запис."""
+        name = self.profile_var.get().strip()
+        globals.user_profile = name or None
+        if not name:
+            return False
+        try:
+            profile_store.save(name, globals.user_metrics, globals.user_thresholds, globals.calibration_quality)
+        except sqlite3.Error as e:
+            globals.logger.error(f"Could not save profile '{name}': {e}")
+            return False
+        self.profile_menu.configure(values=self._profile_names())
+        return True
+
+    def _select_profile(self, event=None):
+        """Зарежда избрания профил вместо калибриране и го проверява, ако сесията е активна."""
+        name = self.profile_var.get().strip()
+        if globals.exercise_active or globals.calibration_active:
+            messagebox.showwarning(
+                "Профилът не може да бъде сменен",
+                "Не можете да смените профила по време на упражнение или калибриране."
+            )
+            self.root.after(10, lambda: self.profile_var.set(globals.user_profile or ""))
+            return
+        try:
+            profile = profile_store.load(name)
+        except sqlite3.Error as e:
+            globals.logger.error(f"Could not load profile '{name}': {e}")
+            profile = None
+        if profile is None:
+            messagebox.showerror("Грешка", f"Профилът „{name}“ не може да бъде зареден.")
+            return
+
+        apply_profile(profile)
+        if globals.session_running:
             self.exercise_btn.configure(state="normal")
-        globals.calibration_active = False
+            self.verify_profile()
+
+    def verify_profile(self):
+        """Кратка проверка дали избраният профил все още отговаря на потребителя пред камерата."""
+        if not globals.session_running or not globals.user_profile or globals.calibration_active:
+            return
+        # Изчакване, докато потребителят застане пред камерата
+        if globals.current_user_skeleton is None:
+            self.root.after(PROFILE_VERIFY_RETRY_MS, self.verify_profile)
+            return
+        self._verifying_profile = True
+        begin_calibration(PROFILE_VERIFY_DURATION, PROFILE_VERIFY_DURATION, on_finished=self.on_profile_verified)
+        self.calibrate_btn.configure(state="disabled", text="Проверка на профила...")
+
+    def on_profile_verified(self, result):
+        """Сравнява кратко измерените метрики с профила и при голямо отклонение пуска пълно калибриране."""
+        self._verifying_profile = False
+        self.calibrate_btn.configure(state="normal", text="Стартиране на калибриране")
+        if not globals.session_running or not globals.user_profile:
+            return
+        if result.metrics is None or result.samples < REQUIRED_SAMPLES:
+            globals.logger.warning(f"Profile '{globals.user_profile}' not verified: only {result.samples} valid samples")
+            return
+
+        drift = metrics_drift(globals.user_metrics, result.metrics)
+        if not drift:
+            globals.logger.info(f"Profile '{globals.user_profile}' verified with {result.samples} samples")
+            return
+
+        globals.logger.info(f"Profile '{globals.user_profile}' drifted: {drift}")
+        messagebox.showwarning(
+            "Нужно е ново калибриране",
+            f"Мерките на тялото се различават от профила „{globals.user_profile}“.\n\nЗапочва ново калибриране."
+        )
+        self.start_calibration()
     
     def _update_exercise(self, value):
         if globals.exercise_active:
@@ -196,6 +323,12 @@ class ModernExerciseApp:
                 break
         print(f"Selected exercise: {value}")
 
+        # Декодиране на инструкциите на упражнението в паметта
+        globals.tts_manager.preload_exercise(globals.EXERCISE_JSON)
+
+        # Предварителна компилация на стъпките, ако вече има калибриране
+        get_step_plan(0)
+
     def run(self):
         """Стартиране на приложението"""
         self.root.mainloop()
\ No newline at end of file
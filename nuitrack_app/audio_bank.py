@@ -0,0 +1,94 @@
+import logging
+import threading
+from collections import OrderedDict
+
+import pygame
+
+logger = logging.getLogger(__name__)
+
+# Максимална памет за декодираните звуци (байтове PCM) - около 6 минути реч при 22050 Hz стерео
+AUDIO_BANK_MAX_BYTES = 32 * 1024 * 1024
+
+class AudioBank:
+    """
+    Банка с декодирани в паметта звуци (pygame.mixer.Sound) по ключ - например текста на инструкцията.
+
+    Файлът се декодира веднъж до PCM, а възпроизвеждането после започва без четене от диска.
+    Общият размер е ограничен до `max_bytes`; при препълване се освобождават най-отдавна използваните звуци.
+    Може да се използва от няколко нишки.
+    """
+
+    def __init__(self, max_bytes=AUDIO_BANK_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._sounds = OrderedDict()  # ключ -> (звук, размер), последно използваните в края
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._sounds
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sounds)
+
+    def get(self, key):
+        """Декодираният звук за ключа или None, ако не е в банката."""
+        with self._lock:
+            entry = self._sounds.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._sounds.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def load(self, key, path):
+        """Декодира файла и го добавя в банката (ако вече не е там). Връща звука или None при грешка."""
+        sound = self.get(key)
+        if sound is not None:
+            return sound
+        if not pygame.mixer.get_init():
+            return None
+
+        # Декодирането е бавната част - извън заключването
+        try:
+            sound = pygame.mixer.Sound(path)
+        except Exception as e:
+            logger.warning(f"Could not decode {path}: {e}")
+            return None
+        size = _pcm_size(sound)
+
+        with self._lock:
+            if key in self._sounds:
+                return self._sounds[key][0]
+            self._sounds[key] = (sound, size)
+            self.size += size
+            # Освобождаване на най-отдавна използваните, но не и на току-що добавения звук
+            while self.size > self.max_bytes and len(self._sounds) > 1:
+                evicted, (_, evicted_size) = self._sounds.popitem(last=False)
+                self.size -= evicted_size
+                logger.debug(f"Audio bank evicted: {str(evicted)[:40]}...")
+        return sound
+
+    def preload(self, items):
+        """Декодира двойките (ключ, път) в банката. Връща броя заредени звуци."""
+        return sum(self.load(key, path) is not None for key, path in items)
+
+    def discard(self, key):
+        with self._lock:
+            entry = self._sounds.pop(key, None)
+            if entry is not None:
+                self.size -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._sounds.clear()
+            self.size = 0
+
+def _pcm_size(sound):
+    """Размер на декодирания звук в байтове според формата на миксера."""
+    frequency, size, channels = pygame.mixer.get_init()
+    return int(sound.get_length() * frequency) * (abs(size) // 8) * channels
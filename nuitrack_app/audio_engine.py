@@ -0,0 +1,263 @@
+import itertools
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+import pygame
+
+from audio_bank import AudioBank
+from utils.trace import tracer
+
+logger = logging.getLogger(__name__)
+
+# Настройки на миксера - малък буфер за по-малка латентност
+MIXER_FREQUENCY = 22050
+MIXER_BUFFER = 512
+
+# Предварително заделени канали: един за инструкциите и няколко за звуковите ефекти
+INSTRUCTION_CHANNEL = 0
+EFFECT_CHANNELS = (1, 2)
+
+# Сила на инструкцията, докато звучи звуков ефект
+DUCK_VOLUME = 0.4
+
+# Колко често (s) се проверява края на звуците, докато нещо звучи
+POLL_INTERVAL = 0.02
+
+# Колко дълго (s) stop() чака нишката да изпълни командата
+STOP_TIMEOUT = 1.0
+
+# Приоритети на командите - по-малкото число се изпълнява първо
+PRIORITY_STOP = 0
+PRIORITY_INTERRUPT = 1
+PRIORITY_DUCK = 2
+PRIORITY_PLAY = 3
+
+class AudioEngine:
+    """
+    Единствената нишка, която работи с pygame миксера - инструкции и звукови ефекти.
+
+    Останалите нишки само добавят команди (play, interrupt, duck, stop) в опашка с приоритет;
+    стоп и прекъсване минават пред чакащите възпроизвеждания. Всяка команда носи поколението,
+    в което е подадена - stop() започва ново поколение, така че по-старите команди в опашката се пропускат.
+    Инструкциите звучат на собствен канал една след друга; ефектите - на отделни канали и
+    заглушават инструкцията, докато звучат. Ефектите се подават като пътища и се декодират
+    в нишката на двигателя веднъж, в собствена банка (`effects`).
+    """
+
+    def __init__(self):
+        self._commands = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._thread = None
+        self._running = False
+        self._failed = False
+        self.initialized = False
+
+        # Състояние, което се променя само от нишката на двигателя
+        self._pending = deque()          # Чакащи инструкции (звук, име)
+        self._instruction = None         # (звук, име, начало) на текущата инструкция
+        self._instruction_channel = None
+        self._effect_channels = ()
+        self.effects = AudioBank()       # Декодираните звукови ефекти по път
+        self._volume = 1.0               # Сила на инструкциите, зададена с duck()
+        self._ducked = False             # Инструкцията е заглушена, докато звучи ефект
+
+    def start(self):
+        """Стартира нишката и инициализира миксера в нея. Връща True, ако миксерът е готов."""
+        if self._failed:
+            return False
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._ready.clear()
+                self._running = True
+                self._thread = threading.Thread(target=self._run, name="audio_engine", daemon=True)
+                self._thread.start()
+        self._ready.wait(timeout=STOP_TIMEOUT)
+        return self.initialized
+
+    def play_instruction(self, sound, name=None, interrupt=True):
+        """Възпроизвежда инструкция; при interrupt=False изчаква текущата и чакащите преди нея."""
+        self._submit(PRIORITY_PLAY, self._play_instruction, sound, name, interrupt)
+
+    def play_effect(self, sound, name=None, duck=True, on_started=None):
+        """
+        Възпроизвежда звуков ефект (път до файл или Sound) на свободен канал за ефекти.
+        Пътят се декодира в нишката на двигателя и остава в банката `effects`.
+        on_started(закъснение) получава оценка на времето (s) от извикването до началото на звука.
+        """
+        self._submit(PRIORITY_PLAY, self._play_effect, sound, name, duck, on_started, time.perf_counter())
+
+    def preload_effects(self, paths):
+        """Декодира звуковите ефекти в банката предварително (в нишката на двигателя)."""
+        self._submit(PRIORITY_PLAY, self._preload_effects, tuple(paths))
+
+    def interrupt(self, wait=False):
+        """Спира текущата инструкция и изчиства чакащите. Звуковите ефекти продължават."""
+        self._submit(PRIORITY_INTERRUPT, self._interrupt, wait=wait)
+
+    def duck(self, volume):
+        """Задава силата на инструкциите (1.0 - нормална)."""
+        self._submit(PRIORITY_DUCK, self._set_volume, volume)
+
+    def stop(self, wait=True):
+        """Спира всичко и отказва всички подадени досега команди. По подразбиране изчаква изпълнението."""
+        with self._lock:
+            self._generation += 1
+        self._submit(PRIORITY_STOP, self._stop, wait=wait)
+
+    def shutdown(self):
+        """Спира всичко, затваря миксера и спира нишката."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._running = False
+        self.stop(wait=False)
+        self._thread.join(timeout=STOP_TIMEOUT)
+
+    def instruction_busy(self):
+        return self._instruction is not None or bool(self._pending)
+
+    def _submit(self, priority, handler, *args, wait=False):
+        if not self.start():
+            return
+        done = threading.Event() if wait else None
+        with self._lock:
+            generation = self._generation
+        self._commands.put((priority, next(self._sequence), generation, handler, args, done))
+        if done is not None:
+            done.wait(timeout=STOP_TIMEOUT)
+
+    def _run(self):
+        try:
+            if not pygame.mixer.get_init():
+                pygame.mixer.init(frequency=MIXER_FREQUENCY, size=-16, channels=2, buffer=MIXER_BUFFER)
+            pygame.mixer.set_reserved(max(EFFECT_CHANNELS) + 1)
+            self._instruction_channel = pygame.mixer.Channel(INSTRUCTION_CHANNEL)
+            self._effect_channels = tuple(pygame.mixer.Channel(index) for index in EFFECT_CHANNELS)
+            self.initialized = True
+            logger.info("Audio engine started")
+        except Exception as e:
+            logger.error(f"Audio engine failed to initialize the mixer: {e}")
+            self._failed = True
+            self._running = False
+            return
+        finally:
+            self._ready.set()
+
+        while self._running:
+            busy = self._instruction is not None or self._pending or self._ducked
+            try:
+                _, _, generation, handler, args, done = self._commands.get(timeout=POLL_INTERVAL if busy else None)
+            except queue.Empty:
+                handler = None
+            if handler is not None:
+                try:
+                    # Командите от преди последния stop() се пропускат
+                    if generation >= self._generation:
+                        handler(*args)
+                except Exception as e:
+                    logger.error(f"Audio engine command failed: {e}")
+                finally:
+                    if done is not None:
+                        done.set()
+            self._update()
+
+        self._close()
+
+    def _update(self):
+        """Отбелязва края на инструкцията, пуска следващата и връща силата след ефектите."""
+        if self._instruction is not None and not self._instruction_channel.get_busy():
+            self._finish_instruction()
+        if self._instruction is None and self._pending:
+            self._start_instruction(*self._pending.popleft())
+        if self._ducked and not any(channel.get_busy() for channel in self._effect_channels):
+            self._ducked = False
+            self._apply_volume()
+
+    def _play_instruction(self, sound, name, interrupt):
+        if interrupt:
+            self._interrupt()
+        self._pending.append((sound, name))
+
+    def _start_instruction(self, sound, name):
+        self._instruction_channel.play(sound)
+        self._apply_volume()
+        self._instruction = (sound, name, time.perf_counter())
+
+    def _finish_instruction(self):
+        _, name, start = self._instruction
+        self._instruction = None
+        tracer.complete("tts_play", start, time.perf_counter(), "tts", {"text": name} if name else None)
+
+    def estimated_output_latency(self):
+        """Оценка на закъснението на изхода на миксера (s) - един буфер при текущата честота, не се измерва."""
+        frequency = pygame.mixer.get_init()[0] if pygame.mixer.get_init() else MIXER_FREQUENCY
+        return MIXER_BUFFER / frequency
+
+    def _play_effect(self, sound, name, duck, on_started, submitted):
+        with tracer.span("sound_play", "sound", {"sound": name} if name else None):
+            if isinstance(sound, str):
+                sound = self._effect_sound(sound)
+                if sound is None:
+                    return
+            # Свободен канал, иначе първият
+            channel = next((channel for channel in self._effect_channels if not channel.get_busy()), self._effect_channels[0])
+            channel.play(sound)
+
+        # От извикването до чуването: измерени изчакване в опашката и стартиране плюс изчисления буфер на миксера
+        dispatch = time.perf_counter() - submitted
+        buffer = self.estimated_output_latency()
+        latency = dispatch + buffer
+        tracer.complete("cue_latency_estimate", submitted, submitted + latency, "sound",
+                        {"sound": name, "dispatch_ms": dispatch * 1000, "mixer_buffer_ms": buffer * 1000, "estimate": True})
+        if on_started is not None:
+            on_started(latency)
+        if duck and self._instruction is not None:
+            self._ducked = True
+            self._apply_volume()
+
+    def _effect_sound(self, path):
+        return self.effects.load(path, path)
+
+    def _preload_effects(self, paths):
+        loaded = sum(self._effect_sound(path) is not None for path in paths)
+        logger.info(f"Loaded {loaded} of {len(paths)} sound effects into memory")
+
+    def _interrupt(self):
+        self._pending.clear()
+        if self._instruction is not None:
+            self._instruction_channel.stop()
+            self._finish_instruction()
+
+    def _set_volume(self, volume):
+        self._volume = volume
+        self._apply_volume()
+
+    def _apply_volume(self):
+        self._instruction_channel.set_volume(self._volume * (DUCK_VOLUME if self._ducked else 1.0))
+
+    def _stop(self):
+        self._interrupt()
+        for channel in self._effect_channels:
+            channel.stop()
+        pygame.mixer.music.stop()
+        self._ducked = False
+        self._set_volume(1.0)
+
+    def _close(self):
+        try:
+            self._stop()
+            # Декодираните звуци не са валидни след затварянето на миксера
+            self.effects.clear()
+            pygame.mixer.quit()
+        except Exception as e:
+            logger.warning(f"Error closing the mixer: {e}")
+        self.initialized = False
+        logger.info("Audio engine stopped")
+
+# Глобален аудио двигател
+audio_engine = AudioEngine()
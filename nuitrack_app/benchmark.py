@@ -0,0 +1,223 @@
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import globals
+from exercises import ALL_EXERCISES
+from utils.calibration import CALIBRATION_MAX_DURATION, StreamingCalibrator
+from utils.exercise_logic import step_progress, user_tracker
+from utils.frame_sources import SyntheticSource, create_frame_source
+from utils.joint_smoothing import smoothing_name
+from utils.nuitrack_runner import analyze_frame, capture_frame, render_frame
+from utils.skeleton_processing import frame_timestamp, process_skeleton_data
+from utils.step_compiler import compile_thresholds
+
+# Етапи на обработката в реда, в който се изпълняват
+STAGES = ("capture", "analysis", "render")
+
+# Перцентили за латентността на етапите
+PERCENTILES = (50, 95, 99)
+
+# Най-много кадри за калибрирането - CALIBRATION_MAX_DURATION при 30 fps с резерв
+CALIBRATION_FRAME_LIMIT = int(CALIBRATION_MAX_DURATION * 30 * 2)
+
+class _SilentAudio:
+    """Заглушава звуците и гласовите инструкции по време на бенчмарка - всяко извикване е празно."""
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+def _create_source(args):
+    """Създава източника на кадри без изчакване между кадрите."""
+    if args.source == "synthetic" or args.source.startswith("synthetic:"):
+        _, _, users = args.source.partition(":")
+        return SyntheticSource(users=int(users) if users else 1, realtime=False, noise_mm=args.noise,
+                               dropout=args.dropout, seed=args.seed)
+    source = create_frame_source(args.source)
+    source.realtime = False
+    return source
+
+def _calibrate(source):
+    """
+    Калибриране от първите кадри на източника със StreamingCalibrator, както в приложението,
+    но по времето на кадрите и без диалози. Приключва при стабилни метрики или след CALIBRATION_MAX_DURATION.
+    """
+    calibrator = None
+    for _ in range(CALIBRATION_FRAME_LIMIT):
+        source.update()
+        data = source.get_skeleton()
+        process_skeleton_data(data)
+        now = frame_timestamp(data)
+        if calibrator is None:
+            calibrator = StreamingCalibrator(now)
+        if calibrator.add_frame(globals.current_user_skeleton, now):
+            break
+
+    result = calibrator.result()
+    if result.metrics is None:
+        raise RuntimeError(f"Calibration failed: missing joints {', '.join(result.missing_joints)} "
+                           f"({result.samples} samples, {result.rejected} rejected)")
+    globals.user_metrics = result.metrics
+    globals.user_thresholds = compile_thresholds(result.metrics)
+    globals.calibration_quality = result.quality
+    globals.calibration_completed = True
+    return result
+
+def _start_exercise():
+    globals.exercise_active = True
+    globals.current_step = 0
+    globals.step_start_time = time.time()
+    step_progress.reset()
+    user_tracker.restart_exercise()
+
+def _run_frame(source, timings, index):
+    """Изпълнява трите етапа върху един кадър и записва времето им в наносекунди."""
+    t0 = time.perf_counter_ns()
+    captured = capture_frame(source)
+    t1 = time.perf_counter_ns()
+    analyzed = analyze_frame(captured)
+    t2 = time.perf_counter_ns()
+    render_frame(analyzed, source)
+    t3 = time.perf_counter_ns()
+
+    if timings is not None:
+        timings[index] = (t1 - t0, t2 - t1, t3 - t2)
+
+def _run(source, frames, timings=None):
+    """Върти обработката за `frames` кадъра. Упражнението се рестартира при завършване."""
+    completed_steps = completed_exercises = 0
+    for index in range(frames):
+        step = globals.current_step
+        _run_frame(source, timings, index)
+
+        if not globals.exercise_active:
+            completed_exercises += 1
+            completed_steps += 1
+            _start_exercise()
+        elif globals.current_step != step:
+            completed_steps += 1
+    return completed_steps, completed_exercises
+
+def _measure_allocations(source, frames):
+    """
+    Отделно минаване с tracemalloc (бави обработката, затова не е в измерването на латентността).
+    Връща медианата на най-голямата временна памет за кадър и нетно задържаните блокове на кадър.
+    """
+    peaks = np.empty(frames)
+    tracemalloc.start()
+    try:
+        start_blocks = sys.getallocatedblocks()
+        for index in range(frames):
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            _run(source, 1)
+            _, peak = tracemalloc.get_traced_memory()
+            peaks[index] = peak - current
+        net_blocks = (sys.getallocatedblocks() - start_blocks) / frames
+    finally:
+        tracemalloc.stop()
+    return {
+        "frames": frames,
+        "peak_bytes_per_frame_p50": float(np.percentile(peaks, 50)),
+        "peak_bytes_per_frame_max": float(peaks.max()),
+        "net_blocks_per_frame": net_blocks,
+    }
+
+def _stage_report(timings, wall_time):
+    """Събира fps и перцентилите на латентността (в ms) за всеки етап и за целия кадър."""
+    frames = len(timings)
+    report = {"frames": frames, "wall_time_s": wall_time, "fps": frames / wall_time if wall_time > 0 else 0.0, "stages": {}}
+    columns = list(zip(STAGES, timings.T)) + [("total", timings.sum(axis=1))]
+    for name, values in columns:
+        ms = values / 1e6
+        stats = {f"p{p}_ms": float(v) for p, v in zip(PERCENTILES, np.percentile(ms, PERCENTILES))}
+        stats["mean_ms"] = float(ms.mean())
+        stats["max_ms"] = float(ms.max())
+        report["stages"][name] = stats
+    return report
+
+def run_benchmark(args):
+    """Пуска бенчмарка и връща отчета като речник."""
+    # Без звук, без Tk и без прозорци - само веригата от run_nuitrack
+    globals.sound_manager = _SilentAudio()
+    globals.tts_manager = _SilentAudio()
+    globals.app = None
+    globals.session_running = True
+    globals.session_start_time = time.time()
+    globals.EXERCISE_JSON = ALL_EXERCISES[args.exercise]
+
+    source = _create_source(args)
+    globals.nuitrack_instance = source
+    calibration = _calibrate(source)
+    _start_exercise()
+
+    # Загряване (кешове за текст, слоеве и компилирани стъпки)
+    _run(source, args.warmup)
+
+    timings = np.zeros((args.frames, len(STAGES)), dtype=np.int64)
+    start = time.perf_counter()
+    completed_steps, completed_exercises = _run(source, args.frames, timings)
+    wall_time = time.perf_counter() - start
+
+    report = _stage_report(timings, wall_time)
+    report.update({
+        "source": args.source,
+        "exercise": globals.EXERCISE_JSON["exercise_name"],
+        "smoothing": smoothing_name(),
+        "completed_steps": completed_steps,
+        "completed_exercises": completed_exercises,
+        "user_metrics": calibration.metrics,
+        "calibration": {
+            "samples": calibration.samples,
+            "rejected": calibration.rejected,
+            "duration_s": calibration.duration,
+            "converged": calibration.converged,
+            "quality": calibration.quality,
+        },
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    })
+    if args.alloc_frames:
+        report["allocations"] = _measure_allocations(source, args.alloc_frames)
+
+    globals.session_running = False
+    return report
+
+def _print_report(report):
+    print(f"{report['frames']} frames in {report['wall_time_s']:.2f}s - {report['fps']:.1f} fps "
+          f"({report['completed_steps']} steps, {report['completed_exercises']} exercises completed)")
+    for name, stats in report["stages"].items():
+        print(f"  {name:<9} p50={stats['p50_ms']:.3f}ms  p95={stats['p95_ms']:.3f}ms  p99={stats['p99_ms']:.3f}ms  max={stats['max_ms']:.3f}ms")
+    if "allocations" in report:
+        alloc = report["allocations"]
+        print(f"  allocations: peak {alloc['peak_bytes_per_frame_p50'] / 1024:.1f} KiB/frame (p50), "
+              f"{alloc['net_blocks_per_frame']:.2f} net blocks/frame")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Headless benchmark of the frame pipeline (capture, analysis, render).")
+    parser.add_argument("--source", default="synthetic", help="synthetic, synthetic:<users> or replay:<path to .mskel>")
+    parser.add_argument("--exercise", type=int, default=0, choices=range(len(ALL_EXERCISES)), help="index in ALL_EXERCISES")
+    parser.add_argument("--frames", type=int, default=2000, help="number of measured frames")
+    parser.add_argument("--warmup", type=int, default=100, help="frames run before measuring")
+    parser.add_argument("--alloc-frames", type=int, default=300, help="frames traced for allocations (0 to skip)")
+    parser.add_argument("--noise", type=float, default=5.0, help="synthetic joint noise in mm")
+    parser.add_argument("--dropout", type=float, default=0.001, help="synthetic per-joint dropout probability")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the synthetic source")
+    parser.add_argument("--output", default="benchmark_report.json", help="path of the JSON report")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_benchmark(args)
+    _print_report(report)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Report written to {args.output}")
+
+if __name__ == "__main__":
+    main()
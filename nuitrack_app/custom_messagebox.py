@@ -1,5 +1,7 @@
 import tkinter as tk
 
+from utils.trace import tracer
+
 def _create_dialog(parent, title, message, dialog_type="info", buttons="ok", play_sound=True):
     """Създава персонализиран диалогов прозорец с модерен стил, съответстващ на уеб приложението"""
     # Вземане на родителския прозорец, по подразбиране root
@@ -193,7 +195,8 @@ def _create_dialog(parent, title, message, dialog_type="info", buttons="ok", pla
     dialog.protocol("WM_DELETE_WINDOW", on_cancel if buttons == "yesno" else on_ok)
     
     # Изчакване диалогът да се затвори
-    parent.wait_window(dialog)
+    with tracer.span("dialog", "ui", {"title": title}):
+        parent.wait_window(dialog)
     
     return result[0]
 
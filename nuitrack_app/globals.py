@@ -19,17 +19,26 @@ logger = logging.getLogger(__name__)
 # Глобални променливи
 session_running = False         # Дали сесията е активна
 session_start_time = 0          # Време на стартиране на сесията
-current_user_skeleton = None    # Последната заснета скелетна рамка на потребителя
+current_user_skeleton = None    # Последната заснета скелетна рамка на основния потребител
+user_skeletons = ()             # Скелетните рамки на всички видими потребители в последния кадър
+primary_user_id = None          # Nuitrack ID на основния потребител
 exercise_active = False         # Дали упражнението е активно
 current_step = 0                # Индекс на текущата стъпка
 step_start_time = 0             # Време на стартиране на текущата стъпка
 nuitrack_instance = None        # Инстанция на Nuitrack
 depth_to_color_frame = None     # Преобразувана дълбочинна рамка към цветова
 user_metrics = None             # Данни от калибриране (височина, дължина на ръка, ширина на таз)
-previous_user_skeleton = None   # Скелет от предишния кадър за откриване на движение
+user_thresholds = None          # Прагове за разстояния на потребителя (от профила или от калибрирането)
+user_profile = None             # Име на избрания потребителски профил
 calibration_active = False      # Следи дали е активна калибриране
 calibration_start_time = 0      # Време на стартиране на калибриране
 calibration_completed = False   # Следи дали калибрирането е успешно завършено
+calibration_quality = None      # Оценка на качеството на последното калибриране (0-100)
+calibrator = None               # Активното калибриране (StreamingCalibrator), захранвано от етапа за анализ
+compiled_steps = None           # Компилирани планове за оценка на стъпките на текущото упражнение
+compiled_steps_key = None       # (упражнение, метрики, прагове), за които са компилирани плановете
+latest_evaluation = None        # Последната оценка на кадър (PoseEvaluation), споделена от HUD и прогреса
+session_recorder = None         # SkeletonRecorder при включен запис на сесията (NUITRACK_RECORD_DIR)
 
 app = None                      # Основен обект на приложението
 sound_manager = sound_manager   # Мениджър за звукови ефекти
@@ -5,5 +5,6 @@ from preload_exercises import initialize_tts_cache
 globals.app = ModernExerciseApp()  # Създаване на ново приложение и записването му в глобална променлива
 
 initialize_tts_cache() # Зареждане на TTS в background thread
+globals.sound_manager.preload() # Звуковите сигнали се зареждат в паметта преди първото упражнение
 
 globals.app.run() # Стартиране на приложението
\ No newline at end of file
@@ -0,0 +1,186 @@
+import argparse
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+
+from exercises import ALL_EXERCISES
+from utils.batch_scoring import compile_batch_step, evaluate_batch, stack_tolerances
+from utils.calibration import METRIC_NAMES, calculate_tolerances, calculate_user_metrics
+from utils.check_angles import ANGLE_NAMES, check_single_angle, compute_all_angles
+from utils.frame_sources import SYNTHETIC_CONFIDENCE, step_pose
+from utils.joint_smoothing import KalmanSmoother, OneEuroSmoother
+from utils.skeleton_history import HISTORY_CAPACITY, SkeletonHistory
+from utils.skeleton_processing import MAX_USERS, SkeletonFrame, calculate_3d_distance, normalize_skeleton, relative_positions
+from utils.step_compiler import DEFAULT_TOLERANCE, POSE_CHECKERS, compile_step
+from utils.visualization import draw_text
+
+# Разстояние на синтетичния потребител от камерата (мм)
+SUBJECT_DISTANCE = 2500.0
+
+# Прагове по подразбиране: относително забавяне и минимална абсолютна разлика (ns),
+# под която разликата се счита за шум при много бързите функции
+DEFAULT_THRESHOLD = 0.25
+MIN_REGRESSION_NS = 200
+
+# Целево време за едно измерване - броят извиквания се избира автоматично
+TARGET_REPEAT_SECONDS = 0.02
+
+def make_frame(step_data=None):
+    """Фиксиран скелетен кадър в позата на стъпката (без шум)."""
+    frame = SkeletonFrame()
+    frame.data[:, :3] = step_pose(step_data)
+    frame.data[:, 2] += SUBJECT_DISTANCE
+    frame.data[:, 3] = SYNTHETIC_CONFIDENCE
+    frame.valid[:] = True
+    frame.timestamp = 0.0
+    return frame
+
+def build_cases():
+    """Връща списък от (име, функция без аргументи) за всички измервани функции."""
+    neutral = make_frame()
+    metrics = calculate_user_metrics(neutral)
+    tolerances = dict(DEFAULT_TOLERANCE)
+    tolerances_data = calculate_tolerances(tolerances, metrics)
+    cases = []
+
+    # Нормализация и разстояния
+    cases.append(("normalize_skeleton", lambda: normalize_skeleton(neutral)))
+    cases.append(("relative_positions", lambda: relative_positions(neutral.data, neutral.valid)))
+    shoulder, wrist = neutral['RIGHT_SHOULDER'], neutral['RIGHT_WRIST']
+    cases.append(("calculate_3d_distance", lambda: calculate_3d_distance(shoulder, wrist)))
+    cases.append(("calculate_tolerances", lambda: calculate_tolerances(tolerances, metrics)))
+
+    # Всяка проверка на поза върху скелет, изпълняващ позата
+    for pose_name, rule in POSE_CHECKERS.items():
+        pose_frame = make_frame({"required_poses": {pose_name: True}})
+        rel, valid = relative_positions(pose_frame.data, pose_frame.valid), pose_frame.valid
+        cases.append((f"{rule.check.__name__}", lambda rule=rule, rel=rel, valid=valid: rule.evaluate(rel, valid, True, tolerances_data, metrics)))
+
+    # Ъгли
+    angles = compute_all_angles(neutral)
+    cases.append(("compute_all_angles", lambda: compute_all_angles(neutral)))
+    for angle_name in ANGLE_NAMES:
+        cases.append((f"check_single_angle[{angle_name}]", lambda name=angle_name: check_single_angle(name, 160, angles, tolerances)))
+
+    # Оценка на всяка стъпка от всички упражнения с компилираните планове, както в цикъла на кадрите:
+    # един потребител (група от един) и MAX_USERS потребители в позата на стъпката
+    for exercise_index, exercise in enumerate(ALL_EXERCISES):
+        for step_index, step in enumerate(exercise["steps"]):
+            label = f"ex{exercise_index + 1}.step{step_index + 1}"
+            frame = make_frame(step)
+            batch_plan = compile_batch_step(step)
+            tolerances_data = compile_step(step, metrics).tolerances_data
+            for users in (1, MAX_USERS):
+                data = np.repeat(frame.data[None], users, axis=0)
+                valid = np.repeat(frame.valid[None], users, axis=0)
+                batch_metrics = {name: np.full(users, metrics[name]) for name in METRIC_NAMES}
+                batch_tolerances = stack_tolerances([tolerances_data] * users)
+                cases.append((
+                    f"evaluate_batch[{label}, {users} user{'s' if users > 1 else ''}]",
+                    lambda p=batch_plan, data=data, valid=valid, m=batch_metrics, t=batch_tolerances: evaluate_batch(p, data, valid, m, t)
+                ))
+
+    # История на скелета: запис на кадър и изчисления върху пълен буфер
+    history, append_history = SkeletonHistory(), SkeletonHistory()
+    for i in range(HISTORY_CAPACITY):
+        neutral.timestamp = i / 30
+        history.append(neutral)
+    neutral.timestamp = 0.0
+    cases.append(("SkeletonHistory.append", lambda: append_history.append(neutral)))
+    cases.append(("SkeletonHistory.velocity[1s]", lambda: history.velocity(1.0)))
+    cases.append(("SkeletonHistory.jitter[2s]", lambda: history.jitter(2.0)))
+    cases.append(("SkeletonHistory.is_still[1s]", lambda: history.is_still(1.0)))
+
+    # Изглаждане на ставите - кадърът се копира, за да не се променя общият неподвижен скелет
+    for smoother in (OneEuroSmoother(), KalmanSmoother()):
+        smoothed = neutral.copy()
+        def apply_smoother(smoother=smoother, frame=smoothed):
+            frame.timestamp += 1 / 30
+            smoother.apply(frame)
+        cases.append((f"{type(smoother).__name__}.apply", apply_smoother))
+
+    # Рисуване на текст (кеширан и нов текст)
+    image = np.zeros((480, 640, 3), dtype=np.uint8)
+    cases.append(("draw_text[cached]", lambda: draw_text(image, "Сесия: 01:23.45", (10, 30))))
+    counter = iter(range(sys.maxsize))
+    cases.append(("draw_text[uncached]", lambda: draw_text(image, f"Сесия: {next(counter)}", (10, 30))))
+
+    return cases
+
+def measure(func, repeat):
+    """Измерва време за едно извикване (ns): минимум и медиана от `repeat` измервания."""
+    # Автоматичен избор на броя извиквания за едно измерване
+    number = 1
+    while True:
+        start = time.perf_counter_ns()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter_ns() - start
+        if elapsed >= TARGET_REPEAT_SECONDS * 1e9 or number >= 1_000_000:
+            break
+        number *= 10 if elapsed < TARGET_REPEAT_SECONDS * 1e8 else 2
+
+    samples = np.empty(repeat)
+    for i in range(repeat):
+        start = time.perf_counter_ns()
+        for _ in range(number):
+            func()
+        samples[i] = (time.perf_counter_ns() - start) / number
+    return {"min_ns": float(samples.min()), "median_ns": float(np.median(samples)), "number": number}
+
+def run_suite(name_filter=None, repeat=5):
+    """Изпълнява всички (или филтрираните) случаи и връща резултатите по име."""
+    results = {}
+    for name, func in build_cases():
+        if name_filter and name_filter not in name:
+            continue
+        results[name] = measure(func, repeat)
+        print(f"  {name:<45} {results[name]['min_ns'] / 1000:10.2f} µs")
+    return results
+
+def compare(results, baseline, threshold, min_regression_ns=MIN_REGRESSION_NS):
+    """Сравнява с базовите резултати. Връща списък от (име, базово, текущо) за забавените функции."""
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        before, after = base["min_ns"], current["min_ns"]
+        if after > before * (1 + threshold) and after - before > min_regression_ns:
+            regressions.append((name, before, after))
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the per-frame pose checking and drawing functions.")
+    parser.add_argument("--filter", help="run only cases whose name contains this text")
+    parser.add_argument("--repeat", type=int, default=5, help="measurements per case")
+    parser.add_argument("--save-baseline", metavar="PATH", help="write the results as a baseline JSON file")
+    parser.add_argument("--compare", metavar="PATH", help="compare against a baseline JSON file")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="allowed slowdown relative to the baseline (0.25 = 25%%)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run_suite(args.filter, args.repeat)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump({"python": platform.python_version(), "platform": platform.platform(), "cases": results}, f, indent=2, ensure_ascii=False)
+        print(f"Baseline written to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["cases"]
+        regressions = compare(results, baseline, args.threshold)
+        for name, before, after in regressions:
+            print(f"REGRESSION {name}: {before / 1000:.2f} µs -> {after / 1000:.2f} µs ({after / before - 1:+.0%})")
+        if regressions:
+            return 1
+        print(f"No regressions above {args.threshold:.0%} against {args.compare}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,6 @@
 import logging
 import threading
+import time
 import globals
 
 logger = logging.getLogger(__name__)
@@ -56,22 +57,29 @@ class CacheStatus:
 # Глобална инстанция на статуса
 cache_status = CacheStatus()
 
+def _notify_app():
+    """Актуализира статуса в UI, ако приложението е заредено."""
+    if globals.app and hasattr(globals.app, 'update_cache_status'):
+        globals.app.root.after(0, lambda: globals.app.update_cache_status())
+
 def initialize_tts_cache():
     """
     Предварително генерира и кешира всички инструкции от всички упражнения.
     Извиква се веднъж при стартиране на приложението в background thread.
+    Липсващите файлове се генерират паралелно (PREFETCH_WORKERS заявки) през общата HTTP сесия на TTS мениджъра.
     """
+    def on_progress(done, total, generated):
+        cache_status.update_progress(done, total, generated=generated)
+        _notify_app()
+
     def preload_worker():
         try:
             logger.info("🔄 Starting TTS cache initialization...")
             
-            # Събира всички уникални инструкции от всички упражнения
-            all_instructions = []
-            for exercise in globals.ALL_EXERCISES:
-                for step in exercise["steps"]:
-                    instruction_text = step["instructions"]
-                    if instruction_text and instruction_text not in all_instructions:
-                        all_instructions.append(instruction_text)
+            # Събира всички уникални инструкции от всички упражнения (в реда на срещане)
+            all_instructions = list(dict.fromkeys(
+                step["instructions"] for exercise in globals.ALL_EXERCISES for step in exercise["steps"] if step["instructions"]
+            ))
             
             total = len(all_instructions)
             logger.info(f"📝 Found {total} unique instructions to preload")
@@ -83,39 +91,19 @@ def initialize_tts_cache():
             if not globals.tts_manager._lazy_initialize():
                 raise Exception("Failed to initialize TTS manager")
             
-            # Генерира всяка инструкция поотделно с прогрес
-            for idx, text in enumerate(all_instructions, 1):
-                try:
-                    cache_path = globals.tts_manager._get_cache_path(text)
-                    logger.info(f"Cache path: {cache_path}")
-
-                    # Генерира файла ако не съществува
-                    if not os.path.exists(cache_path):
-                        logger.info(f"[{idx}/{total}] Generating: {text[:40]}...")
-                        globals.tts_manager._generate_audio_file(text, cache_path)
-                    else:
-                        logger.debug(f"[{idx}/{total}] Already cached: {text[:40]}...")
-                    
-                    # Запазва пътя в паметта
-                    globals.tts_manager.preloaded_audio[text] = cache_path
-                    
-                    # Актуализира прогреса
-                    cache_status.update_progress(idx, total, generated=not os.path.exists(cache_path))
-                    
-                    # Актуализира UI ако приложението е заредено
-                    if globals.app and hasattr(globals.app, 'update_cache_status'):
-                        globals.app.root.after(0, lambda: globals.app.update_cache_status())
-                    
-                except Exception as e:
-                    logger.error(f"[{idx}/{total}] Error preloading '{text[:30]}...': {e}")
+            started = time.perf_counter()
+            failed = globals.tts_manager.prefetch(all_instructions, on_progress=on_progress)
             
             # Маркира завършването
-            cache_status.finish()
-            logger.info(f"✅ TTS cache initialization complete - {total} instructions ready!")
+            cache_status.finish(error=f"{failed} от {total} инструкции не са генерирани" if failed else None)
+            logger.info(f"✅ TTS cache initialization complete - {total - failed}/{total} instructions ready "
+                        f"({cache_status.files_generated} generated in {time.perf_counter() - started:.1f}s)")
+            
+            # Инструкциите на избраното упражнение се декодират в паметта
+            globals.tts_manager.preload_exercise(globals.EXERCISE_JSON)
             
             # Финална актуализация на UI
-            if globals.app and hasattr(globals.app, 'update_cache_status'):
-                globals.app.root.after(0, lambda: globals.app.update_cache_status())
+            _notify_app()
             
         except Exception as e:
             error_msg = str(e)
@@ -123,11 +111,8 @@ def initialize_tts_cache():
             cache_status.finish(error=error_msg)
             
             # Актуализира UI с грешката
-            if globals.app and hasattr(globals.app, 'update_cache_status'):
-                globals.app.root.after(0, lambda: globals.app.update_cache_status())
+            _notify_app()
     
     # Стартира в background thread за да не блокира UI
     threading.Thread(target=preload_worker, daemon=True).start()
     logger.info("🚀 TTS cache initialization started in background")
-
-import os  # Добавяме импорта тук за _get_cache_path
\ No newline at end of file
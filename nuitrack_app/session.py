@@ -2,12 +2,15 @@ import custom_messagebox as messagebox
 import threading
 import time
 
+from utils.calibration import cancel_calibration
+from utils.exercise_logic import step_progress, user_tracker
+
 import globals
 
 _last_toggle_time = 0
 _TOGGLE_DEBOUNCE = 1.0  # минимум 1 секунда между натисканията на бутона
 
-def start_session(update_timer_display, run_nuitrack, app):
+def start_session(run_nuitrack, app):
     """Започва нова сесия на Nuitrack програмата."""
 
     if globals.session_running:
@@ -17,19 +20,22 @@ def start_session(update_timer_display, run_nuitrack, app):
     globals.session_start_time = time.time()
     globals.session_running = True
     
-    threading.Thread(target=update_timer_display, daemon=True).start()
     threading.Thread(target=run_nuitrack, daemon=True).start()
     
     app.start_btn.config(state="disabled")
     app.stop_btn.config(state="normal")
     app.exercise_btn.config(state="normal")
 
+    # Избраният профил се проверява, щом потребителят застане пред камерата
+    if globals.user_profile:
+        app.verify_profile()
+
 def stop_session(app):
     """Прекратява текуща сесия на Nuitrack програмата."""
 
     globals.session_running = False
     globals.exercise_active = False
-    globals.calibration_active = False 
+    cancel_calibration()
     globals.current_step = 0
     globals.session_start_time = 0
     globals.nuitrack_instance = None
@@ -40,6 +46,7 @@ def stop_session(app):
     app.start_btn.config(state="normal")
     app.stop_btn.config(state="disabled") 
     app.exercise_btn.config(state="disabled", text="Стартиране на упражнение", bg="blue")
+    app.calibrate_btn.config(state="normal", text="Стартиране на калибриране")
 
 def toggle_exercise(app):
     """
@@ -78,7 +85,10 @@ def toggle_exercise(app):
             globals.exercise_active = True
             globals.current_step = 0
             globals.step_start_time = time.time()
+            step_progress.reset()
+            user_tracker.restart_exercise()
             app.exercise_btn.config(text="Спиране на упражнението", bg="red")
+            app.accuracy_label.config(text="")
             print("=== EXERCISE STARTED WITH RELATIVE POSES ===")
 
             # Четене на новите инструкции на първата стъпка
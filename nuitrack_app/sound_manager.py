@@ -1,7 +1,10 @@
 import os
 import logging
-import threading
 import sys
+import time
+
+from audio_engine import audio_engine
+from utils.trace import tracer
 
 logger = logging.getLogger(__name__)
 
@@ -12,9 +15,10 @@ class SoundManager:
         self.initialized = False
         self.step_complete_path = None
         self.exercise_complete_path = None
-        self.pygame_mixer = None
+        self.audio_engine = None
         self.winsound = None
         self.playback_method = None
+        self.cue_paths = set()  # Cue files that exist - checked once here, not on every play
         
         # Prepare paths but don't initialize yet
         base_dir = os.path.dirname(os.path.abspath(__file__))
@@ -23,21 +27,34 @@ class SoundManager:
         
         # Log file existence
         if os.path.exists(self.step_complete_path):
+            self.cue_paths.add(self.step_complete_path)
             logger.info(f"Found step_complete_sound.wav")
         else:
             logger.warning(f"step_complete_sound.wav not found at {self.step_complete_path}")
             
         if os.path.exists(self.exercise_complete_path):
+            self.cue_paths.add(self.exercise_complete_path)
             logger.info(f"Found exercise_calibration_complete_sound.wav")
         else:
             logger.warning(f"exercise_calibration_complete_sound.wav not found at {self.exercise_complete_path}")
     
     def _lazy_initialize(self):
-        """Initialize sound system only when first needed"""
+        """Initialize sound system only when first needed and have the audio engine decode the cues into memory"""
         if self.initialized:
             return True
+        
+        # pygame first - the shared audio engine owns the mixer and plays the cues from memory
+        if audio_engine.start():
+            self.audio_engine = audio_engine
+            self.playback_method = 'pygame'
+            self.initialized = True
+            # Decoded on the engine thread, ahead of the first play
+            self.audio_engine.preload_effects(self.cue_paths)
+            logger.info("Using pygame.mixer for audio playback")
+            return True
+        logger.warning("pygame.mixer initialization failed")
             
-        # Try winsound first (Windows built-in, no dependencies)
+        # Try winsound as fallback (Windows built-in, plays from the file on every call)
         if sys.platform == 'win32':
             try:
                 import winsound
@@ -49,65 +66,61 @@ class SoundManager:
             except ImportError:
                 logger.debug("winsound not available")
         
-        # Try pygame as fallback
-        try:
-            import pygame.mixer
-            pygame.mixer.init(frequency=22050, size=-16, channels=2, buffer=512)
-            self.pygame_mixer = pygame.mixer
-            self.playback_method = 'pygame'
-            self.initialized = True
-            logger.info("Using pygame.mixer for audio playback")
-            return True
-        except Exception as e:
-            logger.warning(f"pygame.mixer initialization failed: {e}")
-        
         logger.error("No audio playback method available. Sounds will be disabled.")
         return False
     
-    def _play_sound_threaded(self, sound_path, sound_name):
-        """Play sound in a separate thread to avoid blocking"""
-        def _play():
-            try:
-                if not os.path.exists(sound_path):
-                    logger.debug(f"{sound_name} not found: {sound_path}")
-                    return
-                
-                if not self._lazy_initialize():
-                    return
+    def preload(self):
+        """Initialize the sound system and load the cues ahead of the first play (e.g. at startup)"""
+        return self._lazy_initialize()
+    
+    def _record_latency(self, latency):
+        # Imported here: utils.perf imports globals, which imports this module
+        from utils.perf import CUE_LATENCY, perf_monitor
+        perf_monitor.record(CUE_LATENCY, latency)
+    
+    def _play_sound(self, sound_path, sound_name):
+        """Start a sound without blocking: pygame cues play from memory on the audio engine, winsound asynchronously"""
+        try:
+            if not self._lazy_initialize():
+                return
+            
+            if sound_path not in self.cue_paths:
+                logger.debug(f"{sound_name} not found: {sound_path}")
+                return
+            
+            if self.playback_method == 'pygame' and self.audio_engine:
+                # The engine plays the cue from its in-memory bank
+                self.audio_engine.play_effect(sound_path, sound_name, on_started=self._record_latency)
+                logger.debug(f"Queued {sound_name} for pygame")
                 
-                if self.playback_method == 'winsound' and self.winsound:
+            elif self.playback_method == 'winsound' and self.winsound:
+                start = time.perf_counter()
+                with tracer.span("sound_play", "sound", {"sound": sound_name}):
                     # SND_ASYNC plays sound asynchronously (non-blocking)
                     self.winsound.PlaySound(
                         sound_path, 
                         self.winsound.SND_FILENAME | self.winsound.SND_ASYNC
                     )
-                    logger.debug(f"Played {sound_name} with winsound")
-                    
-                elif self.playback_method == 'pygame' and self.pygame_mixer:
-                    sound = self.pygame_mixer.Sound(sound_path)
-                    sound.play()
-                    logger.debug(f"Played {sound_name} with pygame")
-                    
-            except Exception as e:
-                logger.error(f"Error playing {sound_name}: {e}")
-        
-        # Play in background thread to avoid blocking
-        thread = threading.Thread(target=_play, daemon=True)
-        thread.start()
+                # Only the call itself is timed - winsound gives no way to see when the sound is heard
+                self._record_latency(time.perf_counter() - start)
+                logger.debug(f"Played {sound_name} with winsound")
+                
+        except Exception as e:
+            logger.error(f"Error playing {sound_name}: {e}")
     
     def play_step_complete(self):
         """Play sound when a step is completed"""
-        self._play_sound_threaded(self.step_complete_path, "step completion sound")
+        self._play_sound(self.step_complete_path, "step completion sound")
     
     def play_exercise_complete(self):
         """Play sound when the entire exercise is completed"""
-        self._play_sound_threaded(self.exercise_complete_path, "exercise completion sound")
+        self._play_sound(self.exercise_complete_path, "exercise completion sound")
     
     def stop_all(self):
         """Stop all currently playing sounds"""
         try:
-            if self.playback_method == 'pygame' and self.pygame_mixer and self.initialized:
-                self.pygame_mixer.stop()
+            if self.playback_method == 'pygame' and self.audio_engine and self.initialized:
+                self.audio_engine.stop()
                 logger.debug("Stopped all pygame sounds")
             elif self.playback_method == 'winsound' and self.winsound:
                 # Stop winsound playback
@@ -119,8 +132,8 @@ class SoundManager:
     def cleanup(self):
         """Clean up sound resources"""
         try:
-            if self.playback_method == 'pygame' and self.pygame_mixer and self.initialized:
-                self.pygame_mixer.quit()
+            if self.playback_method == 'pygame' and self.audio_engine and self.initialized:
+                self.audio_engine.shutdown()
                 self.initialized = False
                 logger.info("pygame.mixer cleaned up")
         except Exception as e:
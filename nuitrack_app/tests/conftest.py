@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Модулите на приложението се импортират като в main.py - от директорията nuitrack_app
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Без звукова карта - pygame миксерът работи с празен драйвер
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
@@ -0,0 +1,41 @@
+import os
+import threading
+
+import pytest
+
+from audio_engine import AudioEngine
+
+CUE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "step_complete_sound.wav")
+
+@pytest.fixture
+def engine():
+    engine = AudioEngine()
+    if not engine.start():
+        pytest.skip("pygame mixer unavailable")
+    yield engine
+    engine.shutdown()
+
+def test_effects_are_decoded_once_on_the_engine_thread(engine, monkeypatch):
+    decoded_on = []
+    load = engine.effects.load
+    def recording_load(key, path):
+        decoded_on.append(threading.current_thread().name)
+        return load(key, path)
+    monkeypatch.setattr(engine.effects, "load", recording_load)
+
+    started = threading.Event()
+    engine.preload_effects([CUE_PATH])
+    engine.play_effect(CUE_PATH, "cue", on_started=lambda latency: started.set())
+
+    assert started.wait(timeout=2.0)
+    assert decoded_on == ["audio_engine", "audio_engine"]
+    # Вторият път звукът е взет от банката, без ново декодиране
+    assert len(engine.effects) == 1
+    assert engine.effects.hits == 1
+
+def test_missing_effect_is_skipped(engine, tmp_path):
+    started = threading.Event()
+    engine.play_effect(str(tmp_path / "missing.wav"), "missing", on_started=lambda latency: started.set())
+    engine.stop()
+    assert not started.is_set()
+    assert len(engine.effects) == 0
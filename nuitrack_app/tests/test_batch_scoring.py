@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+
+from exercises import ALL_EXERCISES
+from utils.batch_scoring import batch_feedback, compile_batch_step, evaluate_batch, stack_tolerances
+from utils.calibration import calculate_user_metrics
+from utils.frame_sources import SYNTHETIC_CONFIDENCE, step_pose
+from utils.skeleton_processing import JOINT_COUNT, JointIndex, SkeletonFrame, relative_positions
+from utils.step_compiler import POSE_CHECKERS, angle_feedback, compile_step
+
+USERS = 6
+
+EXERCISE_STEPS = [step for exercise in ALL_EXERCISES for step in exercise["steps"]]
+
+def _steps():
+    steps = list(EXERCISE_STEPS)
+    # Всяка поза и като изискана, и като неизискана, плюс непознат ъгъл
+    for name in POSE_CHECKERS:
+        for required in (True, False):
+            steps.append({"required_poses": {name: required}, "target_angles": {"right_arm_angle": 90, "left_elbow_angle": 150, "bogus_angle": 10}})
+    return steps
+
+def _step_id(step):
+    return step.get("name") or "/".join(step["required_poses"])
+
+def _noisy_users(step, rng):
+    """Кадри на USERS потребители около позата на стъпката, с шум и изгубени стави."""
+    data = np.zeros((USERS, JOINT_COUNT, 4), dtype=np.float32)
+    data[..., :3] = step_pose(step if "duration_seconds" in step else None) + rng.normal(0, 60, (USERS, JOINT_COUNT, 3))
+    data[..., 2] += 2500
+    valid = rng.random((USERS, JOINT_COUNT)) > 0.1
+    data[..., 3] = np.where(valid, 0.75, 0.1)
+    metrics = [
+        {"height": 1700 + rng.normal(0, 50), "arm_length": 540 + rng.normal(0, 20), "hip_width": 200.0, "shoulder_width": 360.0, "leg_length": 450.0}
+        for _ in range(USERS)
+    ]
+    return data, valid, metrics
+
+def _evaluate(plan, step, data, valid, metrics):
+    batch_metrics = {name: np.array([user_metrics[name] for user_metrics in metrics]) for name in metrics[0]}
+    tolerances_data = stack_tolerances([compile_step(step, user_metrics).tolerances_data for user_metrics in metrics])
+    return evaluate_batch(plan, data, valid, batch_metrics, tolerances_data)
+
+@pytest.mark.parametrize("step", _steps(), ids=_step_id)
+def test_users_are_scored_independently(step):
+    rng = np.random.default_rng(0)
+    data, valid, metrics = _noisy_users(step, rng)
+    plan = compile_batch_step(step)
+    evaluation = _evaluate(plan, step, data, valid, metrics)
+
+    # Оценката на всеки ред е същата като на група от един потребител
+    for user in range(USERS):
+        single = _evaluate(plan, step, data[user:user + 1], valid[user:user + 1], metrics[user:user + 1])
+        assert evaluation.accuracy[user] == pytest.approx(single.accuracy[0], abs=1e-9)
+        assert evaluation.all_ok[user] == single.all_ok[0]
+        assert batch_feedback(plan, evaluation, user, valid) == batch_feedback(plan, single, 0, valid[user:user + 1])
+
+@pytest.mark.parametrize("step", _steps(), ids=_step_id)
+def test_accuracy_combines_every_check(step):
+    rng = np.random.default_rng(1)
+    data, valid, metrics = _noisy_users(step, rng)
+    plan = compile_batch_step(step)
+    evaluation = _evaluate(plan, step, data, valid, metrics)
+
+    for user in range(USERS):
+        rel = relative_positions(data[user], valid[user])
+        tolerances_data = compile_step(step, metrics[user]).tolerances_data
+        # Правилата на позите върху един потребител и ъглите през angle_feedback
+        scores = [
+            100.0 * POSE_CHECKERS[name].evaluate(rel, valid[user], plan.required_poses[name], tolerances_data, metrics[user])[0]
+            for name in plan.pose_names
+        ]
+        for check in plan.angle_checks:
+            _, score, _ = angle_feedback(check.name, check.target, check.joints, evaluation.angles[user], valid[user], plan.tolerances)
+            scores.append(score)
+        assert evaluation.accuracy[user] == pytest.approx(np.mean(scores) if scores else 0.0, abs=1e-9)
+        assert bool(evaluation.all_ok[user]) == all(feedback["ok"] for feedback in batch_feedback(plan, evaluation, user, valid).values())
+
+@pytest.mark.parametrize("step", EXERCISE_STEPS, ids=_step_id)
+def test_step_pose_passes_its_step(step):
+    frame = SkeletonFrame()
+    frame.data[:, :3] = step_pose(step)
+    frame.data[:, 2] += 2500
+    frame.data[:, 3] = SYNTHETIC_CONFIDENCE
+    frame.valid[:] = True
+
+    evaluation = _evaluate(compile_batch_step(step), step, frame.data[None], frame.valid[None], [calculate_user_metrics(frame)])
+    assert evaluation.all_ok[0]
+    assert evaluation.accuracy[0] == pytest.approx(100.0)
+
+def test_angle_feedback_messages():
+    step = {"required_poses": {}, "target_angles": {"right_arm_angle": 90, "bogus_angle": 10}}
+    frame = SkeletonFrame()
+    frame.data[:, :3] = step_pose(None)
+    frame.data[:, 2] += 2500
+    frame.data[:, 3] = SYNTHETIC_CONFIDENCE
+    frame.valid[:] = True
+    plan = compile_batch_step(step)
+    metrics = calculate_user_metrics(frame)
+
+    feedback = batch_feedback(plan, _evaluate(plan, step, frame.data[None], frame.valid[None], [metrics]), 0, frame.valid[None])
+    assert feedback["bogus_angle"] == {"ok": False, "msg": "bogus_angle: Not detected ✗"}
+
+    frame.valid[JointIndex.RIGHT_WRIST] = False
+    feedback = batch_feedback(plan, _evaluate(plan, step, frame.data[None], frame.valid[None], [metrics]), 0, frame.valid[None])
+    assert feedback["right_arm_angle"] == {"ok": False, "msg": "✗ Няма скелетни данни"}
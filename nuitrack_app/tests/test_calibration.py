@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from utils.calibration import StreamingCalibrator
+from utils.frame_sources import step_pose
+from utils.skeleton_processing import JOINT_COUNT, JointIndex, SkeletonFrame
+
+FPS = 30.0
+
+def _frame(pose, rng, noise=3.0):
+    frame = SkeletonFrame()
+    frame.data[:, :3] = pose + rng.normal(0, noise, (JOINT_COUNT, 3))
+    frame.data[:, 3] = 0.9
+    frame.valid[:] = True
+    return frame
+
+def _run(calibrator, frames):
+    for index, frame in enumerate(frames):
+        if calibrator.add_frame(frame, index / FPS):
+            break
+    return calibrator.result()
+
+def test_steady_user_converges_early():
+    rng = np.random.default_rng(0)
+    pose = step_pose()
+    result = _run(StreamingCalibrator(0.0), (_frame(pose, rng) for _ in range(int(5 * FPS))))
+
+    assert result.converged
+    assert 1.0 <= result.duration < 5.0
+    assert result.rejected == 0
+    height = pose[JointIndex.HEAD, 1] - pose[JointIndex.LEFT_ANKLE, 1]
+    assert result.metrics["height"] == pytest.approx(height, abs=5)
+    assert result.quality > 50
+
+def test_outlier_frames_are_rejected():
+    rng = np.random.default_rng(1)
+    pose = step_pose()
+    calibrator = StreamingCalibrator(0.0)
+    frames = [_frame(pose, rng) for _ in range(20)]
+    # Грешно засечена глава - височината скача с 400 мм
+    glitch = _frame(pose, rng)
+    glitch.data[JointIndex.HEAD, 1] += 400
+    frames.insert(12, glitch)
+    for index, frame in enumerate(frames):
+        calibrator.add_frame(frame, index / FPS)
+
+    result = calibrator.result()
+    assert result.rejected == 1
+    assert result.samples == 20
+    height = pose[JointIndex.HEAD, 1] - pose[JointIndex.LEFT_ANKLE, 1]
+    assert result.metrics["height"] == pytest.approx(height, abs=5)
+
+def test_missing_joints_time_out_without_metrics():
+    rng = np.random.default_rng(2)
+    pose = step_pose()
+    frames = []
+    for _ in range(int(6 * FPS)):
+        frame = _frame(pose, rng)
+        frame.valid[JointIndex.LEFT_ANKLE] = False
+        frames.append(frame)
+    result = _run(StreamingCalibrator(0.0), frames)
+
+    assert not result.converged
+    assert result.duration == pytest.approx(5.0, abs=1 / FPS)
+    assert result.samples == 0
+    assert result.metrics is None
+    assert "LEFT_ANKLE" in result.missing_joints
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from utils.frame_sources import FrameSource, ReplaySource, SyntheticSource
+from utils.session_recording import SkeletonRecorder
+from utils.skeleton_processing import JOINT_COUNT, SkeletonFrame
+
+def _write_recording(path, count=10, fps=30.0):
+    with SkeletonRecorder(str(path)) as recorder:
+        for index in range(count):
+            frame = SkeletonFrame()
+            frame.data[:, :3] = np.arange(JOINT_COUNT)[:, None] * 10.0
+            frame.data[:, 3] = 0.9
+            frame.timestamp = 100.0 + index / fps
+            frame.user_id = 1
+            recorder.append(frame)
+
+def test_replay_timestamps_increase_across_loops(tmp_path):
+    path = tmp_path / "loop.mskel"
+    _write_recording(path)
+    source = ReplaySource(str(path), realtime=False)
+    timestamps = []
+    for _ in range(35):
+        source.update()
+        timestamps.append(source.get_skeleton().timestamp)
+    steps = np.diff(timestamps)
+    assert (steps > 0).all()
+    # Между повторенията е един кадър, както между съседните кадри
+    assert steps == pytest.approx(1e6 / 30, abs=2)
+
+def test_replay_without_loop_ends_with_no_skeletons(tmp_path):
+    path = tmp_path / "once.mskel"
+    _write_recording(path, count=3)
+    source = ReplaySource(str(path), realtime=False, loop=False)
+    for _ in range(4):
+        source.update()
+    assert source.get_skeleton().skeletons == []
+
+def test_incomplete_source_fails_on_creation():
+    class Incomplete(FrameSource):
+        def update(self):
+            pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+def test_synthetic_source_users():
+    source = SyntheticSource(users=3, realtime=False, seed=0)
+    source.update()
+    assert [skeleton.user_id for skeleton in source.get_skeleton().skeletons] == [1, 2, 3]
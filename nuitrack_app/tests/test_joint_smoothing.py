@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+
+from utils.joint_smoothing import MAX_GAP_SECONDS, KalmanSmoother, OneEuroSmoother, create_joint_smoother, smoothing_name
+from utils.skeleton_processing import CONFIDENCE, JOINT_COUNT, JointIndex, SkeletonFrame
+
+FPS = 30.0
+WRIST = JointIndex.RIGHT_WRIST
+
+SMOOTHERS = [OneEuroSmoother, KalmanSmoother]
+
+def test_smoothing_is_off_by_default(monkeypatch):
+    monkeypatch.delenv("NUITRACK_SMOOTHING", raising=False)
+    assert create_joint_smoother() is None
+    assert smoothing_name() == "off"
+
+def test_smoothing_enabled_by_env(monkeypatch):
+    monkeypatch.setenv("NUITRACK_SMOOTHING", "kalman")
+    assert isinstance(create_joint_smoother(), KalmanSmoother)
+    assert isinstance(create_joint_smoother("one_euro"), OneEuroSmoother)
+
+def test_unknown_smoothing_is_disabled():
+    assert create_joint_smoother("median") is None
+
+def _frame(index, position, confidence=0.9, user_id=1, valid=None):
+    """Кадър, в който всички стави са в `position` (мм)."""
+    frame = SkeletonFrame()
+    frame.data[:, :3] = position
+    frame.data[:, CONFIDENCE] = confidence
+    frame.valid[:] = True if valid is None else valid
+    frame.user_id = user_id
+    frame.timestamp = index / FPS
+    return frame
+
+def _settle(smoother, frames=60, position=(0.0, 0.0, 2500.0)):
+    for index in range(frames):
+        smoother.apply(_frame(index, position))
+    return frames
+
+@pytest.mark.parametrize("smoother_type", SMOOTHERS)
+def test_jitter_is_reduced_on_static_joint(smoother_type):
+    rng = np.random.default_rng(0)
+    smoother = smoother_type()
+    raw, smoothed = [], []
+    for index in range(150):
+        position = np.array([0.0, 0.0, 2500.0]) + rng.normal(0, 10, 3)
+        frame = _frame(index, position)
+        smoother.apply(frame)
+        if index >= 30:
+            raw.append(position)
+            smoothed.append(frame.data[WRIST, :3].copy())
+    assert (np.std(smoothed, axis=0) < 0.6 * np.std(raw, axis=0)).all()
+
+@pytest.mark.parametrize("smoother_type", SMOOTHERS)
+def test_low_confidence_samples_move_the_joint_less(smoother_type):
+    moves = {}
+    for confidence in (0.45, 1.0):
+        smoother = smoother_type()
+        index = _settle(smoother)
+        frame = _frame(index, (100.0, 0.0, 2500.0), confidence=confidence)
+        smoother.apply(frame)
+        moves[confidence] = frame.data[WRIST, 0]
+    assert 0 < moves[0.45] < 0.5 * moves[1.0]
+
+@pytest.mark.parametrize("smoother_type", SMOOTHERS)
+def test_lost_joint_is_predicted_until_max_gap(smoother_type):
+    smoother = smoother_type()
+    # Ставата се движи с постоянна скорост, после сензорът я губи
+    speed = 300.0
+    for index in range(60):
+        smoother.apply(_frame(index, (speed * index / FPS, 0.0, 2500.0)))
+    last_x = smoother.position[WRIST, 0]
+
+    lost = np.ones(JOINT_COUNT, dtype=bool)
+    lost[WRIST] = False
+    gap_frames = int(MAX_GAP_SECONDS * FPS)
+    for offset in range(1, gap_frames + 1):
+        frame = _frame(59 + offset, (0.0, 0.0, 0.0), valid=lost)
+        predicted = smoother.apply(frame)
+        assert predicted[WRIST] and frame.valid[WRIST]
+        assert frame.data[WRIST, CONFIDENCE] == pytest.approx(0.9)
+    # Предсказаната позиция продължава движението
+    assert frame.data[WRIST, 0] > last_x
+
+    frame = _frame(60 + gap_frames, (0.0, 0.0, 0.0), valid=lost)
+    predicted = smoother.apply(frame)
+    assert not predicted[WRIST] and not frame.valid[WRIST]
+    assert not smoother.tracked[WRIST]
+
+@pytest.mark.parametrize("smoother_type", SMOOTHERS)
+def test_state_resets_when_user_changes(smoother_type):
+    smoother = smoother_type()
+    index = _settle(smoother)
+
+    # Друг потребител на друго място: позицията му не се смесва с тази на предишния,
+    # а изгубената му става не се предсказва от състоянието на предишния
+    lost = np.ones(JOINT_COUNT, dtype=bool)
+    lost[WRIST] = False
+    frame = _frame(index, (500.0, 100.0, 2000.0), user_id=2, valid=lost)
+    predicted = smoother.apply(frame)
+
+    assert not predicted.any() and not frame.valid[WRIST]
+    assert frame.data[lost, :3] == pytest.approx(np.tile([500.0, 100.0, 2000.0], (JOINT_COUNT - 1, 1)))
+    assert smoother.user_id == 2
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from utils.session_recording import SkeletonRecorder, SkeletonRecordingReader
+from utils.skeleton_processing import JOINT_COUNT, SkeletonFrame
+
+def _frame(index):
+    frame = SkeletonFrame()
+    frame.data[:] = np.arange(JOINT_COUNT * 4, dtype=np.float32).reshape(JOINT_COUNT, 4) + index
+    frame.data[:, 3] = 0.9
+    frame.data[index % JOINT_COUNT, 3] = 0.0  # Една незасечена става
+    frame.projection[:] = index
+    frame.timestamp = index / 30
+    frame.user_id = 1
+    return frame
+
+@pytest.fixture
+def recording(tmp_path):
+    path = tmp_path / "session.mskel"
+    with SkeletonRecorder(str(path)) as recorder:
+        for index in range(5):
+            recorder.append(_frame(index))
+    return str(path)
+
+def test_round_trip(recording):
+    reader = SkeletonRecordingReader(recording)
+    assert len(reader) == 5
+    for index, frame in enumerate(reader):
+        expected = _frame(index)
+        np.testing.assert_array_equal(frame.data, expected.data)
+        np.testing.assert_array_equal(frame.projection, expected.projection)
+        assert frame.timestamp == pytest.approx(expected.timestamp)
+        assert frame.user_id == 1
+        assert not frame.valid[index % JOINT_COUNT] and frame.valid.sum() == JOINT_COUNT - 1
+
+def test_seek_time(recording):
+    reader = SkeletonRecordingReader(recording)
+    assert reader.seek_time(2 / 30) == 2
+    assert reader.seek_time(10.0) == 5
+
+def test_frames_reuse_one_object(recording):
+    reader = SkeletonRecordingReader(recording)
+    assert len({id(frame) for frame in reader.frames(reuse=True)}) == 1
+    assert len({id(frame) for frame in list(reader.frames())}) == 5
+
+def test_interrupted_recording(recording):
+    # Без затваряне заглавието не е обновено - четат се само целите записи
+    with open(recording, 'ab') as f:
+        f.write(b'\0' * 7)
+    assert len(SkeletonRecordingReader(recording)) == 5
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "other.mskel"
+    path.write_bytes(b'not a recording' * 4)
+    with pytest.raises(ValueError):
+        SkeletonRecordingReader(str(path))
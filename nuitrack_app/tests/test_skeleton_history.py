@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from utils.skeleton_history import SkeletonHistory
+from utils.skeleton_processing import JOINT_COUNT, JointIndex, SkeletonFrame
+
+FPS = 30.0
+
+def _frame(index, user_id=1, offset=0.0):
+    frame = SkeletonFrame()
+    frame.data[:, :3] = np.arange(JOINT_COUNT)[:, None] * 10.0 + offset
+    frame.data[:, 3] = 0.9
+    frame.valid[:] = True
+    frame.user_id = user_id
+    frame.timestamp = index / FPS
+    return frame
+
+def test_window_is_chronological_after_wrap_around():
+    history = SkeletonHistory(capacity=8)
+    for index in range(13):
+        history.append(_frame(index, offset=index))
+
+    positions, valid, timestamps = history.window()
+    assert len(history) == 8
+    assert timestamps == pytest.approx(np.arange(5, 13) / FPS)
+    assert positions[:, 0, 0] == pytest.approx(np.arange(5, 13))
+    assert valid.all()
+    assert len(history.window(seconds=3.5 / FPS)[2]) == 4
+    assert len(history.window(frames=3)[2]) == 3
+
+def test_velocity_of_uniform_motion():
+    history = SkeletonHistory()
+    # 2 мм на кадър = 60 мм/s по всяка ос
+    for index in range(10):
+        history.append(_frame(index, offset=2.0 * index))
+
+    velocity, ok = history.velocity()
+    assert ok.all()
+    assert velocity == pytest.approx(np.full((9, JOINT_COUNT, 3), 60.0), rel=1e-4)
+    assert history.speed() == pytest.approx(np.full(JOINT_COUNT, 60.0 * np.sqrt(3)), rel=1e-4)
+    acceleration, ok = history.acceleration()
+    assert ok.all()
+    assert np.abs(acceleration).max() < 1e-2
+
+def test_missing_joint_is_excluded():
+    history = SkeletonHistory()
+    for index in range(5):
+        frame = _frame(index, offset=index)
+        frame.valid[JointIndex.HEAD] = index % 2 == 0
+        history.append(frame)
+
+    _, ok = history.velocity()
+    assert not ok[:, JointIndex.HEAD].any()
+    assert np.isnan(history.speed()[JointIndex.HEAD])
+
+def test_jitter_and_stillness():
+    rng = np.random.default_rng(0)
+    history = SkeletonHistory()
+    for index in range(60):
+        frame = _frame(index)
+        frame.data[:, :3] += rng.normal(0, 5.0, (JOINT_COUNT, 3))
+        history.append(frame)
+
+    assert np.median(history.jitter()) == pytest.approx(5.0, rel=0.2)
+    assert history.is_still(1.0)
+    # Прозорецът трябва да е покрит изцяло
+    assert not history.is_still(3.0)
+
+    for index in range(60, 90):
+        history.append(_frame(index, offset=20.0 * (index - 60)))
+    assert not history.is_still(1.0)
+
+def test_new_user_starts_new_history():
+    history = SkeletonHistory()
+    for index in range(5):
+        history.append(_frame(index))
+    history.append(_frame(5, user_id=2))
+
+    assert len(history) == 1
+    assert history.user_id == 2
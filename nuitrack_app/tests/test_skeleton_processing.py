@@ -0,0 +1,78 @@
+import pytest
+
+import globals
+from utils import skeleton_processing
+from utils.frame_sources import SyntheticSource
+from utils.nuitrack_runner import AnalyzedFrame, release_analyzed
+from utils.pipeline import DropOldestQueue
+from utils.skeleton_processing import (MAX_USERS, RENDER_QUEUE_SIZE, _FRAME_POOL_SETS, hold_frame, process_skeleton_data,
+                                       release_all_frames, release_frame)
+
+@pytest.fixture
+def source():
+    release_all_frames()
+    yield SyntheticSource(users=MAX_USERS, realtime=False, seed=0)
+    release_all_frames()
+
+def _next_frames(source):
+    source.update()
+    process_skeleton_data(source.get_skeleton())
+    return globals.user_skeletons
+
+def _snapshot(frame):
+    return frame.data.copy(), frame.timestamp, frame.user_id
+
+def _assert_unchanged(frame, snapshot):
+    data, timestamp, user_id = snapshot
+    assert (frame.data == data).all()
+    assert frame.timestamp == timestamp
+    assert frame.user_id == user_id
+
+def test_pool_keeps_frames_in_flight(source):
+    passes = []
+    # Записваният кадър, чакащите в опашката към рисуването и рисуваният в момента
+    for _ in range(RENDER_QUEUE_SIZE + 2):
+        frames = _next_frames(source)
+        passes.append((frames, [_snapshot(frame) for frame in frames]))
+
+    in_flight = [frame for frames, _ in passes for frame in frames]
+    assert len({id(frame) for frame in in_flight}) == len(in_flight)
+    for frames, snapshots in passes:
+        for frame, snapshot in zip(frames, snapshots):
+            _assert_unchanged(frame, snapshot)
+
+def test_held_frame_survives_slow_consumer(source):
+    _next_frames(source)
+    drawn = globals.current_user_skeleton
+    hold_frame(drawn)
+    snapshot = _snapshot(drawn)
+
+    # Рисуването "блокира", докато анализът минава през пула няколко пъти
+    for _ in range(3 * _FRAME_POOL_SETS):
+        frames = _next_frames(source)
+        assert all(frame is not drawn for frame in frames)
+    _assert_unchanged(drawn, snapshot)
+
+    # След освобождаване наборът отново се използва
+    release_frame(drawn)
+    assert any(drawn in _next_frames(source) for _ in range(_FRAME_POOL_SETS))
+
+def test_dropped_frames_return_to_pool(source):
+    render_queue = DropOldestQueue(RENDER_QUEUE_SIZE, on_drop=release_analyzed)
+    _next_frames(source)
+    drawn = globals.current_user_skeleton
+    hold_frame(drawn)
+    snapshot = _snapshot(drawn)
+
+    # Анализът пълни опашката много по-бързо, отколкото се рисува - старите кадри се изхвърлят
+    for _ in range(10 * _FRAME_POOL_SETS):
+        _next_frames(source)
+        hold_frame(globals.current_user_skeleton)
+        render_queue.put(AnalyzedFrame(None, globals.current_user_skeleton, None))
+
+    _assert_unchanged(drawn, snapshot)
+    # Изхвърлените кадри са освободени, затова пулът не е нараснал
+    assert len(skeleton_processing._frame_pool) == _FRAME_POOL_SETS
+    assert len(render_queue) == RENDER_QUEUE_SIZE
+    render_queue.clear()
+    release_frame(drawn)
@@ -0,0 +1,94 @@
+import os
+
+import tts_cache
+from tts_cache import TTSCache, cache_key, legacy_file_name
+
+def _add(cache, text, size):
+    key = cache_key(text, "model", "voice", "", "mp3")
+    path = cache.path_for(key)
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+    cache.add(key, text, path)
+    return key, path
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = TTSCache(str(tmp_path), max_bytes=2500)
+    first, first_path = _add(cache, "first", 1000)
+    second, second_path = _add(cache, "second", 1000)
+    # Използването на първия прави втория най-отдавна използван
+    assert cache.lookup(first, "first") == first_path
+    third, third_path = _add(cache, "third", 1000)
+
+    assert cache.size == 2000
+    assert cache.lookup(second, "second") is None
+    assert not os.path.exists(second_path)
+    assert os.path.exists(first_path) and os.path.exists(third_path)
+
+def test_entry_larger_than_the_limit_is_kept(tmp_path):
+    cache = TTSCache(str(tmp_path), max_bytes=500)
+    key, path = _add(cache, "long", 1000)
+
+    assert cache.lookup(key, "long") == path
+    assert len(cache) == 1
+
+def test_manifest_survives_reopening(tmp_path):
+    cache = TTSCache(str(tmp_path), max_bytes=10_000)
+    key, path = _add(cache, "persisted", 1000)
+    cache.set_duration(key, 1.5)
+    cache.close()
+
+    reopened = TTSCache(str(tmp_path), max_bytes=10_000)
+    assert reopened.lookup(key, "persisted") == path
+    assert reopened.duration(key) == 1.5
+    assert reopened.size == 1000
+    reopened.close()
+
+def test_invalidate_removes_entry_and_file(tmp_path):
+    cache = TTSCache(str(tmp_path), max_bytes=10_000)
+    key, path = _add(cache, "broken", 1000)
+    cache.invalidate(key)
+
+    assert cache.lookup(key, "broken") is None
+    assert not os.path.exists(path)
+    assert cache.size == 0
+
+def test_legacy_file_is_adopted(tmp_path):
+    legacy_path = tmp_path / legacy_file_name("old text")
+    legacy_path.write_bytes(b"\0" * 100)
+    cache = TTSCache(str(tmp_path), max_bytes=10_000)
+    key = cache_key("old text", "model", "voice", "", "mp3")
+
+    path = cache.lookup(key, "old text")
+    assert path == cache.path_for(key)
+    assert os.path.exists(path) and not legacy_path.exists()
+    assert cache.size == 100
+
+def test_legacy_file_is_used_in_place_when_it_cannot_be_renamed(tmp_path, monkeypatch):
+    legacy_path = tmp_path / legacy_file_name("bundled text")
+    legacy_path.write_bytes(b"\0" * 100)
+    cache = TTSCache(str(tmp_path), max_bytes=10_000)
+    key = cache_key("bundled text", "model", "voice", "", "mp3")
+
+    def read_only(src, dst):
+        raise PermissionError("read-only file system")
+    monkeypatch.setattr(tts_cache.os, "replace", read_only)
+
+    # Файлът се ползва под старото име и остава в индекса в паметта
+    assert cache.lookup(key, "bundled text") == str(legacy_path)
+    assert cache.lookup(key, "bundled text") == str(legacy_path)
+    assert legacy_path.exists()
+    assert cache.size == 100
+
+def test_legacy_files_are_listed_once(tmp_path, monkeypatch):
+    cache = TTSCache(str(tmp_path), max_bytes=10_000)
+    assert len(cache) == 0
+
+    # Търсене на липсващ запис не проверява диска
+    def no_disk_access(path):
+        raise AssertionError(f"unexpected disk access: {path}")
+    monkeypatch.setattr(tts_cache.os.path, "exists", no_disk_access)
+    monkeypatch.setattr(tts_cache.os, "stat", no_disk_access)
+    (tmp_path / legacy_file_name("late text")).write_bytes(b"\0" * 100)
+
+    assert cache.lookup(cache_key("missing", "model", "voice", "", "mp3"), "missing") is None
+    assert cache.lookup(cache_key("late text", "model", "voice", "", "mp3"), "late text") is None
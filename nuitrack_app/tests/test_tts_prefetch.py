@@ -0,0 +1,128 @@
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import tts_manager
+from preload_exercises import CacheStatus
+from tts_manager import PREFETCH_WORKERS, TTSManager
+
+# Колко дълго (s) заявката "генерира" реч - за да се застъпят паралелните заявки
+GENERATE_DELAY = 0.1
+
+class StubTTSServer(ThreadingHTTPServer):
+    """Локален заместител на TTS услугата. Поведението зависи от началото на текста:
+    "flaky" - първо 429, после 503, после успех; "bad" - винаги 400; останалите - успех."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubTTSHandler)
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self.active = 0
+        self.max_active = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1/audio/speech"
+
+class StubTTSHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        text = json.loads(self.rfile.read(int(self.headers["Content-Length"])))["input"]
+        server = self.server
+        with server.lock:
+            server.requests[text] += 1
+            attempt = server.requests[text]
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            time.sleep(GENERATE_DELAY)
+            if text.startswith("bad"):
+                self._reply(400, b'{"error": "invalid input"}')
+            elif text.startswith("flaky") and attempt <= 2:
+                self._reply(429 if attempt == 1 else 503, b'{"error": "try again"}')
+            else:
+                self._reply(200, f"ID3 {text}".encode("utf-8"))
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def _reply(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def server():
+    server = StubTTSServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def manager(server, tmp_path, monkeypatch):
+    monkeypatch.setenv(tts_manager.TTS_URL_ENV, server.url)
+    monkeypatch.setattr(tts_manager, "RETRY_BACKOFF", 0.01)
+    manager = TTSManager(cache_dir=str(tmp_path))
+    yield manager
+    manager.cache.close()
+
+def _prefetch(manager, texts):
+    """Генерира текстовете като initialize_tts_cache и връща (неуспешни, статус)."""
+    status = CacheStatus()
+    status.start(len(set(texts)))
+    failed = manager.prefetch(texts, on_progress=lambda done, total, generated: status.update_progress(done, total, generated=generated))
+    status.finish(error=f"{failed} failed" if failed else None)
+    return failed, status
+
+def test_prefetch_generates_in_parallel(server, manager):
+    texts = [f"Инструкция {index}" for index in range(8)]
+    failed, status = _prefetch(manager, texts + texts[:2])
+
+    assert failed == 0
+    assert status.current == status.total == len(texts)
+    assert status.files_generated == len(texts)
+    assert 1 < server.max_active <= PREFETCH_WORKERS
+    assert all(server.requests[text] == 1 for text in texts)
+    for text in texts:
+        with open(manager._cached_path(text), "rb") as f:
+            assert f.read() == f"ID3 {text}".encode("utf-8")
+
+def test_prefetch_retries_temporary_errors(server, manager):
+    failed, status = _prefetch(manager, ["flaky instruction"])
+
+    assert failed == 0
+    assert server.requests["flaky instruction"] == 3
+    assert status.files_generated == 1
+    assert manager._cached_path("flaky instruction") is not None
+
+def test_prefetch_counts_permanent_errors_as_failed(server, manager):
+    failed, status = _prefetch(manager, ["bad instruction", "good instruction"])
+
+    assert failed == 1
+    # Постоянна грешка (4xx) не се опитва отново
+    assert server.requests["bad instruction"] == 1
+    assert status.current == status.total == 2
+    assert status.files_generated == 1
+    assert status.error == "1 failed"
+    assert manager._cached_path("bad instruction") is None
+
+def test_prefetch_skips_cached_texts(server, manager):
+    texts = ["first", "second"]
+    _prefetch(manager, texts)
+    failed, status = _prefetch(manager, texts)
+
+    assert failed == 0
+    assert status.current == 2
+    assert status.files_generated == 0
+    assert sum(server.requests.values()) == 2
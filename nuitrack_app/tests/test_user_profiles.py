@@ -0,0 +1,72 @@
+import itertools
+from types import SimpleNamespace
+
+import pytest
+
+import globals
+from utils import user_profiles
+from utils.step_compiler import compile_thresholds
+from utils.user_profiles import PROFILE_DRIFT_MIN_MM, ProfileStore, apply_profile, metrics_drift
+
+METRICS = {"height": 1700.0, "arm_length": 540.0, "hip_width": 200.0, "shoulder_width": 360.0, "leg_length": 450.0}
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    # Нарастващ часовник - редът по последно използване не зависи от резолюцията на time.time
+    clock = itertools.count(1000.0)
+    monkeypatch.setattr(user_profiles, "time", SimpleNamespace(time=lambda: next(clock)))
+    store = ProfileStore(str(tmp_path / "profiles.sqlite3"))
+    yield store
+    store.close()
+
+def test_profile_round_trip(store, tmp_path):
+    thresholds = compile_thresholds(METRICS)
+    store.save("Мария", METRICS, thresholds, quality=0.9)
+    store.close()
+
+    profile = ProfileStore(str(tmp_path / "profiles.sqlite3")).load("Мария")
+    assert profile.name == "Мария"
+    assert profile.user_metrics == METRICS
+    assert profile.thresholds == thresholds
+    assert profile.quality == 0.9
+    assert store.load("Непознат") is None
+
+def test_names_are_ordered_by_last_use(store):
+    for name in ("first", "second", "third"):
+        store.save(name, METRICS, {})
+    assert store.names() == ["third", "second", "first"]
+
+    store.load("first")
+    assert store.names() == ["first", "third", "second"]
+
+def test_saving_existing_profile_overwrites_it(store):
+    store.save("user", METRICS, {"0.2": {"arm_threshold": 1.0}}, quality=0.5)
+    created = store.load("user").created
+    taller = dict(METRICS, height=1800.0)
+    store.save("user", taller, {"0.2": {"arm_threshold": 2.0}}, quality=0.8)
+
+    profile = store.load("user")
+    assert store.names() == ["user"]
+    assert profile.user_metrics == taller
+    assert profile.thresholds == {"0.2": {"arm_threshold": 2.0}}
+    assert profile.quality == 0.8
+    assert profile.created == created and profile.updated > created
+
+def test_apply_profile_sets_calibration(store, monkeypatch):
+    for name in ("user_metrics", "user_thresholds", "calibration_quality", "calibration_completed", "user_profile"):
+        monkeypatch.setattr(globals, name, getattr(globals, name))
+    thresholds = compile_thresholds(METRICS)
+    store.save("user", METRICS, thresholds, quality=0.75)
+
+    apply_profile(store.load("user"))
+    assert globals.user_metrics == METRICS
+    assert globals.user_thresholds == thresholds
+    assert globals.calibration_quality == 0.75
+    assert globals.calibration_completed
+    assert globals.user_profile == "user"
+
+def test_metrics_drift_flags_out_of_range_metrics():
+    assert metrics_drift(METRICS, dict(METRICS, height=1720.0, hip_width=200.0 + PROFILE_DRIFT_MIN_MM - 1)) == {}
+
+    drift = metrics_drift(METRICS, dict(METRICS, height=1850.0, hip_width=200.0 + PROFILE_DRIFT_MIN_MM + 1))
+    assert drift == {"height": (1700.0, 1850.0), "hip_width": (200.0, 200.0 + PROFILE_DRIFT_MIN_MM + 1)}
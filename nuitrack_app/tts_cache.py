@@ -0,0 +1,247 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+# Индекс на кеша - SQLite файл в директорията на кеша
+MANIFEST_NAME = "manifest.sqlite3"
+
+# Максимален размер на кеша; NUITRACK_TTS_CACHE_MB го сменя
+CACHE_SIZE_ENV = "NUITRACK_TTS_CACHE_MB"
+DEFAULT_CACHE_MAX_MB = 200
+
+# Имена на файловете от стария кеш (MD5 само на текста)
+LEGACY_PREFIX = "openai_tts_"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    file TEXT NOT NULL,
+    text TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    duration REAL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+)
+"""
+
+class CacheEntry(NamedTuple):
+    """Запис в индекса: файлът на една генерирана реч."""
+    key: str
+    file: str
+    text: str
+    size: int
+    duration: float
+    created: float
+    last_used: float
+
+def cache_key(text, model, voice, instructions, response_format):
+    """SHA-256 ключ на речта - смяна на модела, гласа, инструкциите или формата дава нов ключ."""
+    payload = json.dumps([text, model, voice, instructions, response_format], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def legacy_file_name(text):
+    return f"{LEGACY_PREFIX}{hashlib.md5(text.encode('utf-8')).hexdigest()}.mp3"
+
+def default_max_bytes():
+    try:
+        return int(float(os.getenv(CACHE_SIZE_ENV) or DEFAULT_CACHE_MAX_MB) * 1024 * 1024)
+    except ValueError:
+        logger.warning(f"Invalid {CACHE_SIZE_ENV}, using {DEFAULT_CACHE_MAX_MB} MB")
+        return DEFAULT_CACHE_MAX_MB * 1024 * 1024
+
+class TTSCache:
+    """
+    Кеш на генерираната реч по съдържание, с индекс в SQLite.
+
+    Индексът се чете с една заявка при първо използване и после се пази в паметта - търсенето
+    не проверява файла на диска. Файл, който липсва или е повреден, се открива при използването му
+    и се премахва с `invalidate`. Над `max_bytes` се изтриват най-отдавна използваните записи.
+    Времената на използване се записват в индекса на порции (`flush`).
+    """
+
+    def __init__(self, cache_dir, max_bytes=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes if max_bytes is not None else default_max_bytes()
+        self.size = 0
+        self._entries = None
+        self._legacy_files = set()      # Файлове от стария кеш, още непрехвърлени в индекса
+        self._touched = set()
+        self._connection = None
+        self._lock = threading.RLock()
+
+    def _connect(self):
+        if self._connection is None:
+            path = os.path.join(self.cache_dir, MANIFEST_NAME)
+            try:
+                self._connection = sqlite3.connect(path, check_same_thread=False)
+                self._connection.execute(_SCHEMA)
+            except sqlite3.Error as e:
+                # Директорията може да е само за четене (напр. в компилираното приложение)
+                logger.warning(f"TTS cache manifest unavailable at {path} ({e}), keeping it in memory")
+                self._connection = sqlite3.connect(":memory:", check_same_thread=False)
+                self._connection.execute(_SCHEMA)
+            self._connection.commit()
+        return self._connection
+
+    def _load(self):
+        """Зарежда целия индекс в паметта (една заявка)."""
+        if self._entries is None:
+            rows = self._connect().execute(
+                "SELECT key, file, text, size, duration, created, last_used FROM entries"
+            ).fetchall()
+            self._entries = {row[0]: CacheEntry(*row) for row in rows}
+            self.size = sum(entry.size for entry in self._entries.values())
+            # Файловете от стария кеш се търсят веднъж тук, а не с проверка на диска при всяко търсене
+            try:
+                self._legacy_files = {name for name in os.listdir(self.cache_dir) if name.startswith(LEGACY_PREFIX)}
+            except OSError:
+                self._legacy_files = set()
+            logger.info(f"TTS cache manifest loaded: {len(self._entries)} entries, {self.size / 1e6:.1f} MB, "
+                        f"{len(self._legacy_files)} legacy files")
+        return self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._load())
+
+    def path_for(self, key):
+        """Пътят, на който се записва речта с този ключ."""
+        return os.path.join(self.cache_dir, f"{key}.mp3")
+
+    def lookup(self, key, text):
+        """
+        Пътят до кешираната реч или None. Не проверява диска; при липса в индекса приема
+        файл от стария кеш (MD5 на текста), ако е бил в директорията при зареждането на индекса.
+        """
+        with self._lock:
+            entry = self._load().get(key)
+            if entry is not None:
+                self._entries[key] = entry._replace(last_used=time.time())
+                self._touched.add(key)
+                return os.path.join(self.cache_dir, entry.file)
+            return self._adopt_legacy(key, text)
+
+    def _adopt_legacy(self, key, text):
+        legacy_name = legacy_file_name(text)
+        if legacy_name not in self._legacy_files:
+            return None
+        self._legacy_files.discard(legacy_name)
+        legacy_path = os.path.join(self.cache_dir, legacy_name)
+        path = self.path_for(key)
+        try:
+            os.replace(legacy_path, path)
+        except OSError as e:
+            # Директорията е само за четене - файлът се ползва под старото си име
+            logger.warning(f"Could not rename legacy TTS cache file {legacy_path}, using it in place: {e}")
+            path = legacy_path
+        try:
+            self.add(key, text, path)
+        except OSError as e:
+            logger.warning(f"Legacy TTS cache file {path} is unavailable: {e}")
+            return None
+        logger.debug(f"Adopted legacy TTS cache file for: {text[:40]}...")
+        return path
+
+    def add(self, key, text, path, duration=None):
+        """Добавя (или обновява) записа за генериран файл и освобождава място при нужда."""
+        size = os.path.getsize(path)
+        now = time.time()
+        entry = CacheEntry(key, os.path.basename(path), text, size, duration, now, now)
+        with self._lock:
+            entries = self._load()
+            previous = entries.get(key)
+            if previous is not None:
+                self.size -= previous.size
+            entries[key] = entry
+            self.size += size
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO entries (key, file, text, size, duration, created, last_used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                entry
+            )
+            self._evict(keep=key)
+            self._flush()
+
+    def set_duration(self, key, duration):
+        """Записва продължителността на речта (известна след декодиране)."""
+        with self._lock:
+            entry = self._load().get(key)
+            if entry is None or entry.duration == duration:
+                return
+            self._entries[key] = entry._replace(duration=duration)
+            self._connect().execute("UPDATE entries SET duration = ? WHERE key = ?", (duration, key))
+            self._connect().commit()
+
+    def duration(self, key):
+        with self._lock:
+            entry = self._load().get(key)
+            return entry.duration if entry is not None else None
+
+    def invalidate(self, key):
+        """Премахва запис, чийто файл липсва или е повреден."""
+        with self._lock:
+            entry = self._load().pop(key, None)
+            if entry is None:
+                return
+            self.size -= entry.size
+            self._touched.discard(key)
+            self._connect().execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._connect().commit()
+        _remove_file(os.path.join(self.cache_dir, entry.file))
+        logger.info(f"Invalidated TTS cache entry for: {entry.text[:40]}...")
+
+    def _evict(self, keep=None):
+        """Изтрива най-отдавна използваните записи, докато размерът падне под max_bytes."""
+        if self.size <= self.max_bytes:
+            return
+        connection = self._connect()
+        for entry in sorted(self._entries.values(), key=lambda entry: entry.last_used):
+            if self.size <= self.max_bytes:
+                break
+            if entry.key == keep:
+                continue
+            del self._entries[entry.key]
+            self._touched.discard(entry.key)
+            self.size -= entry.size
+            connection.execute("DELETE FROM entries WHERE key = ?", (entry.key,))
+            _remove_file(os.path.join(self.cache_dir, entry.file))
+            logger.info(f"Evicted TTS cache entry ({entry.size / 1e3:.0f} kB): {entry.text[:40]}...")
+
+    def flush(self):
+        """Записва в индекса времената на използване, натрупани от търсенията."""
+        with self._lock:
+            if self._entries is not None:
+                self._flush()
+
+    def _flush(self):
+        connection = self._connect()
+        if self._touched:
+            connection.executemany(
+                "UPDATE entries SET last_used = ? WHERE key = ?",
+                [(self._entries[key].last_used, key) for key in self._touched]
+            )
+            self._touched.clear()
+        connection.commit()
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                if self._entries is not None:
+                    self._flush()
+                self._connection.close()
+                self._connection = None
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Could not delete {path}: {e}")
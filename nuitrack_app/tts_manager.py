@@ -2,21 +2,42 @@ import logging
 import threading
 import queue
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from dotenv import load_dotenv
 
 import requests
+from requests.adapters import HTTPAdapter
 import sys
 import tempfile
 
 import pygame
 
+from audio_bank import AudioBank
+from audio_engine import audio_engine
+from tts_cache import TTSCache, cache_key
+from utils.trace import tracer
+
 logger = logging.getLogger(__name__)
 
 # Получаване на абсолютен път до .env файла
 env_path = Path(__file__).resolve().parent.parent / ".env"
 load_dotenv(dotenv_path=env_path)
 
+# Адрес на TTS услугата - OPENAI_TTS_URL го сменя (напр. с локален сървър за проверки)
+TTS_URL_ENV = "OPENAI_TTS_URL"
+DEFAULT_TTS_URL = "https://api.openai.com/v1/audio/speech"
+
+# Едновременни заявки при предварителното генериране на кеша
+PREFETCH_WORKERS = 4
+
+# Повторни опити при мрежова грешка или временна грешка на услугата: пауза RETRY_BACKOFF * 2^опит (s)
+REQUEST_TIMEOUT = 30
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5
+RETRY_STATUS_CODES = frozenset({408, 429, 500, 502, 503, 504})
+
 class TTSManager:
     """Управлява text-to-speech за прочитане на инструкции за упражнения"""
     
@@ -25,14 +46,15 @@ class TTSManager:
         self.tts_queue = queue.Queue()
         self.tts_thread = None
         self.running = False
-        self.current_speech_thread = None
+        self._speech_id = 0  # Расте при всяко прекъсване - по-старите текстове в опашката не се пускат
         
         # OpenAI API настройки
         self.api_key = os.getenv("OPENAI_API_KEY")
-        self.api_url = "https://api.openai.com/v1/audio/speech"
+        self.api_url = os.getenv(TTS_URL_ENV) or DEFAULT_TTS_URL
         self.model = "gpt-4o-mini-tts"
         self.voice = "coral" 
         self.instructions = "Speak in a friendly, clear, and natural tone. Pronounce Bulgarian correctly, with normal speed."
+        self.response_format = "mp3"
         
         if cache_dir is None:
             if getattr(sys, 'frozen', False):
@@ -48,8 +70,16 @@ class TTSManager:
         os.makedirs(self.cache_dir, exist_ok=True)
         self.cache_enabled = True
         
-        # Предварително зареждане на често използвани фрази
-        self.preloaded_audio = {}
+        # Индекс на кеша по съдържание (текст, модел, глас, инструкции, формат)
+        self.cache = TTSCache(self.cache_dir)
+        
+        # Декодирани в паметта инструкции - възпроизвеждат се от аудио двигателя
+        self.audio_bank = AudioBank()
+
+        # Обща HTTP сесия - връзките се преизползват (keep-alive) от всички заявки и нишки
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=PREFETCH_WORKERS))
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=PREFETCH_WORKERS))
         
     def _lazy_initialize(self):
         """Инициализира TTS engine само при първа нужда"""
@@ -57,11 +87,9 @@ class TTSManager:
             return True
             
         try:
-            # Инициализира pygame mixer веднъж в началото
-            if not pygame.mixer.get_init():
-                # Намалени буфери за по-малка латентност
-                pygame.mixer.init(frequency=22050, size=-16, channels=2, buffer=512)
-                logger.info("Pygame mixer initialized with optimized settings")
+            # Миксерът се инициализира и управлява от нишката на аудио двигателя
+            if not audio_engine.start():
+                raise Exception("Audio engine is not available")
             
             self.initialized = True
             logger.info("TTS manager initialized successfully")
@@ -71,11 +99,36 @@ class TTSManager:
             logger.error(f"Failed to initialize TTS manager: {e}")
             return False
     
+    def _cache_key(self, text):
+        return cache_key(text, self.model, self.voice, self.instructions, self.response_format)
+    
     def _get_cache_path(self, text):
-        """Генерира път за кеширан файл базиран на текста"""
-        import hashlib
-        text_hash = hashlib.md5(text.encode('utf-8')).hexdigest()
-        return os.path.join(self.cache_dir, f"openai_tts_{text_hash}.mp3")
+        """Път за кеширания файл на текста (ключът включва модела, гласа и инструкциите)"""
+        return self.cache.path_for(self._cache_key(text))
+    
+    def _cached_path(self, text):
+        """Пътят до кеширания файл на текста или None - по индекса, без проверка на диска"""
+        return self.cache.lookup(self._cache_key(text), text)
+    
+    def _decode(self, text, path):
+        """
+        Декодира кеширания файл в банката. Файл, който липсва или не се декодира, се премахва от индекса.
+        Връща звука или None.
+        """
+        key = self._cache_key(text)
+        sound = self.audio_bank.load(text, path)
+        if sound is None:
+            self.cache.invalidate(key)
+        elif self.cache.duration(key) is None:
+            self.cache.set_duration(key, sound.get_length())
+        return sound
+    
+    def _generate_cached(self, text):
+        """Генерира речта направо в кеша и я добавя в индекса. Връща пътя."""
+        path = self._get_cache_path(text)
+        self._generate_audio_file(text, path)
+        self.cache.add(self._cache_key(text), text, path)
+        return path
     
     def preload_phrases(self, phrases):
         """
@@ -89,34 +142,82 @@ class TTSManager:
             return
         
         def preload_worker():
-            items = list(phrases.items() if isinstance(phrases, dict) else enumerate(phrases))
-            total = len(items)
-            
-            for idx, (key, text) in enumerate(items, 1):
-                try:
-                    cache_path = self._get_cache_path(text)
-                    
-                    # Генерира файла ако не съществува
-                    if not os.path.exists(cache_path):
-                        logger.info(f"[{idx}/{total}] Generating: {text[:40]}...")
-                        self._generate_audio_file(text, cache_path)
-                    else:
-                        logger.debug(f"[{idx}/{total}] Already cached: {text[:40]}...")
-                    
-                    # Запазва пътя в паметта
-                    self.preloaded_audio[text] = cache_path
-                    
-                except Exception as e:
-                    logger.error(f"[{idx}/{total}] Error preloading: {e}")
-            
-            logger.info(f"✓ Preloading complete! {len(self.preloaded_audio)} phrases ready.")
+            texts = list(phrases.values() if isinstance(phrases, dict) else phrases)
+            failed = self.prefetch(texts)
+            logger.info(f"✓ Preloading complete! {len(set(texts)) - failed} phrases ready.")
         
         # Стартира в background thread, за да не блокира
         threading.Thread(target=preload_worker, daemon=True).start()
     
+    def preload_exercise(self, exercise):
+        """
+        Декодира кешираните инструкции на упражнението в банката във фонов thread,
+        за да започват веднага при смяна на стъпката. Некешираните се пропускат.
+        """
+        if not self._lazy_initialize():
+            return
+        
+        texts = [step["instructions"] for step in exercise["steps"] if step["instructions"]]
+        
+        def preload_worker():
+            paths = ((text, self._cached_path(text)) for text in texts)
+            loaded = sum(self._decode(text, path) is not None for text, path in paths if path)
+            logger.info(f"Audio bank: {loaded}/{len(texts)} instructions decoded for '{exercise['exercise_name']}' "
+                        f"({self.audio_bank.size / 1e6:.1f} MB)")
+        
+        threading.Thread(target=preload_worker, daemon=True).start()
+    
+    def prefetch(self, texts, workers=PREFETCH_WORKERS, on_progress=None):
+        """
+        Генерира липсващите в кеша текстове паралелно - до `workers` заявки едновременно през общата сесия.
+        Вече кешираните се отчитат веднага. Блокира до края.
+        
+        Аргументи:
+            texts: Текстове (повторенията се пропускат)
+            on_progress: Извиква се след всеки текст с (готови, общо, генериран)
+        
+        Връща броя на текстовете, които не са генерирани.
+        """
+        texts = list(dict.fromkeys(text for text in texts if text))
+        total = len(texts)
+        done = failed = 0
+        
+        missing = []
+        for text in texts:
+            if self._cached_path(text):
+                done += 1
+                if on_progress:
+                    on_progress(done, total, False)
+            else:
+                missing.append(text)
+        
+        if missing:
+            logger.info(f"Generating {len(missing)} of {total} phrases with {workers} workers")
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tts_prefetch") as executor:
+                futures = {executor.submit(self._generate_cached, text): text for text in missing}
+                for future in as_completed(futures):
+                    text = futures[future]
+                    done += 1
+                    try:
+                        future.result()
+                        generated = True
+                    except Exception as e:
+                        logger.error(f"[{done}/{total}] Error preloading '{text[:30]}...': {e}")
+                        failed += 1
+                        generated = False
+                    if on_progress:
+                        on_progress(done, total, generated)
+        
+        # Времената на използване от търсенията се записват в индекса наведнъж
+        self.cache.flush()
+        return failed
+    
+    @tracer.traced("tts_generate", "tts")
     def _generate_audio_file(self, text, output_path):
         """
-        Генерира аудио файл от текст използвайки OpenAI TTS API
+        Генерира аудио файл от текст използвайки OpenAI TTS API.
+        Мрежовите и временните грешки (429, 5xx) се опитват отново до MAX_RETRIES пъти с нарастваща пауза.
+        Файлът се записва под временно име и се преименува, така че в кеша не остават непълни файлове.
         
         Args:
             text: Текст за произнасяне
@@ -132,110 +233,101 @@ class TTSManager:
             "input": text,
             "voice": self.voice,
             "instructions": self.instructions,
-            "response_format": "mp3"
+            "response_format": self.response_format
         }
         
-        try:
-            response = requests.post(
-                self.api_url, 
-                headers=headers, 
-                json=payload,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                with open(output_path, 'wb') as f:
-                    f.write(response.content)
-                logger.debug(f"Audio generated and saved to {output_path}")
+        for attempt in range(MAX_RETRIES + 1):
+            retry = attempt < MAX_RETRIES
+            try:
+                response = self.session.post(
+                    self.api_url, 
+                    headers=headers, 
+                    json=payload,
+                    timeout=REQUEST_TIMEOUT
+                )
+            except requests.exceptions.RequestException as e:
+                if not retry:
+                    logger.error(f"Network error calling OpenAI API: {e}")
+                    raise
+                logger.warning(f"Network error calling OpenAI API (attempt {attempt + 1}): {e}")
             else:
-                logger.error(f"OpenAI API error: {response.status_code} - {response.text}")
-                raise Exception(f"API request failed: {response.status_code}")
+                if response.status_code == 200:
+                    temp_path = f"{output_path}.{threading.get_ident()}.part"
+                    with open(temp_path, 'wb') as f:
+                        f.write(response.content)
+                    os.replace(temp_path, output_path)
+                    logger.debug(f"Audio generated and saved to {output_path}")
+                    return
                 
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Network error calling OpenAI API: {e}")
-            raise
+                if not retry or response.status_code not in RETRY_STATUS_CODES:
+                    logger.error(f"OpenAI API error: {response.status_code} - {response.text}")
+                    raise Exception(f"API request failed: {response.status_code}")
+                logger.warning(f"OpenAI API error {response.status_code} (attempt {attempt + 1}), retrying")
+            
+            time.sleep(RETRY_BACKOFF * 2 ** attempt)
     
-    def _speak_text_openai(self, text):
-        """Произнася текст използвайки OpenAI TTS"""
+    def _load_speech(self, text):
+        """
+        Връща декодирания звук за текста: от банката, от кеша на диска или новогенериран чрез OpenAI TTS.
+        Връща None при грешка.
+        """
         temp_file = None
-        try:            
-            logger.info(f"Speaking with OpenAI TTS: {text[:50]}...")
+        try:
+            # Декодиран в паметта звук - без четене от диска
+            sound = self.audio_bank.get(text) if self.cache_enabled else None
+            if sound is not None:
+                return sound
             
-            # Проверка за кеширан файл
-            if self.cache_enabled and text in self.preloaded_audio:
-                audio_file = self.preloaded_audio[text]
-                logger.debug("Using preloaded audio")
-            else:
-                # Проверка за кеширан файл на диска
-                cache_path = self._get_cache_path(text)
-                if self.cache_enabled and os.path.exists(cache_path):
-                    audio_file = cache_path
+            # Кеширан файл по индекса; повреден или изтрит файл се генерира наново
+            if self.cache_enabled:
+                cache_path = self._cached_path(text)
+                sound = self._decode(text, cache_path) if cache_path else None
+                if sound is not None:
                     logger.debug("Using cached audio file")
-                else:
-                    # Генерира нов файл
-                    with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as fp:
-                        temp_file = fp.name
-                    
-                    self._generate_audio_file(text, temp_file)
-                    audio_file = temp_file
-                    
-                    # Кешира файла ако е разрешено
-                    if self.cache_enabled:
-                        try:
-                            import shutil
-                            shutil.copy(temp_file, cache_path)
-                            logger.debug(f"Cached audio to {cache_path}")
-                        except Exception as e:
-                            logger.warning(f"Could not cache audio: {e}")
-            
-            # Възпроизвежда аудиото
-            pygame.mixer.music.load(audio_file)
-            pygame.mixer.music.play()
-            
-            # Изчаква завършване
-            while pygame.mixer.music.get_busy():
-                pygame.time.Clock().tick(10)
+                    return sound
+                
+                # Генерира нов файл направо в кеша
+                cache_path = self._generate_cached(text)
+                logger.debug(f"Cached audio to {cache_path}")
+                return self._decode(text, cache_path)
             
-            logger.info("Finished speaking with OpenAI TTS")
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as fp:
+                temp_file = fp.name
+            self._generate_audio_file(text, temp_file)
+            return pygame.mixer.Sound(temp_file)
             
         except Exception as e:
-            logger.error(f"Error speaking with OpenAI TTS: {e}")
+            logger.error(f"Error preparing OpenAI TTS audio: {e}")
+            return None
         finally:
-            # Изчиства временния файл само ако е създаден нов
+            # Временният файл вече е декодиран в паметта
             if temp_file and os.path.exists(temp_file):
                 try:
-                    pygame.mixer.music.unload()
                     os.unlink(temp_file)
                 except Exception as e:
                     logger.warning(f"Could not delete temp file: {e}")
     
-    def _speak_text(self, text):
-        """Произнася един текст в отделен thread"""
-        self._speak_text_openai(text)
-    
     def _tts_worker(self):
-        """Фонов thread, който обработва TTS опашката"""
+        """
+        Фонов thread, който подготвя звука на всеки текст от опашката и го подава на аудио двигателя.
+        Самото възпроизвеждане е в нишката на двигателя - тук не се създават нови threads.
+        """
         while self.running:
             try:
                 # Взима текст от опашката с timeout
-                text = self.tts_queue.get(timeout=0.5)
+                item = self.tts_queue.get(timeout=0.5)
                 
                 # None се използва като сигнал за спиране на thread-а
-                if text is None:
+                if item is None:
                     break
                 
-                # Проверява дали в момента има активно говорене
-                if self.current_speech_thread and self.current_speech_thread.is_alive():
-                    logger.debug("Interrupting previous speech")
-                    # Оставя текущото говорене да приключи естествено
+                text, interrupt, speech_id = item
+                logger.info(f"Speaking with OpenAI TTS: {text[:50]}...")
+                sound = self._load_speech(text)
                 
-                # Стартира ново говорене в отделен thread
-                self.current_speech_thread = threading.Thread(
-                    target=self._speak_text, 
-                    args=(text,),
-                    daemon=True
-                )
-                self.current_speech_thread.start()
+                # Текст, прекъснат от по-нов или от stop(), докато е бил генериран, не се пуска
+                if sound is not None and speech_id == self._speech_id:
+                    audio_engine.play_instruction(sound, text[:50], interrupt=interrupt)
                 
                 self.tts_queue.task_done()
                 
@@ -273,17 +365,12 @@ class TTSManager:
         
         try:
             if interrupt:
-                # Изчиства текущата опашка
-                while not self.tts_queue.empty():
-                    try:
-                        self.tts_queue.get_nowait()
-                        self.tts_queue.task_done()
-                    except queue.Empty:
-                        break
-                
+                # Изчиства текущата опашка и спира текущото говорене веднага
+                self._clear_queue()
+                audio_engine.interrupt()
                 logger.debug("Queue cleared for interrupt")
             
-            self.tts_queue.put(text)
+            self.tts_queue.put((text, interrupt, self._speech_id))
             logger.info(f"Added to TTS queue: {text[:50]}...")
             
         except Exception as e:
@@ -295,45 +382,44 @@ class TTSManager:
         self.speak(text, interrupt=True)
     
     def stop(self):
-        """Спира TTS и изчиства опашката"""
+        """Спира TTS и изчиства опашката - след връщането не звучи и не започва нито една инструкция"""
         try:
-            # Спира pygame mixer
-            try:
-                if pygame.mixer.get_init():
-                    pygame.mixer.music.stop()
-            except:
-                pass
-            
-            # Изчиства опашката
-            while not self.tts_queue.empty():
-                try:
-                    self.tts_queue.get_nowait()
-                    self.tts_queue.task_done()
-                except queue.Empty:
-                    break
+            self._clear_queue()
+            if self.initialized:
+                audio_engine.interrupt(wait=True)
+            self.cache.flush()
             
             logger.debug("TTS stopped and queue cleared")
             
         except Exception as e:
             logger.error(f"Error stopping TTS: {e}")
     
+    def _clear_queue(self):
+        """Изчиства чакащите текстове и отказва текста, който се подготвя в момента."""
+        self._speech_id += 1
+        while not self.tts_queue.empty():
+            try:
+                self.tts_queue.get_nowait()
+                self.tts_queue.task_done()
+            except queue.Empty:
+                break
+    
     def cleanup(self):
         """Освобождава всички TTS ресурси"""
         try:
             self.running = False
             
-            # Спира pygame mixer
-            try:
-                if pygame.mixer.get_init():
-                    pygame.mixer.quit()
-            except:
-                pass
-            
             # Изпраща сигнал за спиране на worker thread-а
             if self.tts_thread and self.tts_thread.is_alive():
                 self.tts_queue.put(None)
                 self.tts_thread.join(timeout=2.0)
             
+            # Спира аудио двигателя и миксера - декодираните звуци се освобождават преди него
+            self.audio_bank.clear()
+            audio_engine.shutdown()
+            
+            self.session.close()
+            self.cache.close()
             self.initialized = False
             logger.info("TTS engine cleaned up")
             
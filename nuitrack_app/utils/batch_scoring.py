@@ -0,0 +1,105 @@
+from types import MappingProxyType
+from typing import NamedTuple
+
+import numpy as np
+
+from utils.check_angles import ANGLE_INDEX, ANGLE_JOINTS, angle_score, compute_all_angles
+from utils.skeleton_processing import relative_positions
+from utils.step_compiler import DEFAULT_TOLERANCE, POSE_CHECKERS, angle_feedback, checked_poses
+
+class BatchAngleCheck(NamedTuple):
+    """Проверка на ъгъл за всички потребители наведнъж."""
+    name: str
+    target: float
+    index: int          # Колона в резултата на compute_all_angles (-1 за непознат ъгъл)
+    joints: np.ndarray
+
+class BatchStepPlan(NamedTuple):
+    """
+    План за оценка на стъпка, независим от потребителя - праговете на всеки потребител се подават
+    при оценката (stack_tolerances), затова един план обслужва всички проследени потребители.
+    """
+    name: str
+    duration: float
+    required_poses: MappingProxyType
+    pose_names: tuple
+    angle_checks: tuple
+    tolerances: MappingProxyType
+
+class BatchEvaluation(NamedTuple):
+    """Резултат от оценката на N потребители: масиви по потребители (N,) и по проверки (N, проверки)."""
+    accuracy: np.ndarray
+    all_ok: np.ndarray
+    ok: np.ndarray
+    angles: np.ndarray
+    rel: np.ndarray              # Позиции спрямо торса (N, 20, 3) - за съобщенията
+    tolerances_data: dict        # Праговете {праг: (N,) масив}, с които е оценено
+
+def compile_batch_step(step_data):
+    """Компилира стъпка в план за групова оценка - проверките на позите и ъглите, независими от потребителя."""
+    required_poses = MappingProxyType(dict(step_data.get("required_poses", {})))
+    angle_checks = []
+    for angle_name, target in step_data.get("target_angles", {}).items():
+        index = ANGLE_INDEX.get(angle_name, -1)
+        joints = np.array(ANGLE_JOINTS[index] if index >= 0 else (), dtype=np.intp)
+        angle_checks.append(BatchAngleCheck(angle_name, target, index, joints))
+
+    return BatchStepPlan(
+        name=step_data.get("name", ""),
+        duration=step_data.get("duration_seconds", 0),
+        required_poses=required_poses,
+        pose_names=checked_poses(required_poses),
+        angle_checks=tuple(angle_checks),
+        tolerances=MappingProxyType(dict(step_data.get("tolerance", DEFAULT_TOLERANCE)))
+    )
+
+def compile_batch_exercise(exercise):
+    return tuple(compile_batch_step(step) for step in exercise["steps"])
+
+def stack_tolerances(rows):
+    """Праговете на N потребители (tolerances_data на всеки) като {праг: (N,) масив} за evaluate_batch."""
+    return {name: np.array([row[name] for row in rows]) for name in rows[0]}
+
+def evaluate_batch(plan, data, valid, metrics, tolerances_data):
+    """
+    Оценява стъпка за N потребители с една векторизирана проверка върху (N, 20, 4) масив (правилата са
+    POSE_CHECKERS). Единственият път за оценка - един потребител е група от един.
+    `metrics` е речник {метрика: (N,) масив}, а `tolerances_data` - вече компилираните прагове
+    на потребителите (stack_tolerances).
+    """
+    rel = relative_positions(data, valid)
+
+    users = rel.shape[0]
+    checks = len(plan.pose_names) + len(plan.angle_checks)
+    ok = np.zeros((users, checks), dtype=bool)
+    scores = np.zeros((users, checks))
+
+    for column, name in enumerate(plan.pose_names):
+        ok[:, column] = POSE_CHECKERS[name].check(rel, valid, plan.required_poses[name], tolerances_data, metrics)
+        scores[:, column] = ok[:, column] * 100.0
+
+    # compute_all_angles дава NaN за ъгъл с липсващи стави - оценява се като неуспех с 0 точки
+    angles = compute_all_angles(data, valid) if plan.angle_checks else np.empty((users, 0))
+    angle_tolerance = plan.tolerances.get('angle_tolerance', 0)
+    for offset, check in enumerate(plan.angle_checks):
+        column = len(plan.pose_names) + offset
+        measured = angles[:, check.index] if check.index >= 0 else np.full(users, np.nan)
+        ok[:, column], scores[:, column] = angle_score(check.name, check.target, measured, angle_tolerance)
+
+    accuracy = scores.sum(axis=1) / checks if checks else np.zeros(users)
+    return BatchEvaluation(accuracy, ok.all(axis=1), ok, angles, rel, tolerances_data)
+
+def batch_feedback(plan, evaluation, user, valid):
+    """Съобщенията за потребител `user` ({проверка: {"ok", "msg"}}) - изграждат се само при нужда."""
+    rel = evaluation.rel[user]
+    tolerances_data = {name: values[user] for name, values in evaluation.tolerances_data.items()}
+    feedback = {}
+    for column, name in enumerate(plan.pose_names):
+        is_ok = bool(evaluation.ok[user, column])
+        required = plan.required_poses[name]
+        feedback[name] = {'ok': is_ok, 'msg': "✓" if is_ok else POSE_CHECKERS[name].message(required, rel, tolerances_data)}
+
+    for check in plan.angle_checks:
+        fb, _, _ = angle_feedback(check.name, check.target, check.joints, evaluation.angles[user], valid[user], plan.tolerances)
+        feedback[check.name] = fb
+    return feedback
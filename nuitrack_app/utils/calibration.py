@@ -1,52 +1,237 @@
 import time
+from typing import NamedTuple
 import custom_messagebox as messagebox
 
 import numpy as np
-from utils.skeleton_processing import calculate_3d_distance, process_skeleton_data
+from utils.skeleton_processing import JOINT_COUNT, JOINT_NAMES, JointIndex, calculate_3d_distance
+from utils.trace import tracer
 
 import globals
 
-def perform_calibration(nuitrack):
-    """Калибриране на неутрална поза."""
+# Продължителност на калибрирането (s): спира при сходимост, но не по-рано от минимума и не по-късно от максимума
+CALIBRATION_MIN_DURATION = 1.0
+CALIBRATION_MAX_DURATION = 5.0
+
+# Минимален брой приети проби преди проверка за сходимост и за успешно калибриране
+CONVERGENCE_MIN_SAMPLES = 15
+REQUIRED_SAMPLES = 5
+
+# Сходимост: стандартната грешка на средната стойност на всяка следена метрика е под тази стойност (мм)
+CONVERGENCE_SEM_MM = 5.0
+
+# Отхвърляне на проби, отдалечени от средната с повече от OUTLIER_SIGMA стандартни отклонения
+# (но поне OUTLIER_MIN_MM), след като са натрупани OUTLIER_WARMUP проби
+OUTLIER_SIGMA = 3.0
+OUTLIER_MIN_MM = 30.0
+OUTLIER_WARMUP = 8
+
+# Метрики на тялото в реда на calculate_user_metrics и тези, по които се следи сходимостта
+METRIC_NAMES = ("height", "arm_length", "hip_width", "shoulder_width", "leg_length")
+CONVERGENCE_METRICS = ("height", "arm_length", "hip_width", "leg_length")
+_CONVERGENCE_INDEX = np.array([METRIC_NAMES.index(name) for name in CONVERGENCE_METRICS])
+
+# Стави, които трябва да са засечени в една проба - важните за калибриране и нужните за метриките
+CALIBRATION_JOINTS = ('HEAD', 'TORSO', 'LEFT_ANKLE', 'RIGHT_ANKLE', 'RIGHT_SHOULDER', 'RIGHT_WRIST',
+                      'LEFT_SHOULDER', 'LEFT_HIP', 'RIGHT_HIP', 'LEFT_KNEE', 'RIGHT_KNEE')
+_CALIBRATION_INDEX = np.array([JointIndex[name] for name in CALIBRATION_JOINTS])
+
+# Стъпка (в проценти), през която напредъкът се съобщава на интерфейса
+PROGRESS_REPORT_STEP = 10
+
+class RunningStats:
+    """Плъзгаща се средна стойност и дисперсия по алгоритъма на Welford - без да се пазят пробите."""
+
+    def __init__(self, shape):
+        self.count = np.zeros(shape)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+
+    def update(self, values, mask=True):
+        """Добавя проба; `mask` указва кои елементи да се обновят."""
+        mask = np.broadcast_to(mask, self.mean.shape)
+        self.count += mask
+        delta = np.where(mask, values - self.mean, 0.0)
+        self.mean += delta / np.maximum(self.count, 1)
+        self.m2 += np.where(mask, delta * (values - self.mean), 0.0)
+
+    @property
+    def variance(self):
+        return np.where(self.count > 1, self.m2 / np.maximum(self.count - 1, 1), 0.0)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    @property
+    def sem(self):
+        """Стандартна грешка на средната стойност (безкрайна при по-малко от 2 проби)."""
+        return np.where(self.count > 1, np.sqrt(self.variance / np.maximum(self.count, 1)), np.inf)
+
+    def outliers(self, values):
+        """Маска на стойностите, които са твърде далеч от натрупаната средна."""
+        limit = np.maximum(OUTLIER_SIGMA * self.std, OUTLIER_MIN_MM)
+        return (self.count >= OUTLIER_WARMUP) & (np.abs(values - self.mean) > limit)
+
+class CalibrationResult(NamedTuple):
+    """Резултат от калибрирането преди проверките за позиция и височина."""
+    avg_skeleton: dict
+    metrics: dict
+    samples: int
+    rejected: int
+    duration: float
+    converged: bool
+    quality: float
+    missing_joints: tuple
+
+class StreamingCalibrator:
+    """
+    Калибриране в реално време: всеки кадър обновява средната и дисперсията на ставите и на метриките на тялото.
+    Кадри без нужните стави и отдалечените проби се отхвърлят. Калибрирането приключва, щом метриките
+    се стабилизират (след поне CALIBRATION_MIN_DURATION), или при изтичане на CALIBRATION_MAX_DURATION.
+    """
+
+    def __init__(self, start_time, min_duration=CALIBRATION_MIN_DURATION, max_duration=CALIBRATION_MAX_DURATION):
+        self.start_time = start_time
+        self.min_duration = min_duration
+        self.max_duration = max_duration
+        self.joints = RunningStats((JOINT_COUNT, 3))
+        self.metrics = RunningStats(len(METRIC_NAMES))
+        self.elapsed = 0.0
+        self.rejected = 0
+        self.converged = False
+        self.done = False
+        self.reported_progress = 0
+        self.on_finished = None
+
+    @property
+    def samples(self):
+        return int(self.metrics.count[0])
+
+    @property
+    def progress(self):
+        """Напредък от 0 до 1 за интерфейса."""
+        return 1.0 if self.done else min(1.0, self.elapsed / self.max_duration)
+
+    def add_frame(self, frame, now):
+        """Добавя скелетен кадър (или None при липса на скелет). Връща True, когато калибрирането е приключило."""
+        if self.done:
+            return True
+        self.elapsed = now - self.start_time
+        if frame is not None:
+            self._add_sample(frame)
+
+        self.converged = (
+            self.elapsed >= self.min_duration
+            and self.samples >= CONVERGENCE_MIN_SAMPLES
+            and bool((self.metrics.sem[_CONVERGENCE_INDEX] < CONVERGENCE_SEM_MM).all())
+        )
+        self.done = self.converged or self.elapsed >= self.max_duration
+        return self.done
+
+    def _add_sample(self, frame):
+        # Проверка на важни стави за калибриране
+        if not frame.valid[_CALIBRATION_INDEX].all():
+            missing_joints = [name for name in CALIBRATION_JOINTS if not frame.valid[JointIndex[name]]]
+            globals.logger.debug(f"Calibration: Missing or low-confidence joints: {missing_joints}")
+            self.rejected += 1
+            return
+
+        metrics = calculate_user_metrics(frame)
+        values = np.array([metrics[name] for name in METRIC_NAMES], dtype=np.float64)
+        if self.metrics.outliers(values).any():
+            globals.logger.debug(f"Calibration: Outlier sample rejected: {dict(zip(METRIC_NAMES, values.round()))}")
+            self.rejected += 1
+            return
+        self.metrics.update(values)
+
+        # Ставите се обновяват поотделно - отдалечена става не отхвърля целия кадър
+        xyz = frame.data[:, :3]
+        joint_ok = frame.valid & ~self.joints.outliers(xyz).any(axis=1)
+        self.joints.update(xyz, joint_ok[:, None])
+
+    def quality(self):
+        """Оценка на качеството 0-100: дял на приетите проби, умножен по точността на метриките."""
+        if self.samples < 2:
+            return 0.0
+        acceptance = self.samples / (self.samples + self.rejected)
+        max_sem = float(self.metrics.sem[_CONVERGENCE_INDEX].max())
+        precision = min(1.0, CONVERGENCE_SEM_MM / max(max_sem, 1e-6))
+        return 100.0 * acceptance * precision
+
+    def result(self):
+        """Усреднен скелет и метрики от натрупаните статистики."""
+        counts = self.joints.count[:, 0]
+        avg_skeleton = {
+            name: {"x": float(x), "y": float(y), "z": float(z)}
+            for name, count, (x, y, z) in zip(JOINT_NAMES, counts, self.joints.mean)
+            if count >= REQUIRED_SAMPLES
+        }
+        missing_joints = tuple(name for name in CALIBRATION_JOINTS if name not in avg_skeleton)
+        return CalibrationResult(
+            avg_skeleton=avg_skeleton,
+            metrics=calculate_user_metrics(avg_skeleton) if not missing_joints else None,
+            samples=self.samples,
+            rejected=self.rejected,
+            duration=self.elapsed,
+            converged=self.converged,
+            quality=self.quality(),
+            missing_joints=missing_joints
+        )
+
+def begin_calibration(min_duration=CALIBRATION_MIN_DURATION, max_duration=CALIBRATION_MAX_DURATION, on_finished=None):
+    """
+    Стартира калибриране във фонов режим. Кадрите идват от етапа за анализ (feed_calibration),
+    така сензорът се чете само от нишката за четене, а Tk нишката не се блокира.
+    `on_finished(result)` се вика в Tk нишката; по подразбиране е app.on_calibration_finished.
+    """
+    globals.calibration_start_time = time.time()
+    calibrator = StreamingCalibrator(globals.calibration_start_time, min_duration, max_duration)
+    calibrator.on_finished = on_finished
+    globals.calibrator = calibrator
+    globals.calibration_active = True
+
+def cancel_calibration():
+    """Прекратява текущото калибриране без резултат (напр. при спиране на сесията)."""
+    globals.calibrator = None
+    globals.calibration_active = False
+
+def feed_calibration(skeleton, now):
+    """
+    Подава кадър на активното калибриране - вика се от етапа за анализ за всеки кадър.
+    Напредъкът и резултатът се предават на Tk нишката чрез root.after.
+    """
+    calibrator = globals.calibrator
+    if calibrator is None:
+        return
+
+    with tracer.span("calibration_sample", "calibration"):
+        done = calibrator.add_frame(skeleton, now)
+
+    if done:
+        globals.calibrator = None
+        globals.calibration_active = False
+        result = calibrator.result()
+        if globals.app:
+            on_finished = calibrator.on_finished or globals.app.on_calibration_finished
+            globals.app.root.after(0, lambda: on_finished(result))
+        return
+
+    # Напредъкът се съобщава на стъпки, а не за всеки кадър
+    progress = int(calibrator.progress * 100) // PROGRESS_REPORT_STEP * PROGRESS_REPORT_STEP
+    if progress != calibrator.reported_progress:
+        calibrator.reported_progress = progress
+        if globals.app:
+            globals.app.root.after(0, lambda: globals.app.on_calibration_progress(progress))
+
+def finish_calibration(result):
+    """Проверява резултата от калибрирането и при успех записва метриките на потребителя."""
 
-    # Ако нямаме инициализиран Nuitrack обект, прекратяваме функцията
-    if not nuitrack:
-        globals.logger.error("No Nuitrack instance provided")
-        return None
-    
-    # Записване времето на начало на калибрирането
-    start_time = time.time()
-    # Инициализира списък за съхранение на данни за скелета
-    samples = []
-    
-    # Продължава цикъла за 5 секунди, докато сесията и калибрирането са активни
-    while time.time() - start_time < 5 and globals.session_running and globals.calibration_active:
-        try:
-            nuitrack.update() # Актуализиране на данните от камерата
-            skeleton_data = nuitrack.get_skeleton()
-            process_skeleton_data(skeleton_data, debug=True)
-            
-            # Проверка дали има достатъчно зесечени стави
-            if (globals.current_user_skeleton and len(globals.current_user_skeleton) >= 6):  # Трябва да имаме поне 6 засечени стави
-
-                # Проверка на важни стави за калибриране
-                required_joints = ['HEAD', 'TORSO', 'LEFT_ANKLE', 'RIGHT_ANKLE', 'RIGHT_SHOULDER', 'RIGHT_WRIST']
-                missing_joints = [j for j in required_joints if j not in globals.current_user_skeleton or globals.current_user_skeleton[j].get('confidence', 0) < 0.4]
-                if not missing_joints:
-                    samples.append(dict(globals.current_user_skeleton))
-                else:
-                    globals.logger.debug(f"Calibration: Missing or low-confidence joints: {missing_joints}")
-            time.sleep(0.05)
-
-        except Exception as e:
-            globals.logger.error(f"Calibration update error: {e}")
-    
     # Проверка за достатъчен брой валидни обекти със засечени стави
-    if len(samples) < 5: 
-        globals.logger.info(f"Calibration failed: Only {len(samples)} valid samples (need 5)")
+    if result.samples < REQUIRED_SAMPLES: 
+        globals.logger.info(f"Calibration failed: Only {result.samples} valid samples (need {REQUIRED_SAMPLES})")
         feedback = (
             "Не са открити достатъчно валидни стави.\n"
-            f"Събрани са само {len(samples)}.\n\n"
+            f"Събрани са само {result.samples}.\n\n"
             "Уверете се, че:\n"
             "- цялото тяло е видимо\n"
             "- стоите неподвижно\n"
@@ -57,25 +242,14 @@ def perform_calibration(nuitrack):
         messagebox.showwarning("Неуспешно калибриране", feedback)
         return None
     
-    # Усредняване на данните за всяка става
-    avg_skeleton = {}
-    try:
-        for joint in samples[0].keys():
-            # Проверка дали всички проби съдържат тази става
-            if any(joint not in s for s in samples):
-                raise KeyError(joint)
-            
-            avg_skeleton[joint] = {
-                "x": np.mean([s[joint]['x'] for s in samples]),
-                "y": np.mean([s[joint]['y'] for s in samples]),
-                "z": np.mean([s[joint]['z'] for s in samples])
-            }
-
-    except KeyError as missing_joint:
-        globals.logger.error(f"Calibration failed: Missing joint {missing_joint}")
+    # Всички важни стави трябва да имат достатъчно приети проби
+    if result.missing_joints:
+        globals.logger.error(f"Calibration failed: Missing joint {result.missing_joints}")
         messagebox.showerror("Неуспешно калибриране", "Неуспешно калибриране. Моля, опитайте пак!")
         return None
 
+    avg_skeleton = result.avg_skeleton
+
     # Проверка дали торсът е центриран и на правилна дистанция
     torso_x = avg_skeleton.get('TORSO', {}).get('x', 0)
     torso_z = avg_skeleton.get('TORSO', {}).get('z', 1500)
@@ -103,7 +277,25 @@ def perform_calibration(nuitrack):
         messagebox.showwarning("Калибрирането е неуспешно", feedback)
         return None
     
-    # Изчисляване на дължина и ширина на различни части на тялото
+    globals.user_metrics = result.metrics
+    # Праговете на стария профил вече не важат - изчисляват се наново от новите метрики
+    globals.user_thresholds = None
+    globals.calibration_quality = result.quality
+
+    globals.calibration_completed = True
+    
+    # Пускане на звук при успешно калибриране
+    globals.sound_manager.play_exercise_complete()
+
+    globals.logger.info(
+        f"Calibration successful: {result.samples} samples ({result.rejected} rejected) in {result.duration:.1f}s, "
+        f"converged={result.converged}, quality={result.quality:.0f}%"
+    )
+    return globals.user_metrics
+
+def calculate_user_metrics(avg_skeleton):
+    """Изчисляване на височина, дължина и ширина на различни части на тялото от усреднен скелет."""
+    height = abs(avg_skeleton.get('HEAD', {}).get('y', 0) - avg_skeleton.get('LEFT_ANKLE', {}).get('y', 0))
     arm_length = calculate_3d_distance(avg_skeleton.get('RIGHT_SHOULDER'), avg_skeleton.get('RIGHT_WRIST'))
     hip_width = abs(avg_skeleton.get('RIGHT_HIP', {}).get('x', 0) - avg_skeleton.get('LEFT_HIP', {}).get('x', 0))
     shoulder_width = abs(avg_skeleton.get('RIGHT_SHOULDER', {}).get('x', 0) - avg_skeleton.get('LEFT_SHOULDER', {}).get('x', 0))
@@ -111,7 +303,7 @@ def perform_calibration(nuitrack):
     right_leg = abs(avg_skeleton.get('RIGHT_HIP', {}).get('y', 0) - avg_skeleton.get('RIGHT_KNEE', {}).get('y', 0))
     leg_length = max(left_leg, right_leg) if left_leg or right_leg else 500  # Default if missing
 
-    globals.user_metrics = {
+    return {
         "height": height,
         "arm_length": arm_length,
         "hip_width": hip_width,
@@ -119,21 +311,6 @@ def perform_calibration(nuitrack):
         "leg_length": leg_length
     }
 
-    globals.calibration_completed = True
-    
-    # Пускане на звук при успешно калибриране
-    globals.sound_manager.play_exercise_complete()
-
-    globals.logger.info(f"Calibration successful: {len(samples)} samples collected")
-    return globals.user_metrics
-
-def update_calibration_progress():
-    """Актуализира таймера на калибрирането с визуално обратно броене."""
-
-    # Проверява дали калибрирането е активно
-    if not globals.calibration_active:
-        return
-
 def calculate_tolerances(tolerances, user_metrics):
     """Изчисляване на толеранси базирани на метриките на потребителя."""
     return {
@@ -1,95 +1,98 @@
 import numpy as np
-import math
 
 from globals import logger
-
-# Функция за изчисляване на ъгъла на повдигане на ръката
-def arm_elevation_angle(shoulder, wrist):
-
-    # Проверка за налични данни и достатъчно confidence
-    if not shoulder or not wrist or shoulder.get('confidence', 0) < 0.4 or wrist.get('confidence', 0) < 0.4:
-        logger.debug(f"Skipping angle calc - low confidence: shoulder={shoulder.get('confidence', 0):.2f}, wrist={wrist.get('confidence', 0):.2f}")
-        return None
-    
-    # Вектор от рамото до китката
-    v = np.array([wrist['x'] - shoulder['x'], wrist['y'] - shoulder['y'], wrist['z'] - shoulder['z']])
-    norm_v = np.linalg.norm(v)
-    if norm_v == 0:
-        logger.debug("Zero vector in arm angle calculation")
-        return None
-    
-    # Сравняваме спрямо вертикала надолу
-    vertical_down = np.array([0, -1, 0])
-    cos_angle = np.dot(v / norm_v, vertical_down)
-    angle = np.degrees(np.arccos(np.clip(cos_angle, -1.0, 1.0)))
-    return angle
-
-# Функция за изчисляване на ъгъла на коляното
-def calculate_knee_angle(hip, knee, ankle):
-
-    if not hip or not knee or not ankle or hip.get('confidence', 0) < 0.4 or knee.get('confidence', 0) < 0.4 or ankle.get('confidence', 0) < 0.4:
-        logger.debug(f"Skipping knee angle calc - low confidence: hip={hip.get('confidence', 0):.2f}, knee={knee.get('confidence', 0):.2f}, ankle={ankle.get('confidence', 0):.2f}")
-        return None
-    
-    # Вектори от коляното към таза и от коляното към глезена
-    v1 = np.array([hip['x'] - knee['x'], hip['y'] - knee['y'], hip['z'] - knee['z']])        
-    norm_v1 = np.linalg.norm(v1)
-
-    # Проверка за липсващ глезен или ниска увереност: сравнявай бедро-коляно с вертикала
-    if not ankle or ankle.get('confidence', 0) < 0.3:
-        logger.debug("Fallback knee angle: no ankle or low confidence, assuming vertical calf")
-        vertical_down = np.array([0, -1, 0])
-        cos_angle = np.dot(v1 / norm_v1, vertical_down)
-        angle = np.degrees(np.arccos(np.clip(cos_angle, -1.0, 1.0)))
-        return angle  # Приблизително изчислява ъгъла на бедрото спрямо вертикала
-
-    # Стандартно изчисление с глезен
-    if ankle.get('confidence', 0) >= 0.3:
-        v2 = np.array([ankle['x'] - knee['x'], ankle['y'] - knee['y'], ankle['z'] - knee['z']])
-        norm_v2 = np.linalg.norm(v2)
-        if norm_v2 == 0:
-            logger.debug("Zero vector in knee-ankle calculation")
-            return None
-    
-        # Изчисляване на ъгъла между двата вектора
-        cos_angle = np.dot(v1 / norm_v1, v2 / norm_v2)
-        angle = np.degrees(np.arccos(np.clip(cos_angle, -1.0, 1.0)))
-        return angle
-
-    logger.debug("No valid angle calculation possible")
-    return None
-
-def check_single_angle(angle_name, target, user_skeleton, rel_skeleton, tolerances):
-    """Проверка на единичен ъгъл."""
-    angle = None
-    feedback = {}
-    score = 0
-    is_ok = False
-
-    # Проверка на ъглите на ръцете
-    if angle_name == "right_arm_angle":
-        angle = arm_elevation_angle(user_skeleton.get('RIGHT_SHOULDER'), user_skeleton.get('RIGHT_WRIST'))
-    elif angle_name == "left_arm_angle":
-        angle = arm_elevation_angle(user_skeleton.get('LEFT_SHOULDER'), user_skeleton.get('LEFT_WRIST'))
-
-    # Проверка на ъглите на коленете
-    elif angle_name == "right_knee_angle":
-        angle = calculate_knee_angle(user_skeleton.get('RIGHT_HIP'), user_skeleton.get('RIGHT_KNEE'), user_skeleton.get('RIGHT_ANKLE'))
-    elif angle_name == "left_knee_angle":
-        angle = calculate_knee_angle(user_skeleton.get('LEFT_HIP'), user_skeleton.get('LEFT_KNEE'), user_skeleton.get('LEFT_ANKLE'))
+from utils.skeleton_processing import CONFIDENCE, MIN_JOINT_CONFIDENCE, JointIndex, SkeletonFrame
+
+# Поддържани ъгли - редът определя колоната в резултата на compute_all_angles
+ANGLE_NAMES = (
+    "right_arm_angle", "left_arm_angle",
+    "right_elbow_angle", "left_elbow_angle",
+    "right_knee_angle", "left_knee_angle",
+)
+ANGLE_INDEX = {name: i for i, name in enumerate(ANGLE_NAMES)}
+
+# Стави, участващи във всеки ъгъл (в реда на ANGLE_NAMES)
+ANGLE_JOINTS = (
+    (JointIndex.RIGHT_SHOULDER, JointIndex.RIGHT_WRIST),
+    (JointIndex.LEFT_SHOULDER, JointIndex.LEFT_WRIST),
+    (JointIndex.RIGHT_SHOULDER, JointIndex.RIGHT_ELBOW, JointIndex.RIGHT_WRIST),
+    (JointIndex.LEFT_SHOULDER, JointIndex.LEFT_ELBOW, JointIndex.LEFT_WRIST),
+    (JointIndex.RIGHT_HIP, JointIndex.RIGHT_KNEE, JointIndex.RIGHT_ANKLE),
+    (JointIndex.LEFT_HIP, JointIndex.LEFT_KNEE, JointIndex.LEFT_ANKLE),
+)
+
+# Ъгли на повдигане на ръката: вектор рамо → китка спрямо вертикала надолу
+_ARM_SHOULDERS = np.array([j[0] for j in ANGLE_JOINTS[:2]])
+_ARM_WRISTS = np.array([j[1] for j in ANGLE_JOINTS[:2]])
+
+# Ъгли в става (лакът, коляно): ъгъл между векторите от средната става към крайните
+_JOINT_A = np.array([j[0] for j in ANGLE_JOINTS[2:]])
+_JOINT_B = np.array([j[1] for j in ANGLE_JOINTS[2:]])
+_JOINT_C = np.array([j[2] for j in ANGLE_JOINTS[2:]])
+
+def compute_all_angles(joints, valid=None):
+    """
+    Изчислява всички поддържани ъгли (в градуси) с едно векторизирано минаване.
+
+    `joints` е (20, 4) масив (x, y, z, confidence), (N, 20, 4) стек от кадри или SkeletonFrame.
+    Връща масив с форма (6,) или (N, 6) по реда на ANGLE_NAMES; NaN означава, че ъгълът
+    не може да се изчисли (липсваща става или нулев вектор).
+    """
+    if isinstance(joints, SkeletonFrame):
+        joints, valid = joints.data, joints.valid
+
+    joints = np.asarray(joints, dtype=np.float32)
+    if valid is None:
+        valid = joints[..., CONFIDENCE] > MIN_JOINT_CONFIDENCE
+    xyz = joints[..., :3]
+
+    angles = np.empty(joints.shape[:-2] + (len(ANGLE_NAMES),), dtype=np.float64)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Ръце: cos = (v / |v|) · (0, -1, 0)
+        v = xyz[..., _ARM_WRISTS, :] - xyz[..., _ARM_SHOULDERS, :]
+        norm_v = np.linalg.norm(v, axis=-1)
+        cos_arm = -v[..., 1] / norm_v
+        arm_ok = valid[..., _ARM_SHOULDERS] & valid[..., _ARM_WRISTS] & (norm_v > 0)
+        angles[..., :2] = np.where(arm_ok, np.degrees(np.arccos(np.clip(cos_arm, -1.0, 1.0))), np.nan)
+
+        # Лакти и колене: cos = (v1 · v2) / (|v1| |v2|)
+        v1 = xyz[..., _JOINT_A, :] - xyz[..., _JOINT_B, :]
+        v2 = xyz[..., _JOINT_C, :] - xyz[..., _JOINT_B, :]
+        norms = np.linalg.norm(v1, axis=-1) * np.linalg.norm(v2, axis=-1)
+        cos_joint = np.einsum('...k,...k->...', v1, v2) / norms
+        joint_ok = valid[..., _JOINT_A] & valid[..., _JOINT_B] & valid[..., _JOINT_C] & (norms > 0)
+        angles[..., 2:] = np.where(joint_ok, np.degrees(np.arccos(np.clip(cos_joint, -1.0, 1.0))), np.nan)
+
+    return angles
+
+# Ъгли, които се оценяват само като в/извън толеранса (без частични точки)
+ELBOW_ANGLES = ('right_elbow_angle', 'left_elbow_angle')
+
+def angle_score(angle_name, target, angle, tolerance):
+    """
+    Успех и точки (0-100) на измерения ъгъл спрямо целта. `angle` може да е число или масив
+    за много потребители; NaN (неизчислен ъгъл) дава неуспех и 0 точки.
+    """
+    diff = np.abs(angle - target)
+    is_ok = diff <= tolerance
+    if angle_name in ELBOW_ANGLES:
+        return is_ok, np.where(is_ok, 100.0, 0.0)
+    with np.errstate(invalid='ignore'):
+        return is_ok, np.where(np.isnan(diff), 0.0, np.maximum(0.0, 100 * (1 - diff / (2 * tolerance))))
+
+def check_single_angle(angle_name, target, angles, tolerances):
+    """Проверка на единичен ъгъл спрямо предварително изчислените ъгли от compute_all_angles."""
+    angle = angles[ANGLE_INDEX[angle_name]] if angle_name in ANGLE_INDEX else np.nan
+    angle = None if np.isnan(angle) else float(angle)
 
     # Проверка на лактите
-    if angle_name in ['right_elbow_angle', 'left_elbow_angle']:
+    if angle_name in ELBOW_ANGLES:
         side = 'RIGHT' if 'right' in angle_name else 'LEFT'
-        shoulder = rel_skeleton.get(f'{side}_SHOULDER', {})
-        elbow = rel_skeleton.get(f'{side}_ELBOW', {})
-        wrist = rel_skeleton.get(f'{side}_WRIST', {})
         
-        if shoulder and elbow and wrist:
-            v1 = np.array([shoulder['x'] - elbow['x'], shoulder['y'] - elbow['y'], shoulder['z'] - elbow['z']])
-            v2 = np.array([wrist['x'] - elbow['x'], wrist['y'] - elbow['y'], wrist['z'] - elbow['z']])
-            angle = math.degrees(math.acos(np.dot(v1, v2) / (np.linalg.norm(v1) * np.linalg.norm(v2) + 1e-10)))
-            is_ok = abs(angle - target) <= tolerances['angle_tolerance']
+        if angle is not None:
+            is_ok, score = angle_score(angle_name, target, angle, tolerances['angle_tolerance'])
+            is_ok = bool(is_ok)
             feedback = {
                 'ok': is_ok,
                 'msg': f"✓" if is_ok else f"✗ {side.lower()}_elbow_angle: {angle:.0f}° (target: {target}°)"
@@ -97,7 +100,7 @@ def check_single_angle(angle_name, target, user_skeleton, rel_skeleton, toleranc
 
             logger.debug(f"{angle_name}: measured={angle:.0f}, target={target}, ok={is_ok}")
 
-            return feedback, 100 if is_ok else 0, 1
+            return feedback, float(score), 1
         else:
             feedback = {
                 'ok': False,
@@ -114,9 +117,8 @@ def check_single_angle(angle_name, target, user_skeleton, rel_skeleton, toleranc
         feedback = {'ok': False, 'msg': f"{angle_name}: Not detected ✗"}
         return feedback, 0, 1
     
-    diff = abs(angle - target)
-    score = max(0, 100 * (1 - diff / (2 * tolerances['angle_tolerance'])))
-    is_ok = diff <= tolerances['angle_tolerance']
+    is_ok, score = angle_score(angle_name, target, angle, tolerances['angle_tolerance'])
+    is_ok, score = bool(is_ok), float(score)
 
     feedback = {
         'ok': is_ok,
@@ -1,282 +1,189 @@
-from globals import logger
+from types import MappingProxyType
+from typing import Callable, NamedTuple
 
-def _check_arms_down(rel_skeleton, required_poses, tolerances_data, user_metrics):
+import numpy as np
+
+from utils.skeleton_processing import JointIndex as J
+
+# Проверките работят върху позициите спрямо торса (relative_positions) - (20, 3) масив за един потребител
+# или (N, 20, 3) за N потребители, заедно с маската на засечените стави. Липсващите стави са 0.
+# Затова вместо and/or се използват & и |, а резултатът е bool или (N,) масив.
+
+def _x(rel, joint):
+    return rel[..., joint, 0]
+
+def _y(rel, joint):
+    return rel[..., joint, 1]
+
+def _z(rel, joint):
+    return rel[..., joint, 2]
+
+class PoseRule(NamedTuple):
+    """Правило за поза: условие върху масивите на ставите и съобщение при неуспех."""
+    check: Callable    # (rel, valid, required, tolerances_data, user_metrics) -> bool или (N,) масив
+    message: Callable  # (required, rel, tolerances_data) -> съобщение при неуспех за един потребител
+
+    def evaluate(self, rel, valid, required, tolerances_data, user_metrics):
+        """Проверка за един потребител - връща (успех, съобщение)."""
+        is_ok = bool(self.check(rel, valid, required, tolerances_data, user_metrics))
+        return is_ok, "✓" if is_ok else self.message(required, rel, tolerances_data)
+
+def _fail_message(required_msg, neutral_msg=None):
+    """Съобщение при неуспех; neutral_msg (ако е зададено) - когато позата не е изискана."""
+    def message(required, rel, tolerances_data):
+        return required_msg if required or neutral_msg is None else neutral_msg
+    return message
+
+def _check_arms_down(rel, valid, required, tolerances_data, user_metrics):
     """Проверка: Ръце спуснати надолу"""
-    right_wrist_y = rel_skeleton.get('RIGHT_WRIST', {}).get('y', 0)
-    left_wrist_y = rel_skeleton.get('LEFT_WRIST', {}).get('y', 0)
-    right_shoulder_y = rel_skeleton.get('RIGHT_SHOULDER', {}).get('y', 0)
-    left_shoulder_y = rel_skeleton.get('LEFT_SHOULDER', {}).get('y', 0)
-    
     # Китките трябва да са по-ниско от раменете с достатъчна разлика
-    is_right_down = right_wrist_y < right_shoulder_y - (0.7 * user_metrics['arm_length'] - tolerances_data['arm_tol'])
-    is_left_down = left_wrist_y < left_shoulder_y - (0.7 * user_metrics['arm_length'] - tolerances_data['arm_tol'])
-    is_down = is_right_down and is_left_down
-    
-    logger.debug(f"arms_down: right={is_right_down}, left={is_left_down}")
-    return is_down, "✓" if is_down else "✗ Спуснете ръцете си плътно до тялото"
-
-def _check_arms_bent_waist(rel_skeleton, required_poses, tolerances_data, user_metrics):
-    """Проверка: Ръце свити на кръста"""
-    required = required_poses["arms_bent_waist"]
-    right_wrist = rel_skeleton.get('RIGHT_WRIST', {})
-    left_wrist = rel_skeleton.get('LEFT_WRIST', {})
-    right_elbow = rel_skeleton.get('RIGHT_ELBOW', {})
-    left_elbow = rel_skeleton.get('LEFT_ELBOW', {})
-    right_hip = rel_skeleton.get('RIGHT_HIP', {})
-    left_hip = rel_skeleton.get('LEFT_HIP', {})
+    limit = 0.7 * user_metrics['arm_length'] - tolerances_data['arm_tol']
+    is_right_down = _y(rel, J.RIGHT_WRIST) < _y(rel, J.RIGHT_SHOULDER) - limit
+    is_left_down = _y(rel, J.LEFT_WRIST) < _y(rel, J.LEFT_SHOULDER) - limit
+    return is_right_down & is_left_down
 
+def _check_arms_bent_waist(rel, valid, required, tolerances_data, user_metrics):
+    """Проверка: Ръце свити на кръста"""
     # Проверка: ъгъл в лакътя да е сгънат (китка да е по-близо до рамо отколкото до бедро)
     right_elbow_bent = (
-        abs(right_wrist.get('y', 0) - right_elbow.get('y', 0)) <
-        abs(right_wrist.get('y', 0) - right_hip.get('y', 0)) + tolerances_data['arm_tol']
+        np.abs(_y(rel, J.RIGHT_WRIST) - _y(rel, J.RIGHT_ELBOW)) <
+        np.abs(_y(rel, J.RIGHT_WRIST) - _y(rel, J.RIGHT_HIP)) + tolerances_data['arm_tol']
     )
     left_elbow_bent = (
-        abs(left_wrist.get('y', 0) - left_elbow.get('y', 0)) <
-        abs(left_wrist.get('y', 0) - left_hip.get('y', 0)) + tolerances_data['arm_tol']
+        np.abs(_y(rel, J.LEFT_WRIST) - _y(rel, J.LEFT_ELBOW)) <
+        np.abs(_y(rel, J.LEFT_WRIST) - _y(rel, J.LEFT_HIP)) + tolerances_data['arm_tol']
     )
+    return (right_elbow_bent & left_elbow_bent) == required
 
-    is_bent_waist = right_elbow_bent and left_elbow_bent
-    is_ok = (is_bent_waist == required)
-    
-    if required:
-        msg = "✓" if is_ok else "✗ Поставете китките върху кръста"
-    else:
-        msg = "✓" if is_ok else "✗ Не поставяйте китките върху кръста (изпънете ръцете)"
-    
-    logger.debug(f"arms_bent_waist: right_bent={right_elbow_bent}, left_bent={left_elbow_bent}, required={required}, ok={is_ok}")
-    return is_ok, msg
-
-def _check_arms_back(rel_skeleton, required_poses, tolerances_data, user_metrics):
+def _check_arms_back(rel, valid, required, tolerances_data, user_metrics):
     """Проверка: Ръце назад (гърди изпъчени)"""
-    tol = tolerances_data['arm_tol'] * 1.5 
-    
-    has_right = 'RIGHT_WRIST' in rel_skeleton and 'RIGHT_SHOULDER' in rel_skeleton
-    has_left = 'LEFT_WRIST' in rel_skeleton and 'LEFT_SHOULDER' in rel_skeleton
-    
-    is_right_back = False
-    if has_right:
-        right_wrist_z = rel_skeleton['RIGHT_WRIST']['z']
-        right_shoulder_z = rel_skeleton['RIGHT_SHOULDER']['z']
-        # китката трябва да е по-назад от рамото
-        is_right_back = right_wrist_z > right_shoulder_z + tol
-    
-    is_left_back = False
-    if has_left:
-        left_wrist_z = rel_skeleton['LEFT_WRIST']['z']
-        left_shoulder_z = rel_skeleton['LEFT_SHOULDER']['z']
-        # китката трябва да е по-назад от рамото
-        is_left_back = left_wrist_z > left_shoulder_z + tol
-    
+    tol = tolerances_data['arm_tol'] * 1.5
+
+    # китката трябва да е по-назад от рамото
+    is_right_back = valid[..., J.RIGHT_WRIST] & valid[..., J.RIGHT_SHOULDER] & (_z(rel, J.RIGHT_WRIST) > _z(rel, J.RIGHT_SHOULDER) + tol)
+    is_left_back = valid[..., J.LEFT_WRIST] & valid[..., J.LEFT_SHOULDER] & (_z(rel, J.LEFT_WRIST) > _z(rel, J.LEFT_SHOULDER) + tol)
+
     # Приема се ако поне едната ръка е назад
-    is_back = (is_right_back and has_right) or (is_left_back and has_left)
-    
-    logger.debug(f"arms_back: right={is_right_back} (has_right={has_right}), left={is_left_back} (has_left={has_left})")
-    return is_back, "✓" if is_back else "✗ Изпънете ръцете назад за разтягане (отворете гърдите)"
+    return is_right_back | is_left_back
 
-def _check_arms_forward(rel_skeleton, required_poses, tolerances_data, user_metrics):
+def _check_arms_forward(rel, valid, required, tolerances_data, user_metrics):
     """Проверка: Ръце напред"""
     tol_z = tolerances_data['arm_tol'] * 1.5
     tol_x = user_metrics['shoulder_width'] * 0.6
 
-    has_right = 'RIGHT_WRIST' in rel_skeleton and 'RIGHT_SHOULDER' in rel_skeleton
-    has_left = 'LEFT_WRIST' in rel_skeleton and 'LEFT_SHOULDER' in rel_skeleton
-
-    is_right_forward = is_left_forward = False
-
-    if has_right:
-        rw, rs = rel_skeleton['RIGHT_WRIST'], rel_skeleton['RIGHT_SHOULDER']
-        # китката трябва да е пред рамото по Z
-        forward_ok = rw['z'] < rs['z'] - tol_z
-        # китката трябва да е приблизително на същата хоризонтална линия (X) като рамото
-        aligned_ok = abs(rw['x'] - rs['x']) < tol_x
-        is_right_forward = forward_ok and aligned_ok
-
-    if has_left:
-        lw, ls = rel_skeleton['LEFT_WRIST'], rel_skeleton['LEFT_SHOULDER']
-        forward_ok = lw['z'] < ls['z'] - tol_z
-        aligned_ok = abs(lw['x'] - ls['x']) < tol_x
-        is_left_forward = forward_ok and aligned_ok
+    # китката трябва да е пред рамото по Z и приблизително на същата хоризонтална линия (X)
+    is_right_forward = (
+        valid[..., J.RIGHT_WRIST] & valid[..., J.RIGHT_SHOULDER]
+        & (_z(rel, J.RIGHT_WRIST) < _z(rel, J.RIGHT_SHOULDER) - tol_z)
+        & (np.abs(_x(rel, J.RIGHT_WRIST) - _x(rel, J.RIGHT_SHOULDER)) < tol_x)
+    )
+    is_left_forward = (
+        valid[..., J.LEFT_WRIST] & valid[..., J.LEFT_SHOULDER]
+        & (_z(rel, J.LEFT_WRIST) < _z(rel, J.LEFT_SHOULDER) - tol_z)
+        & (np.abs(_x(rel, J.LEFT_WRIST) - _x(rel, J.LEFT_SHOULDER)) < tol_x)
+    )
 
     # изискваме и двете ръце да са изпънати напред
-    is_forward = (is_right_forward and has_right) and (is_left_forward and has_left)
-
-    logger.debug(f"arms_forward: right={is_right_forward} (has_right={has_right}), left={is_left_forward} (has_left={has_left})")
-    return is_forward, "✓" if is_forward else "✗ Изпънете ръце напред, близо една до друга, насочени към камерата"
+    return is_right_forward & is_left_forward
 
-def _check_arms_w_shape(rel_skeleton, required_poses, tolerances_data, user_metrics):
+def _check_arms_w_shape(rel, valid, required, tolerances_data, user_metrics):
     """Проверка: Ръце в W форма"""
-    right_wrist_y = rel_skeleton.get('RIGHT_WRIST', {}).get('y', 0)
-    left_wrist_y = rel_skeleton.get('LEFT_WRIST', {}).get('y', 0)
-    right_shoulder_y = rel_skeleton.get('RIGHT_SHOULDER', {}).get('y', 0)
-    left_shoulder_y = rel_skeleton.get('LEFT_SHOULDER', {}).get('y', 0)
-
     tol = tolerances_data['arm_tol'] * 0.5
-    is_w_shape = (abs(right_wrist_y - right_shoulder_y) < tol) and (abs(left_wrist_y - left_shoulder_y) < tol)
-    
-    return is_w_shape, "✓" if is_w_shape else "✗ Поставете китките близо до раменете (W форма)"
+    return (np.abs(_y(rel, J.RIGHT_WRIST) - _y(rel, J.RIGHT_SHOULDER)) < tol) & (np.abs(_y(rel, J.LEFT_WRIST) - _y(rel, J.LEFT_SHOULDER)) < tol)
 
-def _check_arms_y_shape(rel_skeleton, required_poses, tolerances_data, user_metrics):
+def _check_arms_y_shape(rel, valid, required, tolerances_data, user_metrics):
     """Проверка: Ръце в Y форма"""
-    right_wrist_y = rel_skeleton.get('RIGHT_WRIST', {}).get('y', 0)
-    left_wrist_y = rel_skeleton.get('LEFT_WRIST', {}).get('y', 0)
-    head_y = rel_skeleton.get('HEAD', {}).get('y', 0)
+    limit = _y(rel, J.HEAD) + tolerances_data['arm_tol'] * 0.10
+    return (_y(rel, J.RIGHT_WRIST) > limit) & (_y(rel, J.LEFT_WRIST) > limit)
 
-    tol = tolerances_data['arm_tol'] * 0.10
-    is_y_shape = (right_wrist_y > head_y + tol) and (left_wrist_y > head_y + tol)
-    
-    return is_y_shape, "✓" if is_y_shape else "✗ Изпънете ръцете нагоре (Y форма)"
+def _feet_distance(rel, valid):
+    """Разстояние между краката по X - глезенът, ако е засечен, иначе коляното."""
+    right_x = np.where(valid[..., J.RIGHT_ANKLE], _x(rel, J.RIGHT_ANKLE), _x(rel, J.RIGHT_KNEE))
+    left_x = np.where(valid[..., J.LEFT_ANKLE], _x(rel, J.LEFT_ANKLE), _x(rel, J.LEFT_KNEE))
+    return np.abs(right_x - left_x)
 
-def _check_legs_together(rel_skeleton, required_poses, tolerances_data, user_metrics):
+def _check_legs_together(rel, valid, required, tolerances_data, user_metrics):
     """Проверка: Крака събрани"""
-    right_joint = rel_skeleton.get('RIGHT_ANKLE', rel_skeleton.get('RIGHT_KNEE', {}))
-    left_joint = rel_skeleton.get('LEFT_ANKLE', rel_skeleton.get('LEFT_KNEE', {}))
-    right_x = right_joint.get('x', 0)
-    left_x = left_joint.get('x', 0)
-    
     # Разликата между краката трябва да е малка
-    is_together = abs(right_x - left_x) < user_metrics['hip_width'] + tolerances_data['hip_tol']
-    logger.debug(f"legs_together: {is_together}, right_x={right_x:.0f}, left_x={left_x:.0f}")
-    
-    return is_together, "✓" if is_together else "✗ Приближете краката си"
+    return _feet_distance(rel, valid) < user_metrics['hip_width'] + tolerances_data['hip_tol']
 
-def _check_legs_apart(rel_skeleton, required_poses, tolerances_data, user_metrics):
+def _check_legs_apart(rel, valid, required, tolerances_data, user_metrics):
     """Проверка: Крака раздалечени"""
-    right_joint = rel_skeleton.get('RIGHT_ANKLE', rel_skeleton.get('RIGHT_KNEE', {}))
-    left_joint = rel_skeleton.get('LEFT_ANKLE', rel_skeleton.get('LEFT_KNEE', {}))
-    right_x = right_joint.get('x', 0)
-    left_x = left_joint.get('x', 0)
-
     # Разликата между краката трябва да е голяма
-    is_apart = abs(right_x - left_x) > user_metrics['hip_width'] + tolerances_data['hip_tol']
-    logger.debug(f"legs_apart: {is_apart}, right_x={right_x:.0f}, left_x={left_x:.0f}")
-    
-    return is_apart, "✓" if is_apart else "✗ Разтворете краката си на ширината на раменете"
+    return _feet_distance(rel, valid) > user_metrics['hip_width'] + tolerances_data['hip_tol']
 
-def _check_shoulders_retracted(rel_skeleton, required_poses, tolerances_data, user_metrics):
+def _check_shoulders_retracted(rel, valid, required, tolerances_data, user_metrics):
     """Проверка: Рамене прибрани назад (shoulder retraction)"""
-    required = required_poses["shoulders_retracted"]
-    right_shoulder_z = rel_skeleton.get('RIGHT_SHOULDER', {}).get('z', 0)
-    left_shoulder_z = rel_skeleton.get('LEFT_SHOULDER', {}).get('z', 0)
-    collar_z = rel_skeleton.get('LEFT_COLLAR', {}).get('z', 0)
-
     # Толеранс за прибиране (по отношение на дължината на ръката)
-    tol = tolerances_data['arm_tol'] * 0.05
-
-    # Раменете са прибрани, ако и двете са зад торса поне
-    is_right_retracted = right_shoulder_z > collar_z + tol
-    is_left_retracted = left_shoulder_z > collar_z + tol
-    is_retracted = is_right_retracted and is_left_retracted
-    
-    is_ok = (is_retracted == required)
-    
+    limit = _z(rel, J.LEFT_COLLAR) + tolerances_data['arm_tol'] * 0.05
+
+    # Раменете са прибрани, ако и двете са зад ключицата
+    is_retracted = (_z(rel, J.RIGHT_SHOULDER) > limit) & (_z(rel, J.LEFT_SHOULDER) > limit)
+    return is_retracted == required
+
+def _shoulders_retracted_message(required, rel, tolerances_data):
     # Проверка за ротация на торса (асиметрия)
-    if abs(right_shoulder_z - left_shoulder_z) > tolerances_data['arm_tol']:
+    if abs(_z(rel, J.RIGHT_SHOULDER) - _z(rel, J.LEFT_SHOULDER)) > tolerances_data['arm_tol']:
         if required:
-            msg = "✓" if is_ok else "✗ Стегнете лопатките си равномерно, избягвайте завъртане на торса"
-        else:
-            msg = "✓" if is_ok else "✗ Не стягайте лопатките (върнете в неутрално, избягвайте завъртане)"
-    else:
-        if required:
-            msg = "✓" if is_ok else "✗ Стегнете лопатките си, като издърпате раменете назад и леко надолу"
-        else:
-            msg = "✓" if is_ok else "✗ Не стягайте лопатките (върнете раменете в неутрално)"
-    
-    logger.debug(f"shoulders_retracted: right={is_right_retracted} (z={right_shoulder_z:.0f}), left={is_left_retracted} (z={left_shoulder_z:.0f}), collar_z={collar_z:.0f}, required={required}, ok={is_ok}")
-    return is_ok, msg
-
-def _check_pelvis_anterior(rel_skeleton, required_poses, tolerances_data, user_metrics):
-    """Проверка: Таз напред (anterior pelvic tilt)"""
-    hip_z = (rel_skeleton.get('RIGHT_HIP', {}).get('z', 0) + rel_skeleton.get('LEFT_HIP', {}).get('z', 0)) / 2
-    torso_z = rel_skeleton.get('TORSO', {}).get('z', 0)
+            return "✗ Стегнете лопатките си равномерно, избягвайте завъртане на торса"
+        return "✗ Не стягайте лопатките (върнете в неутрално, избягвайте завъртане)"
+    if required:
+        return "✗ Стегнете лопатките си, като издърпате раменете назад и леко надолу"
+    return "✗ Не стягайте лопатките (върнете раменете в неутрално)"
 
-    tol = tolerances_data['height_tol'] * 0.15
+def _hip_z(rel):
+    return (_z(rel, J.RIGHT_HIP) + _z(rel, J.LEFT_HIP)) / 2
 
-    is_anterior = hip_z > torso_z + tol
-    return is_anterior, "✓" if is_anterior else "✗ Приберете таза назад"
+def _check_pelvis_anterior(rel, valid, required, tolerances_data, user_metrics):
+    """Проверка: Таз напред (anterior pelvic tilt)"""
+    return _hip_z(rel) > _z(rel, J.TORSO) + tolerances_data['height_tol'] * 0.15
 
-def _check_pelvis_posterior(rel_skeleton, required_poses, tolerances_data, user_metrics):
+def _check_pelvis_posterior(rel, valid, required, tolerances_data, user_metrics):
     """Проверка: Таз назад (posterior pelvic tilt)"""
-    hip_z = (rel_skeleton.get('RIGHT_HIP', {}).get('z', 0) + rel_skeleton.get('LEFT_HIP', {}).get('z', 0)) / 2
-    torso_z = rel_skeleton.get('TORSO', {}).get('z', 0)
-
-    tol = tolerances_data['height_tol'] * 0.05
-
-    is_posterior = hip_z < torso_z + tol
-    return is_posterior, "✓" if is_posterior else "✗ Приберете таза напред"
+    return _hip_z(rel) < _z(rel, J.TORSO) + tolerances_data['height_tol'] * 0.05
 
-def _check_head_retracted(rel_skeleton, required_poses, tolerances_data, user_metrics):
+def _check_head_retracted(rel, valid, required, tolerances_data, user_metrics):
     """Проверка: Прибрана глава (head retraction)"""
-    required = required_poses["head_retracted"]
-    head_z = rel_skeleton.get('HEAD', {}).get('z', 0)
-    collar_z = rel_skeleton.get('LEFT_COLLAR', {}).get('z', 0)
-    
-    # Толеранс за прибиране (по отношение на височината) 
-    tol = tolerances_data['height_tol'] * 0.01
-    
-    # Главата е прибрана, ако HEAD е по-назад от ключицата с поне *tol*
-    is_head_retracted = head_z > collar_z + tol 
-    is_ok = (is_head_retracted == required)
-    
-    if required:
-        msg = "✓" if is_ok else "✗ Приберете брадичката назад"
-    else:
-        msg = "✓" if is_ok else "✗ Върнете главата в неутрално положение (не прибирайте брадичката)"
-    
-    logger.debug(f"head_retracted: is_head_retracted={is_head_retracted} (z={head_z:.0f}), collar_z={collar_z:.0f}, required={required}, ok={is_ok}")
-    return is_ok, msg
-
-def _check_head_tilted_left(rel_skeleton, required_poses, tolerances_data, user_metrics):
-    """Проверка: Глава наклонена наляво"""
-    required = required_poses["head_tilted_left"]
-    head_x = rel_skeleton.get('HEAD', {}).get('x', 0)
-    neck_x = rel_skeleton.get('NECK', {}).get('x', 0)
+    # Главата е прибрана, ако HEAD е по-назад от ключицата с поне толеранса (по отношение на височината)
+    is_head_retracted = _z(rel, J.HEAD) > _z(rel, J.LEFT_COLLAR) + tolerances_data['height_tol'] * 0.01
+    return is_head_retracted == required
 
-    tol = tolerances_data['height_tol'] * 0.05
-
-    is_tilted_right = head_x > neck_x + tol
-    is_ok = (is_tilted_right == required)
-    
-    if required:
-        msg = "✓" if is_ok else "✗ Наклонете главата наляво"
-    else:
-        msg = "✓" if is_ok else "✗ Не накланяйте главата наляво (върнете в неутрално)"
-
-    logger.debug(f"head_tilted_left: {is_tilted_right}, head_x={head_x:.0f}, neck_x={neck_x:.0f}, required={required}, ok={is_ok}")
-    return is_ok, msg
+def _check_head_tilted_left(rel, valid, required, tolerances_data, user_metrics):
+    """Проверка: Глава наклонена наляво"""
+    is_tilted = _x(rel, J.HEAD) > _x(rel, J.NECK) + tolerances_data['height_tol'] * 0.05
+    return is_tilted == required
 
-def _check_head_tilted_right(rel_skeleton, required_poses, tolerances_data, user_metrics):
+def _check_head_tilted_right(rel, valid, required, tolerances_data, user_metrics):
     """Проверка: Глава наклонена надясно"""
-    required = required_poses["head_tilted_right"]
-    head_x = rel_skeleton.get('HEAD', {}).get('x', 0)
-    neck_x = rel_skeleton.get('NECK', {}).get('x', 0)
-
-    tol = tolerances_data['height_tol'] * 0.05
+    is_tilted = _x(rel, J.HEAD) < _x(rel, J.NECK) - tolerances_data['height_tol'] * 0.05
+    return is_tilted == required
 
-    is_tilted_left = head_x < neck_x - tol
-    is_ok = (is_tilted_left == required)
-    
-    if required:
-        msg = "✓" if is_ok else "✗ Наклонете главата надясно"
-    else:
-        msg = "✓" if is_ok else "✗ Не накланяйте главата надясно (върнете в неутрално)"
-
-    logger.debug(f"head_tilted_right: {is_tilted_left}, head_x={head_x:.0f}, neck_x={neck_x:.0f}, required={required}, ok={is_ok}")
-    return is_ok, msg
-
-def _check_spine_extended(rel_skeleton, required_poses, tolerances_data, user_metrics):
+def _check_spine_extended(rel, valid, required, tolerances_data, user_metrics):
     """Проверка: Гръбнак изпънат (spine extended)"""
-    required = required_poses["spine_extended"]
-    collar_z = (rel_skeleton.get('LEFT_COLLAR', {}).get('z', 0) + rel_skeleton.get('RIGHT_COLLAR', {}).get('z', 0)) / 2
-    torso_z = rel_skeleton.get('TORSO', {}).get('z', 0)
-
     # Изпънат гръбнак ако collar е по-назад от torso (защото по-голямо Z = назад)
-    is_extended = collar_z > torso_z
-    is_ok = (is_extended == required)
-    
-    if required:
-        msg = "✓" if is_ok else "✗ Изпънете гръбнака (приберете таза назад)"
-    else:
-        msg = "✓" if is_ok else "✗ Върнете в неутрално (не изпъвайте гръбнака прекомерно)"
-
-    logger.debug(f"spine_extended: is_extended={is_extended}, collar_z={collar_z:.0f}, torso_z={torso_z:.0f}, required={required}, ok={is_ok}")
-    return is_ok, msg
\ No newline at end of file
+    collar_z = (_z(rel, J.LEFT_COLLAR) + _z(rel, J.RIGHT_COLLAR)) / 2
+    return (collar_z > _z(rel, J.TORSO)) == required
+
+# Правилата за всички пози по име - едни и същи при оценката на един и на много потребители
+POSE_RULES = MappingProxyType({
+    'arms_down': PoseRule(_check_arms_down, _fail_message("✗ Спуснете ръцете си плътно до тялото")),
+    'arms_bent_waist': PoseRule(_check_arms_bent_waist, _fail_message(
+        "✗ Поставете китките върху кръста", "✗ Не поставяйте китките върху кръста (изпънете ръцете)")),
+    'arms_back': PoseRule(_check_arms_back, _fail_message("✗ Изпънете ръцете назад за разтягане (отворете гърдите)")),
+    'arms_forward': PoseRule(_check_arms_forward, _fail_message("✗ Изпънете ръце напред, близо една до друга, насочени към камерата")),
+    'arms_w_shape': PoseRule(_check_arms_w_shape, _fail_message("✗ Поставете китките близо до раменете (W форма)")),
+    'arms_y_shape': PoseRule(_check_arms_y_shape, _fail_message("✗ Изпънете ръцете нагоре (Y форма)")),
+    'legs_together': PoseRule(_check_legs_together, _fail_message("✗ Приближете краката си")),
+    'legs_apart': PoseRule(_check_legs_apart, _fail_message("✗ Разтворете краката си на ширината на раменете")),
+    'shoulders_retracted': PoseRule(_check_shoulders_retracted, _shoulders_retracted_message),
+    'pelvis_anterior': PoseRule(_check_pelvis_anterior, _fail_message("✗ Приберете таза назад")),
+    'pelvis_posterior': PoseRule(_check_pelvis_posterior, _fail_message("✗ Приберете таза напред")),
+    'head_retracted': PoseRule(_check_head_retracted, _fail_message(
+        "✗ Приберете брадичката назад", "✗ Върнете главата в неутрално положение (не прибирайте брадичката)")),
+    'head_tilted_left': PoseRule(_check_head_tilted_left, _fail_message(
+        "✗ Наклонете главата наляво", "✗ Не накланяйте главата наляво (върнете в неутрално)")),
+    'head_tilted_right': PoseRule(_check_head_tilted_right, _fail_message(
+        "✗ Наклонете главата надясно", "✗ Не накланяйте главата надясно (върнете в неутрално)")),
+    'spine_extended': PoseRule(_check_spine_extended, _fail_message(
+        "✗ Изпънете гръбнака (приберете таза назад)", "✗ Върнете в неутрално (не изпъвайте гръбнака прекомерно)")),
+})
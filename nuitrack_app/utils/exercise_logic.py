@@ -1,182 +1,276 @@
+import logging
 import time
+from types import MappingProxyType
 import custom_messagebox as messagebox
 
-from utils.calibration import calculate_tolerances
-from utils.check_angles import check_single_angle
-from utils.check_poses import (
-    _check_arms_down, _check_arms_bent_waist, _check_arms_back, _check_arms_forward, _check_arms_w_shape, _check_arms_y_shape, _check_legs_together, _check_legs_apart, _check_shoulders_retracted, _check_pelvis_anterior, _check_pelvis_posterior, _check_head_retracted, _check_head_tilted_left, _check_head_tilted_right, _check_spine_extended
-)
-from utils.skeleton_processing import normalize_skeleton
+import numpy as np
+
+from utils.batch_scoring import batch_feedback, compile_batch_exercise, evaluate_batch, stack_tolerances
+from utils.calibration import METRIC_NAMES
+from utils.joint_smoothing import create_joint_smoother
+from utils.skeleton_processing import JointIndex
+from utils.step_compiler import PoseEvaluation, compile_exercise, compile_thresholds, step_tolerances
+from utils.trace import tracer
 
 import globals
 
-def check_relative_pose(user_skeleton, required_poses, target_angles, tolerances, user_metrics):
-    """Проверка на позите и ъглите на потребителя спрямо зададени критерии."""
+# Стави, чиито позиции спрямо торса се логват в дебъг режим
+_CRITICAL_JOINTS = ('TORSO', 'RIGHT_SHOULDER', 'RIGHT_WRIST', 'LEFT_SHOULDER', 'LEFT_WRIST', 'RIGHT_HIP', 'LEFT_HIP', 'RIGHT_KNEE', 'LEFT_KNEE')
 
-    # Ако няма скелетни данни или метрики → прекъсваме
-    if not user_skeleton or not user_metrics:
-        globals.logger.debug("No skeleton or metrics available")
-        return 0.0, {"feedback": "No skeleton or metrics available"}
-    
-    feedback = {}      # Съобщения за обратна връзка
-    total_score = 0.0  # Общ резултат
-    checks = 0         # Брой извършени проверки
-
-    # Нормализиране на скелетните данни
-    rel_skeleton = normalize_skeleton(user_skeleton)
-
-    # Изчисляване на толеранси
-    tolerances_data = calculate_tolerances(tolerances, user_metrics)
-
-    # Дефиниране на проверките за пози
-    pose_checkers = {
-        'arms_down': _check_arms_down,
-        'arms_bent_waist': _check_arms_bent_waist,
-        'arms_back': _check_arms_back,
-        'arms_forward': _check_arms_forward,
-        'arms_w_shape': _check_arms_w_shape,
-        'arms_y_shape': _check_arms_y_shape,
-        'legs_together': _check_legs_together,
-        'legs_apart': _check_legs_apart,
-        'shoulders_retracted': _check_shoulders_retracted,
-        'pelvis_anterior': _check_pelvis_anterior,
-        'pelvis_posterior': _check_pelvis_posterior,
-        'head_retracted': _check_head_retracted,
-        'head_tilted_left': _check_head_tilted_left,
-        'head_tilted_right': _check_head_tilted_right,
-        'spine_extended': _check_spine_extended
-    }
-    
-    # Проверка на позите с постепенно натрупване на total_score и checks
-    for pose_name in required_poses:
-        if pose_name in ['arms_down', 'arms_forward'] and not required_poses.get(pose_name):
-            continue
-
-        if pose_name in pose_checkers:
-            is_ok, msg = pose_checkers[pose_name](rel_skeleton, required_poses, tolerances_data, user_metrics)
-            feedback[pose_name] = {'ok': is_ok, 'msg': msg}
-            total_score += 100 if is_ok else 0
-            checks += 1
-
-    # --- Проверка на ъглите ---
-    required_joints = {
-        "right_arm_angle": ["RIGHT_SHOULDER", "RIGHT_WRIST"],
-        "left_arm_angle": ["LEFT_SHOULDER", "LEFT_WRIST"],
-        "right_elbow_angle": ["RIGHT_SHOULDER", "RIGHT_ELBOW", "RIGHT_WRIST"],
-        "left_elbow_angle": ["LEFT_SHOULDER", "LEFT_ELBOW", "LEFT_WRIST"],
-        "right_knee_angle": ["RIGHT_HIP", "RIGHT_KNEE", "RIGHT_ANKLE"],
-        "left_knee_angle": ["LEFT_HIP", "LEFT_KNEE", "LEFT_ANKLE"]
-    }
-    
-    for angle_name, target in target_angles.items():
-        joints = required_joints.get(angle_name, [])
-
-        if not all(user_skeleton.get(j) for j in joints):  
-            feedback[angle_name] = {"ok": False, "msg": "✗ Няма скелетни данни"}
-            checks += 1
-            continue
-
-        fb, score, count = check_single_angle(angle_name, target, user_skeleton, rel_skeleton, tolerances)
-        feedback[angle_name] = fb
-        total_score += score
-        checks += count
-    
-    # Финални резултати
-    accuracy = total_score / checks if checks > 0 else 0.0
-    detailed_feedback = "\n".join([f"{k}: {v['msg']}" for k, v in feedback.items()])
-    all_ok = all(v['ok'] for v in feedback.values() if 'ok' in v)
-    
-    # Отпечатваме критични стави за дебъг
-    globals.logger.debug(f"Step {globals.current_step + 1}: Critical joints - {[(k, v) for k, v in rel_skeleton.items() if k in ['TORSO', 'RIGHT_SHOULDER', 'RIGHT_WRIST', 'LEFT_SHOULDER', 'LEFT_WRIST', 'RIGHT_HIP', 'LEFT_HIP', 'RIGHT_KNEE', 'LEFT_KNEE']]}")
+def get_step_plan(step_index=None):
+    """
+    Връща компилирания план за стъпка от текущото упражнение.
+    Плановете се компилират наново само при смяна на упражнението или на калибрирането.
+    """
+    if not globals.user_metrics:
+        return None
+
+    key = (globals.EXERCISE_JSON, globals.user_metrics, globals.user_thresholds)
+    if globals.compiled_steps_key is None or any(a is not b for a, b in zip(key, globals.compiled_steps_key)):
+        globals.compiled_steps = compile_exercise(globals.EXERCISE_JSON, globals.user_metrics, globals.user_thresholds)
+        globals.compiled_steps_key = key
+        globals.logger.info(f"Compiled {len(globals.compiled_steps)} step plans for {globals.EXERCISE_JSON['exercise_name']}")
+
+    index = globals.current_step if step_index is None else step_index
+    return globals.compiled_steps[index]
+
+def evaluate_current_frame():
+    """
+    Оценява кадрите на всички видими потребители с една групова проверка (за всяка стъпка, на която има потребители)
+    и публикува оценката на основния потребител в globals.latest_evaluation.
+    HUD-ът и логиката за задържане използват този резултат, вместо да оценяват кадъра сами.
+    Прогресът на останалите потребители се придвижва тук, в тяхното собствено състояние.
+    """
+    skeleton = globals.current_user_skeleton
+    if not globals.exercise_active or not skeleton or not globals.user_metrics:
+        globals.latest_evaluation = None
+        return None
+
+    frames = globals.user_skeletons or (skeleton,)
+    states = [user_tracker.state(frame.user_id) for frame in frames]
+    plans = user_tracker.batch_plans()
+
+    # Стъпка на всеки потребител - основният следва globals.current_step
+    steps = np.array([globals.current_step if frame is skeleton else state.current_step for frame, state in zip(frames, states)])
+    data = np.stack([frame.data for frame in frames])
+    valid = np.stack([frame.valid for frame in frames])
+    # Основният потребител ползва текущото калибриране, останалите - своите метрики, ако имат такива
+    metrics = np.array([
+        [(globals.user_metrics if frame is skeleton else state.metrics or globals.user_metrics)[name] for name in METRIC_NAMES]
+        for frame, state in zip(frames, states)
+    ])
+
+    evaluation = None
+    for step_index in np.unique(steps[steps < len(plans)]).tolist():
+        members = np.flatnonzero(steps == step_index)
+        plan = plans[step_index]
+        # Компилираните прагове: на основния потребител - от плана му, на останалите - от техните метрики
+        primary_tolerances = get_step_plan(step_index).tolerances_data
+        tolerances_data = stack_tolerances([
+            primary_tolerances if frames[member] is skeleton or states[member].metrics is None
+            else step_tolerances(plan.tolerances, states[member].metrics, states[member].thresholds)
+            for member in members.tolist()
+        ])
+        batch = evaluate_batch(plan, data[members], valid[members], dict(zip(METRIC_NAMES, metrics[members].T)), tolerances_data)
+
+        for row, member in enumerate(members.tolist()):
+            frame = frames[member]
+            is_primary = frame is skeleton
+            result = PoseEvaluation(
+                accuracy=float(batch.accuracy[row]),
+                # Подробни съобщения само за основния потребител
+                feedback=MappingProxyType(batch_feedback(plan, batch, row, valid[members]) if is_primary else {}),
+                all_ok=bool(batch.all_ok[row]),
+                timestamp=frame.timestamp,
+                step_index=step_index
+            )
+            if is_primary:
+                evaluation = result
+                # Отпечатваме критични стави за дебъг
+                if globals.logger.isEnabledFor(logging.DEBUG):
+                    critical = [(name, batch.rel[row, JointIndex[name]].round().tolist()) for name in _CRITICAL_JOINTS if frame.valid[JointIndex[name]]]
+                    globals.logger.debug(f"Step {step_index + 1}: Critical joints - {critical}")
+            else:
+                states[member].on_evaluation(result, plan.duration, len(plans))
+
+    globals.latest_evaluation = evaluation
+    return evaluation
+
+class StepProgress:
+    """
+    Машина на състоянията за задържане на позата в текущата стъпка.
+    Напредва при всяка нова оценка на кадър и мери задържането по времето на кадрите от сензора,
+    така че стъпката завършва в същия кадър, в който е достигната нужната продължителност.
+    """
+
+    # Минимална точност, при която позата се счита за задържана
+    MIN_ACCURACY = 80.0
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Нулира задържането (нова стъпка или загубена поза)."""
+        self.hold_start = None      # Време на кадъра, в който е започнало задържането
+        self.hold_duration = 0.0    # Натрупана продължителност на задържане
+        self.last_timestamp = None  # Време на последния обработен кадър
+
+    def on_evaluation(self, evaluation, duration):
+        """Обработва оценка на кадър. Връща True, ако стъпката е завършена в този кадър."""
+        # Един и същ кадър не се брои два пъти
+        if self.last_timestamp is not None and evaluation.timestamp <= self.last_timestamp:
+            return False
+        self.last_timestamp = evaluation.timestamp
+
+        if evaluation.accuracy >= self.MIN_ACCURACY and evaluation.all_ok:
+            if self.hold_start is None:
+                self.hold_start = evaluation.timestamp
+            self.hold_duration = evaluation.timestamp - self.hold_start
+        else:
+            self.hold_start = None
+            self.hold_duration = 0.0
+
+        # Стъпката е завършена при задържане за необходимата продължителност
+        if self.hold_duration >= duration:
+            self.reset()
+            return True
+        return False
+
+# Глобално състояние на задържането за текущата стъпка
+step_progress = StepProgress()
+
+# Колко дълго (s) се пази състоянието на потребител, който вече не се вижда
+USER_STATE_TIMEOUT = 5.0
+
+class UserState:
+    """
+    Състояние на един проследен потребител по Nuitrack ID: метрики, стъпка, задържане и изглаждане на ставите.
+    За основния потребител стъпката и задържането са globals.current_step и step_progress.
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.metrics = None          # Собствени метрики; без тях се ползват тези на калибрирания потребител
+        self.thresholds = None       # Праговете, компилирани от собствените метрики (compile_thresholds)
+        self.smoother = create_joint_smoother()
+        self.last_seen = 0.0
+        self.restart()
 
-    return accuracy, {"feedback": detailed_feedback, "all_ok": all_ok}
+    def restart(self):
+        self.current_step = 0
+        self.progress = StepProgress()
+        self.completed = False
 
-def update_exercise_progress():
-    """Актуализира прогреса на упражнението с проверка на относителни пози."""
-    # Декларира глобални променливи за състоянието на упражнението и скелета
+    def on_evaluation(self, evaluation, duration, step_count):
+        """Придвижва задържането на допълнителен потребител; при завършена стъпка минава към следващата."""
+        if self.completed or not self.progress.on_evaluation(evaluation, duration):
+            return
+        tracer.instant("step_completed", "exercise", {"step": self.current_step + 1, "user": self.user_id})
+        globals.logger.info(f"User {self.user_id}: step {self.current_step + 1} completed")
+        self.current_step += 1
+        if self.current_step >= step_count:
+            self.completed = True
+            globals.logger.info(f"User {self.user_id}: exercise completed")
+
+class UserTracker:
+    """Състоянията на всички проследени потребители и груповите планове за оценка на текущото упражнение."""
+
+    def __init__(self):
+        self.users = {}
+        self._plans = None
+        self._plans_exercise = None
+
+    def reset(self):
+        self.users.clear()
+
+    def restart_exercise(self):
+        """Започва упражнението отначало за всички потребители."""
+        for state in self.users.values():
+            state.restart()
+
+    def state(self, user_id):
+        """Състоянието на потребителя; създава ново за нов потребител."""
+        state = self.users.get(user_id)
+        if state is None:
+            state = self.users[user_id] = UserState(user_id)
+            globals.logger.info(f"Tracking user {user_id}")
+        return state
+
+    def update(self, frames):
+        """Отбелязва видимите в кадъра потребители и премахва изчезналите преди USER_STATE_TIMEOUT. Връща състоянията им в реда на кадрите."""
+        if not frames:
+            return []
+        now = max(frame.timestamp for frame in frames)
+        states = []
+        for frame in frames:
+            state = self.state(frame.user_id)
+            state.last_seen = now
+            states.append(state)
+
+        for user_id in [user_id for user_id, state in self.users.items() if now - state.last_seen > USER_STATE_TIMEOUT]:
+            del self.users[user_id]
+            globals.logger.info(f"User {user_id} lost")
+        return states
+
+    def set_metrics(self, user_id, metrics, thresholds=None):
+        """Запазва калибрираните метрики и праговете (компилират се, ако не са подадени) в състоянието на потребителя."""
+        state = self.users.get(user_id)
+        if state is not None:
+            state.metrics = metrics
+            state.thresholds = thresholds or compile_thresholds(metrics)
+
+    def batch_plans(self):
+        """Груповите планове на стъпките на текущото упражнение (компилират се при смяна на упражнението)."""
+        if self._plans_exercise is not globals.EXERCISE_JSON:
+            self._plans = compile_batch_exercise(globals.EXERCISE_JSON)
+            self._plans_exercise = globals.EXERCISE_JSON
+        return self._plans
+
+    def group_status(self):
+        """Кратък текст с напредъка на допълнителните потребители (None при един потребител)."""
+        others = [state for state in self.users.values() if state.user_id != globals.primary_user_id]
+        if not others or not globals.exercise_active:
+            return None
+        step_count = len(globals.EXERCISE_JSON["steps"])
+        return "Група: " + " | ".join(
+            f"#{state.user_id} {'✓' if state.completed else f'{state.current_step + 1}/{step_count}'}" for state in others
+        )
+
+# Глобални състояния на потребителите
+user_tracker = UserTracker()
+
+def update_exercise_progress(evaluation):
+    """Актуализира прогреса на упражнението с оценката на новия кадър."""
     
-    # Проверява дали упражнението е активно и има ли скелетни данни и метрики
-    if not globals.exercise_active or not globals.current_user_skeleton or not globals.user_metrics or not globals.calibration_completed:
-        globals.logger.debug("No exercise active, skeleton, metrics, or calibration incomplete")
+    # Проверява дали упражнението е активно и има ли оценка за текущата стъпка
+    if not globals.exercise_active or not globals.user_metrics or not globals.calibration_completed:
+        globals.logger.debug("No exercise active, metrics, or calibration incomplete")
+        return
+    if evaluation is None or evaluation.step_index != globals.current_step:
+        globals.logger.debug("No evaluation available for the current step")
         return
-    
-    # Взема данните за текущата стъпка от упражнението
-    current_step_data = globals.EXERCISE_JSON["steps"][globals.current_step]
-    # Извлича изискваните пози (напр. arms_down, legs_together)
-    required_poses = current_step_data.get("required_poses", {})
-    # Извлича целевите ъгли (напр. ъгъл на ръката)
-    target_angles = current_step_data.get("target_angles", {})
-    # Взема толерансите за грешки (ъглов и дистанционен)
-    tolerances = current_step_data.get("tolerance", {"angle_tolerance": 20, "distance_tolerance": 0.2})
-    
-    # Взема Z координатата на торса (разстояние от камерата)
-    user_z = globals.current_user_skeleton.get('TORSO', {}).get('z', 1500)
-
-    # Записва дебъг информация за стъпката, разстоянието и толерансите
-    globals.logger.debug(f"Step {globals.current_step + 1}: user_z={user_z:.0f}, tolerances={tolerances}")
-
-    # Проверява точността на позата спрямо изискванията
-    accuracy, details = check_relative_pose(globals.current_user_skeleton, required_poses, target_angles, tolerances, globals.user_metrics)
-    # Извлича детайлна обратна връзка за позите
-    detailed_feedback = details["feedback"]
-    # Проверява дали всички пози са коректни
-    all_ok = details["all_ok"]
-    
-    # Изчислява изминалото време за текущата стъпка
-    elapsed_time = time.time() - globals.step_start_time
-    # Взема продължителността на стъпката
-    duration = current_step_data["duration_seconds"]
-    # Изчислява оставащото време
-    remaining_time = max(0, duration - elapsed_time)
-
-    # Задава минимална точност и време за завършване на стъпката
-    min_accuracy = 80.0
-
-    # Логика за задържане на позата
-    current_time = time.time()
-    if not hasattr(globals, 'hold_start_time'):
-        globals.hold_start_time = [0]  # Инициализиране при първо изпълнение
-    if not hasattr(globals, 'hold_duration'):
-        globals.hold_duration = [0]  # Натрупана продължителност на задържане
-    
-    if accuracy >= min_accuracy and all_ok:
-        if globals.hold_start_time[0] == 0:
-            globals.hold_start_time[0] = current_time
-        globals.hold_duration[0] = current_time - globals.hold_start_time[0]
-    else:
-        globals.hold_start_time[0] = 0
-        globals.hold_duration[0] = 0
 
-    # Проверява дали стъпката е завършена (задържане за необходимата продължителност - точност, време, пози)
-    step_complete = (globals.hold_duration[0] >= duration)
-        
-    try:
-        # Формира текст за точността
-        accuracy_text = f"Точност на изпълнение: {accuracy:.1f}% (need {min_accuracy}%)"
-        if all_ok:
-            accuracy_text += " ✓ Всички пози са ОК!"
-        else:
-            accuracy_text += " ✗ Коригирайте позите"
-        
-        # Ако стъпката е завършена, преминава към следващата
-        if step_complete:
-            globals.hold_start_time[0] = 0
-            globals.hold_duration[0] = 0
-            advance_to_next_step()
-            
-    except Exception as e:
-        globals.logger.error(f"GUI update error: {e}")
+    # Взема компилирания план за текущата стъпка от упражнението
+    plan = get_step_plan()
+
+    # Записва дебъг информация за стъпката и задържането
+    globals.logger.debug(f"Step {globals.current_step + 1}: accuracy={evaluation.accuracy:.1f}, all_ok={evaluation.all_ok}, hold={step_progress.hold_duration:.2f}/{plan.duration}s")
+
+    # Ако стъпката е завършена в този кадър, преминава към следващата
+    if step_progress.on_evaluation(evaluation, plan.duration):
+        advance_to_next_step()
 
 def advance_to_next_step():
     """Преминаване към следващата стъпка на упражнението."""
     
+    tracer.instant("step_completed", "exercise", {"step": globals.current_step + 1})
+    
     # Увеличава индекса на текущата стъпка
     globals.current_step += 1
     # Записва времето на започване на новата стъпка
     globals.step_start_time = time.time()
-    # Ресетва hold timers за новата стъпка
-    globals.hold_start_time[0] = 0
-    globals.hold_duration[0] = 0
+    # Ресетва задържането за новата стъпка
+    step_progress.reset()
     
     # Проверява дали всички стъпки са завършени
     if globals.current_step >= len(globals.EXERCISE_JSON["steps"]):
@@ -186,11 +280,9 @@ def advance_to_next_step():
         # Пускане на звук за минато упражнение
         globals.sound_manager.play_exercise_complete()
         
-        messagebox.showinfo("Упражнението е завършено!", 
-                          "Поздравления! Вие изпълнихте всички стъпки успешно! 🎉", False)
-        globals.app.exercise_btn.config(text="Стартиране на упражнение", bg="blue")
-        
-        globals.app.accuracy_label.config(text="Упражнението е завършено!")
+        # Диалогът се показва от Tk нишката, за да не блокира цикъла на кадрите
+        if globals.app:
+            globals.app.root.after(0, _show_exercise_completed)
         
         print("🎉 === EXERCISE COMPLETED === 🎉")
     else:
@@ -200,3 +292,10 @@ def advance_to_next_step():
         # Четене на новите инструкции на стъпката
         new_step = globals.EXERCISE_JSON["steps"][globals.current_step]
         globals.tts_manager.speak_step(new_step["instructions"])
+
+def _show_exercise_completed():
+    """Показва съобщение за завършено упражнение и връща бутона в начално състояние."""
+    globals.app.exercise_btn.config(text="Стартиране на упражнение", bg="blue")
+    messagebox.showinfo("Упражнението е завършено!", 
+                      "Поздравления! Вие изпълнихте всички стъпки успешно! 🎉", False)
+    globals.app.accuracy_label.config(text="Упражнението е завършено!")
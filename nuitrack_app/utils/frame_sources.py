@@ -0,0 +1,377 @@
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import namedtuple
+
+import numpy as np
+
+from utils.skeleton_processing import CONFIDENCE, JOINT_COUNT, JOINT_NAMES, JointIndex
+from utils.session_recording import SkeletonRecordingReader
+
+import globals
+
+# Структури, повтарящи формата на py_nuitrack, за да работи останалият код без промени
+Joint = namedtuple('Joint', ['type', 'confidence', 'real', 'projection'])
+Skeleton = namedtuple('Skeleton', ['user_id'] + [name.lower() for name in JOINT_NAMES])
+SkeletonResult = namedtuple('SkeletonResult', ['timestamp', 'skeletons'])
+
+# Размер на цветния кадър и параметри на проекцията (същите като в project_world_to_screen)
+FRAME_SIZE = (480, 640)
+_FX, _FY, _CX, _CY = 400.0, 400.0, 320.0, 240.0
+
+# Увереност на синтетичните стави
+SYNTHETIC_CONFIDENCE = 0.75
+
+class FrameSource(ABC):
+    """
+    Източник на кадри с интерфейса на py_nuitrack.Nuitrack, който ползват run_nuitrack и калибрирането:
+    init/create_modules/run/release за жизнения цикъл и update/get_skeleton/get_color_data за кадрите.
+    Източник без update/get_skeleton/get_color_data не може да се създаде.
+    """
+
+    def init(self):
+        pass
+
+    def get_device_list(self):
+        return []
+
+    def set_device(self, device):
+        pass
+
+    def create_modules(self):
+        pass
+
+    def run(self):
+        pass
+
+    @abstractmethod
+    def update(self):
+        """Чете следващия кадър."""
+
+    @abstractmethod
+    def get_skeleton(self):
+        """Скелетите от последния кадър (SkeletonResult или py_nuitrack резултат)."""
+
+    @abstractmethod
+    def get_color_data(self):
+        """Цветният кадър (H, W, 3) uint8."""
+
+    def get_depth_to_color_frame(self):
+        return None
+
+    def release(self):
+        pass
+
+class NuitrackSource(FrameSource):
+    """Истинският сензор чрез Nuitrack SDK. SDK-то се импортира едва при създаване на източника."""
+
+    def __init__(self):
+        from PyNuitrack import py_nuitrack
+        self._nuitrack = py_nuitrack.Nuitrack()
+
+    def init(self):
+        self._nuitrack.init()
+
+    def get_device_list(self):
+        return self._nuitrack.get_device_list()
+
+    def set_device(self, device):
+        self._nuitrack.set_device(device)
+
+    def create_modules(self):
+        self._nuitrack.create_modules()
+
+    def run(self):
+        self._nuitrack.run()
+
+    def update(self):
+        self._nuitrack.update()
+
+    def get_skeleton(self):
+        return self._nuitrack.get_skeleton()
+
+    def get_color_data(self):
+        return self._nuitrack.get_color_data()
+
+    def get_depth_to_color_frame(self):
+        return self._nuitrack.get_depth_to_color_frame()
+
+    def release(self):
+        self._nuitrack.release()
+
+def _project(xyz):
+    """Екранни координати (x, y) на стави с форма (20, 3) по модела на project_world_to_screen."""
+    projection = np.zeros((len(xyz), 2))
+    z = xyz[:, 2]
+    in_front = z > 100
+    projection[in_front, 0] = xyz[in_front, 0] * _FX / z[in_front] + _CX
+    projection[in_front, 1] = -xyz[in_front, 1] * _FY / z[in_front] + _CY
+    return projection
+
+def _build_skeleton(user_id, joints, projection):
+    """Превръща (20, 4) масив и (20, 2) проекции в Skeleton с Joint елементи като тези на py_nuitrack."""
+    return Skeleton(user_id, *(
+        Joint(i, float(joints[i, CONFIDENCE]), joints[i, :3].copy(), projection[i])
+        for i in range(JOINT_COUNT)
+    ))
+
+class _PacedSource(FrameSource):
+    """Общо за записаните и синтетичните източници: темпо на кадрите и празен цветен кадър."""
+
+    def __init__(self, fps, realtime, frame_size):
+        self.fps = fps
+        self.realtime = realtime
+        self.frame_size = frame_size
+        self.frame_index = -1
+        self._next_frame_time = None
+
+    def _wait_for_next_frame(self):
+        """При realtime=True изчаква до времето на следващия кадър, иначе връща веднага."""
+        if not self.realtime or not self.fps:
+            return
+        now = time.perf_counter()
+        if self._next_frame_time is None or now - self._next_frame_time > 1.0:
+            self._next_frame_time = now
+        elif self._next_frame_time > now:
+            time.sleep(self._next_frame_time - now)
+        self._next_frame_time += 1.0 / self.fps
+
+    def get_color_data(self):
+        # Нов масив за всеки кадър - рисуването става директно върху него
+        return np.zeros(self.frame_size + (3,), dtype=np.uint8)
+
+class ReplaySource(_PacedSource):
+    """Възпроизвежда запис, направен със SkeletonRecorder. При fps=None се ползва темпото от записа."""
+
+    def __init__(self, path, fps=None, realtime=True, loop=True, frame_size=FRAME_SIZE):
+        self.reader = SkeletonRecordingReader(path)
+        if not len(self.reader):
+            raise ValueError(f"Skeleton recording is empty: {path}")
+        timestamps = self.reader.timestamps
+        duration = float(timestamps[-1] - timestamps[0]) if len(timestamps) > 1 else 0.0
+        if fps is None:
+            fps = (len(timestamps) - 1) / duration if duration > 0 else 30.0
+        super().__init__(fps, realtime, frame_size)
+        self.loop = loop
+        self.loop_count = 0
+        # Всяко повторение измества времената с продължителността на записа плюс един кадър,
+        # за да растат монотонно - иначе прогресът на стъпката пропуска кадрите с "по-старо" време
+        self.loop_period = duration + 1.0 / fps
+        self._skeleton = None
+
+    def update(self):
+        self._wait_for_next_frame()
+        self.frame_index += 1
+        if self.frame_index >= len(self.reader):
+            if not self.loop:
+                self._skeleton = SkeletonResult(0, [])
+                return
+            self.frame_index = 0
+            self.loop_count += 1
+
+        record = self.reader.records[self.frame_index]
+        joints = record['joints']
+        projection = record['projection'] if self.reader.with_projection else _project(joints[:, :3])
+        user_id = int(record['user_id'])
+        # Времената се пренасят в микросекунди, както ги подава сензорът
+        timestamp = float(record['timestamp']) + self.loop_count * self.loop_period
+        self._skeleton = SkeletonResult(int(timestamp * 1e6), [_build_skeleton(user_id, joints, projection)])
+
+    def get_skeleton(self):
+        return self._skeleton
+
+def _neutral_pose():
+    """Изправена стойка (мм, торсът в началото): ръце спуснати, крака събрани, глава и рамене леко напред."""
+    pose = np.zeros((JOINT_COUNT, 3))
+    pose[JointIndex.HEAD] = (0, 560, -40)
+    pose[JointIndex.NECK] = (0, 400, -25)
+    pose[JointIndex.TORSO] = (0, 0, 0)
+    pose[JointIndex.WAIST] = (0, -200, 0)
+    for side, sign in (('LEFT', -1), ('RIGHT', 1)):
+        pose[JointIndex[f'{side}_COLLAR']] = (sign * 60, 380, -15)
+        pose[JointIndex[f'{side}_SHOULDER']] = (sign * 180, 350, -20)
+        pose[JointIndex[f'{side}_ELBOW']] = (sign * 195, 75, -20)
+        pose[JointIndex[f'{side}_WRIST']] = (sign * 210, -190, -20)
+        pose[JointIndex[f'{side}_HAND']] = (sign * 215, -260, -20)
+        pose[JointIndex[f'{side}_HIP']] = (sign * 100, -250, 0)
+        pose[JointIndex[f'{side}_KNEE']] = (sign * 95, -700, 0)
+        pose[JointIndex[f'{side}_ANKLE']] = (sign * 90, -1150, 0)
+    return pose
+
+def _set_arms(pose, elbow, wrist):
+    """Поставя двете ръце симетрично; координатите са за дясната ръка (положително X)."""
+    for side, sign in (('LEFT', -1), ('RIGHT', 1)):
+        mirror = np.array((sign, 1, 1))
+        wrist_pos = np.multiply(wrist, mirror)
+        pose[JointIndex[f'{side}_ELBOW']] = np.multiply(elbow, mirror)
+        pose[JointIndex[f'{side}_WRIST']] = wrist_pos
+        pose[JointIndex[f'{side}_HAND']] = wrist_pos + (wrist_pos - pose[JointIndex[f'{side}_ELBOW']]) * 0.25
+
+def _bend_elbow(pose, side, angle):
+    """Завърта предмишницата около лакътя в равнината на ръката, така че ъгълът в лакътя да е `angle` градуса."""
+    shoulder, elbow, wrist = (JointIndex[f'{side}_{name}'] for name in ('SHOULDER', 'ELBOW', 'WRIST'))
+    upper = pose[shoulder] - pose[elbow]
+    forearm = pose[wrist] - pose[elbow]
+    axis = upper / np.linalg.norm(upper)
+    # Посока, перпендикулярна на рамото, в която сочи предмишницата (или навън при изпъната ръка)
+    normal = forearm - forearm.dot(axis) * axis
+    if np.linalg.norm(normal) < 1e-6:
+        normal = np.cross(axis, (0.0, 0.0, 1.0))
+    normal /= np.linalg.norm(normal)
+    theta = np.radians(angle)
+    new_forearm = np.linalg.norm(forearm) * (np.cos(theta) * axis + np.sin(theta) * normal)
+    pose[wrist] = pose[elbow] + new_forearm
+    pose[JointIndex[f'{side}_HAND']] = pose[wrist] + new_forearm * 0.25
+
+def step_pose(step_data=None):
+    """
+    Параметрична поза (20, 3) в мм спрямо торса, която изпълнява required_poses на стъпка от exercises.py.
+    Без стъпка връща неутралната стойка за калибриране.
+    """
+    pose = _neutral_pose()
+    required = (step_data or {}).get("required_poses", {})
+    upper = [JointIndex.HEAD, JointIndex.NECK, JointIndex.LEFT_COLLAR, JointIndex.RIGHT_COLLAR,
+             JointIndex.LEFT_SHOULDER, JointIndex.RIGHT_SHOULDER]
+
+    # Гръбнак и таз
+    if required.get("spine_extended"):
+        pose[upper, 2] += 55
+    if required.get("pelvis_anterior"):
+        pose[[JointIndex.LEFT_HIP, JointIndex.RIGHT_HIP], 2] += 90
+    if required.get("pelvis_posterior"):
+        pose[[JointIndex.LEFT_HIP, JointIndex.RIGHT_HIP], 2] -= 40
+
+    # Рамене и глава (спрямо ключицата)
+    collar_z = pose[JointIndex.LEFT_COLLAR, 2]
+    if required.get("shoulders_retracted"):
+        pose[[JointIndex.LEFT_SHOULDER, JointIndex.RIGHT_SHOULDER], 2] = collar_z + 45
+    if required.get("head_retracted"):
+        pose[JointIndex.HEAD, 2] = collar_z + 45
+    if required.get("head_tilted_left"):
+        pose[JointIndex.HEAD, :2] = (90, 540)
+    elif required.get("head_tilted_right"):
+        pose[JointIndex.HEAD, :2] = (-90, 540)
+
+    # Ръце (координатите са за дясната ръка)
+    shoulder_z = pose[JointIndex.RIGHT_SHOULDER, 2]
+    if required.get("arms_y_shape"):
+        _set_arms(pose, (330, 600, shoulder_z), (460, 860, shoulder_z))
+    elif required.get("arms_w_shape"):
+        _set_arms(pose, (340, 130, shoulder_z), (360, 350, shoulder_z))
+    elif required.get("arms_forward"):
+        _set_arms(pose, (180, 350, shoulder_z - 270), (180, 350, shoulder_z - 540))
+    elif required.get("arms_bent_waist"):
+        _set_arms(pose, (320, 0, 60), (70, -100, 60))
+    elif required.get("arms_back"):
+        _set_arms(pose, (200, 80, shoulder_z + 120), (215, -170, shoulder_z + 260))
+
+    # Крака
+    if required.get("legs_apart"):
+        for side, sign in (('LEFT', -1), ('RIGHT', 1)):
+            pose[JointIndex[f'{side}_KNEE'], 0] = sign * 190
+            pose[JointIndex[f'{side}_ANKLE'], 0] = sign * 270
+
+    # Ъгли в лактите от target_angles
+    for side in ('LEFT', 'RIGHT'):
+        angle = (step_data or {}).get("target_angles", {}).get(f"{side.lower()}_elbow_angle")
+        if angle is not None:
+            _bend_elbow(pose, side, angle)
+
+    return pose
+
+class SyntheticSource(_PacedSource):
+    """
+    Генерира скелетни кадри без сензор по стъпките на упражнение от exercises.py.
+
+    При follow_session=True позата следва текущата стъпка на активното упражнение (неутрална стойка иначе),
+    а без сесия стъпките се редуват по тяхната продължителност. Шумът е в мм, dropout е вероятността
+    отделна става да се изгуби, а frame_dropout - целият скелет. Допълнителните потребители стоят встрани.
+    """
+
+    def __init__(self, exercise=None, fps=30.0, realtime=True, noise_mm=5.0, dropout=0.001, frame_dropout=0.0,
+                 users=1, follow_session=True, distance_mm=2500.0, seed=None, frame_size=FRAME_SIZE):
+        super().__init__(fps, realtime, frame_size)
+        self.exercise = exercise
+        self.noise_mm = noise_mm
+        self.dropout = dropout
+        self.frame_dropout = frame_dropout
+        self.users = max(1, users)
+        self.follow_session = follow_session
+        self.rng = np.random.default_rng(seed)
+        self.start_time = time.time()
+
+        # Позиция на всеки потребител спрямо камерата - основният е в центъра
+        self._offsets = np.array([(((i + 1) // 2) * 800.0 * (-1) ** i, 0.0, distance_mm) for i in range(self.users)])
+        self._poses = {}                                       # Кеш на позите по стъпки
+        self._joints = np.empty((self.users, JOINT_COUNT, 4))  # Буфер за ставите на всички потребители
+        self._skeleton = None
+
+    def current_step_data(self):
+        """Стъпката, чиято поза се генерира в момента, или None за неутрална стойка."""
+        if self.follow_session and self.exercise is None:
+            if not globals.exercise_active:
+                return None
+            steps = globals.EXERCISE_JSON["steps"]
+            return steps[min(globals.current_step, len(steps) - 1)]
+
+        exercise = self.exercise or globals.EXERCISE_JSON
+        steps = exercise["steps"]
+        cycle = sum(step.get("duration_seconds", 1) + 1 for step in steps)
+        elapsed = (self.frame_index / self.fps) % cycle
+        for step in steps:
+            elapsed -= step.get("duration_seconds", 1) + 1
+            if elapsed < 0:
+                return step
+        return steps[-1]
+
+    def _pose_for(self, step_data):
+        key = id(step_data)
+        if key not in self._poses:
+            self._poses[key] = step_pose(step_data)
+        return self._poses[key]
+
+    def update(self):
+        self._wait_for_next_frame()
+        self.frame_index += 1
+        timestamp = int((self.start_time + self.frame_index / self.fps) * 1e6)
+
+        if self.frame_dropout and self.rng.random() < self.frame_dropout:
+            self._skeleton = SkeletonResult(timestamp, [])
+            return
+
+        pose = self._pose_for(self.current_step_data())
+        joints = self._joints
+        joints[:, :, :3] = pose
+        joints[:, :, :3] += self._offsets[:, None, :]
+        if self.noise_mm:
+            joints[:, :, :3] += self.rng.normal(0.0, self.noise_mm, (self.users, JOINT_COUNT, 3))
+        joints[:, :, CONFIDENCE] = SYNTHETIC_CONFIDENCE
+        if self.dropout:
+            joints[:, :, CONFIDENCE][self.rng.random((self.users, JOINT_COUNT)) < self.dropout] = 0.0
+
+        skeletons = [_build_skeleton(user + 1, joints[user], _project(joints[user, :, :3])) for user in range(self.users)]
+        self._skeleton = SkeletonResult(timestamp, skeletons)
+
+    def get_skeleton(self):
+        return self._skeleton
+
+def create_frame_source(spec=None):
+    """
+    Създава източник на кадри по описание (или NUITRACK_FRAME_SOURCE):
+    "nuitrack" (по подразбиране), "synthetic[:брой потребители]" или "replay:<път до запис>".
+    """
+    spec = spec or os.getenv("NUITRACK_FRAME_SOURCE") or "nuitrack"
+    kind, _, argument = spec.partition(":")
+    kind = kind.strip().lower()
+
+    if kind == "nuitrack":
+        return NuitrackSource()
+    if kind == "synthetic":
+        globals.logger.info(f"Using synthetic frame source ({argument or 1} users)")
+        return SyntheticSource(users=int(argument) if argument else 1)
+    if kind == "replay":
+        if not argument:
+            raise ValueError("Replay frame source needs a recording path (replay:<path>)")
+        globals.logger.info(f"Replaying skeleton recording {argument}")
+        return ReplaySource(argument)
+    raise ValueError(f"Unknown frame source: {spec}")
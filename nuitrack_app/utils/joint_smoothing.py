@@ -0,0 +1,209 @@
+import math
+import os
+
+import numpy as np
+
+from utils.skeleton_processing import CONFIDENCE, JOINT_COUNT, MIN_JOINT_CONFIDENCE
+
+import globals
+
+# Избор на изглаждане: off (по подразбиране), one_euro или kalman
+SMOOTHING_ENV = "NUITRACK_SMOOTHING"
+DEFAULT_SMOOTHING = "off"
+
+# Колко дълго (s) се предсказва позицията на става, която сензорът е изгубил
+MAX_GAP_SECONDS = 0.25
+
+# Интервал между кадрите, ако времето на кадъра не нараства (първи или повторен кадър)
+DEFAULT_FRAME_INTERVAL = 1 / 30
+
+# Тегла по confidence: от MIN_CONFIDENCE_WEIGHT при прага за засичане до 1 при CONFIDENCE_FULL_WEIGHT
+CONFIDENCE_FULL_WEIGHT = 0.7
+MIN_CONFIDENCE_WEIGHT = 0.1
+
+# One-Euro филтър: гранична честота в покой (Hz), нарастване с скоростта (Hz за мм/s) и за производната
+ONE_EURO_MIN_CUTOFF = 1.0
+ONE_EURO_BETA = 0.007
+ONE_EURO_D_CUTOFF = 1.0
+
+# Kalman филтър с постоянна скорост: шум на измерването (мм) и на ускорението (мм/s²)
+KALMAN_MEASUREMENT_NOISE_MM = 10.0
+KALMAN_ACCELERATION_NOISE = 1000.0
+KALMAN_INITIAL_VELOCITY_STD = 500.0
+
+def confidence_weight(confidence):
+    """Тегло 0-1 на измерването според confidence на ставите."""
+    weight = (confidence - MIN_JOINT_CONFIDENCE) / (CONFIDENCE_FULL_WEIGHT - MIN_JOINT_CONFIDENCE)
+    return np.clip(weight, MIN_CONFIDENCE_WEIGHT, 1.0)
+
+class JointSmoother:
+    """
+    Изглаждане на всички 20 стави наведнъж върху масиви - без отделен Python филтър за всяка става.
+
+    Общата логика е тук: тегла по confidence, предсказване на изгубени стави до MAX_GAP_SECONDS
+    и нулиране при смяна на потребителя. Наследниците реализират самия филтър в `_start` и `_step`.
+    """
+
+    name = None
+
+    def __init__(self, max_gap=MAX_GAP_SECONDS):
+        self.max_gap = max_gap
+        self.position = np.zeros((JOINT_COUNT, 3))
+        self.confidence = np.zeros(JOINT_COUNT)
+        self.last_seen = np.zeros(JOINT_COUNT)
+        self.tracked = np.zeros(JOINT_COUNT, dtype=bool)
+        self.reset()
+
+    def reset(self):
+        self.tracked.fill(False)
+        self.timestamp = None
+        self.user_id = None
+
+    def apply(self, frame):
+        """
+        Изглажда кадъра (SkeletonFrame) на място. Кратко изгубените стави получават предсказана позиция
+        и последния си confidence и се маркират като валидни. Връща маската на предсказаните стави.
+        """
+        if frame.user_id != self.user_id:
+            self.reset()
+            self.user_id = frame.user_id
+
+        now = frame.timestamp
+        dt = now - self.timestamp if self.timestamp is not None else 0.0
+        if dt <= 0:
+            dt = DEFAULT_FRAME_INTERVAL
+        self.timestamp = now
+
+        measured = frame.data[:, :3]
+        valid = frame.valid
+        weight = confidence_weight(frame.data[:, CONFIDENCE])
+
+        # Филтриране на следените стави и начало на следене за новите
+        self._step(measured, weight, valid & self.tracked, dt)
+        new = valid & ~self.tracked
+        if new.any():
+            self.position[new] = measured[new]
+            self._start(new, weight)
+
+        self.last_seen[valid] = now
+        self.confidence[valid] = frame.data[valid, CONFIDENCE]
+        self.tracked |= valid
+
+        # Изгубените стави се предсказват до max_gap, след това се спира следенето им
+        gap = self.tracked & ~valid
+        self.tracked &= ~(gap & (now - self.last_seen > self.max_gap))
+        predicted = gap & self.tracked
+
+        frame.data[self.tracked, :3] = self.position[self.tracked]
+        frame.data[predicted, CONFIDENCE] = self.confidence[predicted]
+        frame.valid[predicted] = True
+        return predicted
+
+    def _start(self, joints, weight):
+        """Начално състояние за ставите в маската `joints` (позицията вече е записана)."""
+        pass
+
+    def _step(self, measured, weight, update, dt):
+        """Предсказва всички следени стави и коригира тези в `update` с измерването."""
+        self.position[update] = measured[update]
+
+class OneEuroSmoother(JointSmoother):
+    """
+    One-Euro филтър: нискочестотен филтър, чиято гранична честота расте със скоростта на ставата -
+    силно изглаждане в покой (стабилно задържане) и малко закъснение при бързо движение.
+    По-нисък confidence намалява теглото на новото измерване.
+    """
+
+    name = "one_euro"
+
+    def __init__(self, min_cutoff=ONE_EURO_MIN_CUTOFF, beta=ONE_EURO_BETA, d_cutoff=ONE_EURO_D_CUTOFF, max_gap=MAX_GAP_SECONDS):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.derivative = np.zeros((JOINT_COUNT, 3))
+        super().__init__(max_gap)
+
+    def _start(self, joints, weight):
+        self.derivative[joints] = 0.0
+
+    def _step(self, measured, weight, update, dt):
+        # Изгубените стави продължават с последната оценка на скоростта
+        gap = self.tracked & ~update
+        self.position[gap] += self.derivative[gap] * dt
+
+        derivative = (measured - self.position) / dt
+        derivative = self.derivative + _alpha(self.d_cutoff, dt) * (derivative - self.derivative)
+        cutoff = self.min_cutoff + self.beta * np.linalg.norm(derivative, axis=1)
+        alpha = (_alpha(cutoff, dt) * weight)[:, None]
+
+        mask = update[:, None]
+        self.position = np.where(mask, self.position + alpha * (measured - self.position), self.position)
+        self.derivative = np.where(mask, derivative, self.derivative)
+
+class KalmanSmoother(JointSmoother):
+    """
+    Kalman филтър с постоянна скорост, независимо за всяка ос на всяка става.
+    Ковариацията 2x2 се пази в три масива (20, 3); шумът на измерването расте при нисък confidence.
+    """
+
+    name = "kalman"
+
+    def __init__(self, measurement_noise=KALMAN_MEASUREMENT_NOISE_MM, acceleration_noise=KALMAN_ACCELERATION_NOISE, max_gap=MAX_GAP_SECONDS):
+        self.measurement_variance = measurement_noise ** 2
+        self.acceleration_variance = acceleration_noise ** 2
+        self.velocity = np.zeros((JOINT_COUNT, 3))
+        self.p00 = np.zeros((JOINT_COUNT, 3))
+        self.p01 = np.zeros((JOINT_COUNT, 3))
+        self.p11 = np.zeros((JOINT_COUNT, 3))
+        super().__init__(max_gap)
+
+    def _start(self, joints, weight):
+        self.velocity[joints] = 0.0
+        self.p00[joints] = (self.measurement_variance / weight[joints])[:, None]
+        self.p01[joints] = 0.0
+        self.p11[joints] = KALMAN_INITIAL_VELOCITY_STD ** 2
+
+    def _step(self, measured, weight, update, dt):
+        # Предсказване: x += v*dt, P = F P F^T + Q (бял шум на ускорението)
+        q = self.acceleration_variance
+        self.position += self.velocity * dt
+        self.p00 += dt * (2 * self.p01 + dt * self.p11) + q * dt ** 4 / 4
+        self.p01 += dt * self.p11 + q * dt ** 3 / 2
+        self.p11 += q * dt ** 2
+
+        # Корекция с измерването само за засечените стави
+        r = (self.measurement_variance / weight)[:, None]
+        innovation = measured - self.position
+        s = self.p00 + r
+        k0 = np.where(update[:, None], self.p00 / s, 0.0)
+        k1 = np.where(update[:, None], self.p01 / s, 0.0)
+        self.position += k0 * innovation
+        self.velocity += k1 * innovation
+        self.p11 -= k1 * self.p01
+        self.p01 *= 1 - k0
+        self.p00 *= 1 - k0
+
+def _alpha(cutoff, dt):
+    """Коефициент на експоненциалното изглаждане за гранична честота `cutoff` (Hz)."""
+    tau = 1.0 / (2 * math.pi * cutoff)
+    return 1.0 / (1.0 + tau / dt)
+
+_SMOOTHERS = {
+    "one_euro": OneEuroSmoother,
+    "kalman": KalmanSmoother,
+}
+
+def create_joint_smoother(spec=None):
+    """Създава изглаждането по име (или от NUITRACK_SMOOTHING). Връща None при off - изглаждането е по избор."""
+    spec = (spec or os.getenv(SMOOTHING_ENV) or DEFAULT_SMOOTHING).strip().lower()
+    if spec in ("off", "none", "0"):
+        return None
+    if spec not in _SMOOTHERS:
+        globals.logger.warning(f"Unknown joint smoothing '{spec}', smoothing disabled")
+        return None
+    return _SMOOTHERS[spec]()
+
+def smoothing_name(spec=None):
+    """Името на избраното изглаждане (off, ако е изключено) - за отчетите."""
+    smoother = create_joint_smoother(spec)
+    return smoother.name if smoother is not None else "off"
@@ -1,21 +1,179 @@
 import time
+from typing import Any, NamedTuple
 import custom_messagebox as messagebox
 import cv2
-from PyNuitrack import py_nuitrack
 
-from utils.calibration import update_calibration_progress
-from utils.exercise_logic import check_relative_pose, update_exercise_progress
-from utils.skeleton_processing import process_skeleton_data
+from utils.calibration import feed_calibration
+from utils.exercise_logic import evaluate_current_frame, update_exercise_progress, user_tracker
+from utils.frame_sources import create_frame_source
+from utils.perf import perf_monitor
+from utils.pipeline import DropOldestQueue, PipelineStage, StageStats
+from utils.session_recording import start_session_recording
+from utils.skeleton_history import skeleton_history
+from utils.trace import tracer
+from utils.skeleton_processing import RENDER_QUEUE_SIZE, hold_frame, process_skeleton_data, release_all_frames, release_frame
 from utils.visualization import draw_simple_skeleton, draw_text
 
 import globals
 
+WINDOW_NAME = 'OpenCV - Nuitrack SDK'
+
+# Размери на опашките между етапите - малки, за да се показва винаги най-новият кадър
+# (RENDER_QUEUE_SIZE е в skeleton_processing, защото определя и размера на пула с кадри)
+CAPTURE_QUEUE_SIZE = 2
+
+class CapturedFrame(NamedTuple):
+    """Суровите данни от сензора за един кадър."""
+    skeleton_data: Any
+    img_color: Any
+    capture_time: float
+
+class AnalyzedFrame(NamedTuple):
+    """Кадър след извличане на скелета и оценка на позата. Скелетът е от пула и се държи до release_analyzed."""
+    captured: CapturedFrame
+    skeleton: Any
+    evaluation: Any
+    group_status: Any = None
+
+def capture_frame(nuitrack):
+    """Етап 1: чете нов кадър от сензора."""
+    # Обновяване на данните от сензора
+    with perf_monitor.span("sensor_update"):
+        nuitrack.update()
+    
+    skeleton_data = nuitrack.get_skeleton()
+    img_color = nuitrack.get_color_data()
+    
+    # Опит за взимане на depth-to-color съответствие
+    try:
+        globals.depth_to_color_frame = nuitrack.get_depth_to_color_frame()
+    except:
+        pass
+    
+    return CapturedFrame(skeleton_data, img_color, time.perf_counter())
+
+def analyze_frame(captured):
+    """Етап 2: извлича скелета, оценява позата и придвижва прогреса на стъпката."""
+    # Обработка на скелетните данни
+    with perf_monitor.span("skeleton"):
+        process_skeleton_data(captured.skeleton_data)
+    states = user_tracker.update(globals.user_skeletons)
+    
+    # История на скелета за скорост, ускорение и неподвижност - едно копиране на ред в буфера
+    if globals.current_user_skeleton is not None:
+        skeleton_history.append(globals.current_user_skeleton)
+    
+    # Запис на кадъра за по-късно възпроизвеждане (ако е включен)
+    if globals.session_recorder is not None and globals.current_user_skeleton is not None:
+        globals.session_recorder.append(globals.current_user_skeleton)
+    
+    # Кадърът се подава и на калибрирането, ако е активно
+    if globals.calibrator is not None:
+        feed_calibration(globals.current_user_skeleton, time.time())
+    
+    # Изглаждане на ставите на всеки потребител преди оценката (историята, записът и калибрирането ползват суровите данни)
+    if states:
+        with perf_monitor.span("smoothing"):
+            for frame, state in zip(globals.user_skeletons, states):
+                if state.smoother is not None:
+                    state.smoother.apply(frame)
+    
+    # Една оценка на позата за кадъра - ползва се от HUD-а и от прогреса на стъпката
+    with perf_monitor.span("scoring"):
+        evaluation = evaluate_current_frame()
+        # Прогресът на стъпката напредва с всеки нов кадър
+        update_exercise_progress(evaluation)
+    
+    # Скелетът на основния потребител остава зает, докато рисуването приключи с него
+    hold_frame(globals.current_user_skeleton)
+    return AnalyzedFrame(captured, globals.current_user_skeleton, evaluation, user_tracker.group_status())
+
+def release_analyzed(analyzed):
+    """Връща скелета на нарисуван или изхвърлен кадър в пула."""
+    release_frame(analyzed.skeleton)
+
+def render_frame(analyzed, nuitrack):
+    """Етап 3: рисува скелета и статус линиите върху цветния кадър. Връща None при празен кадър."""
+    try:
+        return _draw_frame(analyzed, nuitrack)
+    finally:
+        release_analyzed(analyzed)
+
+def _draw_frame(analyzed, nuitrack):
+    """Рисуването на кадъра - скелетът е зает през цялото време."""
+    img_color = analyzed.captured.img_color
+    if not img_color.size:
+        return None
+    
+    user_skeleton = analyzed.skeleton
+    evaluation = analyzed.evaluation
+    
+    # Рисуване върху видео потока
+    draw_simple_skeleton(img_color, analyzed.captured.skeleton_data, nuitrack, user_skeleton)
+    
+    # Изчисляване на изминалото време
+    elapsed = time.time() - globals.session_start_time
+    minutes = int(elapsed // 60)
+    seconds = elapsed % 60
+    
+    # Събиране на статус линии за показване върху видео
+    status_lines = [f"Сесия: {minutes:02d}:{seconds:05.2f}"]
+
+    # Статус само при незасечен скелет
+    if not user_skeleton:
+        # Статус при калибриране
+        if globals.calibration_active:
+            elapsed_cal = time.time() - globals.calibration_start_time
+            calibrator = globals.calibrator
+            remaining_cal = max(0, (calibrator.max_duration if calibrator is not None else 5) - elapsed_cal)
+            status_lines.extend([
+                f"КАЛИБРИРАНЕ: {remaining_cal:.1f} секунди остават"
+            ])
+        status_lines.append("Скелет: ТЪРСЕНЕ...")
+                        
+    # Статус при упражнение
+    elif globals.exercise_active:
+        step_data = globals.EXERCISE_JSON["steps"][globals.current_step]
+        accuracy = evaluation.accuracy if evaluation else 0
+        
+        accuracy_display = get_accuracy_indicator(accuracy)
+        
+        status_lines.extend([
+            f"{step_data['name']}",
+            f"Форма: {accuracy_display}"
+        ])
+        # Напредък на останалите потребители в кадъра
+        if analyzed.group_status:
+            status_lines.append(analyzed.group_status)
+    
+    # Статус при изчакване
+    elif not globals.calibration_active:
+        status_lines.append("Упражнение: В готовност за стартиране")
+    
+    # Показване на всички статус линии върху екрана
+    for i, line in enumerate(status_lines):
+        y_pos = 30 + (i * 25)
+        img_color = draw_text(img_color, line, (10, y_pos))
+    
+    # Линия с производителността (превключва се с клавиш 'p')
+    if perf_monitor.hud_enabled:
+        img_color = draw_text(img_color, perf_monitor.hud_text(), (10, 30 + len(status_lines) * 25), font_size=18, color=(255, 255, 0))
+    
+    return img_color
+
 def run_nuitrack():
-    """Главен цикъл на Nuitrack програмата - обработва скелетни данни и показва камерата."""
+    """
+    Главен цикъл на Nuitrack програмата - обработва скелетни данни и показва камерата.
+
+    Работата е разделена на три етапа, свързани с ограничени опашки, които изхвърлят най-стария кадър:
+    четене от сензора и анализ работят в собствени нишки, а рисуването и показването - в тази нишка.
+    Така бавен кадър при рисуването не забавя четенето от сензора.
+    """
     
+    stages = []
     try:
-        # 1) Инициализация на Nuitrack обект
-        nuitrack = py_nuitrack.Nuitrack()
+        # 1) Инициализация на източника на кадри - Nuitrack сензор или симулация (NUITRACK_FRAME_SOURCE)
+        nuitrack = create_frame_source()
         globals.nuitrack_instance = nuitrack
         nuitrack.init()
         
@@ -29,92 +187,66 @@ def run_nuitrack():
         # 2) Запис на началното време на сесията
         globals.session_start_time = time.time()
         
-        # 3) Главен цикъл за обработка на данни
+        skeleton_history.clear()
+        user_tracker.reset()
+        release_all_frames()
+        
+        # Запис на скелетните кадри, ако е зададена NUITRACK_RECORD_DIR
+        globals.session_recorder = start_session_recording()
+        
+        # 3) Стартиране на етапите за четене и анализ
+        capture_queue = DropOldestQueue(CAPTURE_QUEUE_SIZE)
+        render_queue = DropOldestQueue(RENDER_QUEUE_SIZE, on_drop=release_analyzed)
+        stages = [
+            PipelineStage("capture", lambda: capture_frame(nuitrack), output_queue=capture_queue),
+            PipelineStage("analysis", analyze_frame, input_queue=capture_queue, output_queue=render_queue)
+        ]
+        render_stats = StageStats("render")
+        # Хистограмите се нулират преди етапите да започнат да записват в тях
+        perf_monitor.reset()
+        for stage in stages:
+            stage.start()
+        
+        cv2.namedWindow(WINDOW_NAME, cv2.WINDOW_NORMAL)
+        cv2.resizeWindow(WINDOW_NAME, 1024, 768)
+        
+        # 4) Главен цикъл за рисуване и показване
         while globals.session_running:
-            cv2.waitKey(1)
+            perf_monitor.handle_key(cv2.waitKey(1))
 
             try:
-                # Обновяване на данните от сензора
-                nuitrack.update()
-                
-                skeleton_data = nuitrack.get_skeleton()
-                img_color = nuitrack.get_color_data()
+                analyzed = render_queue.get(timeout=0.1)
+                if analyzed is None:
+                    continue
                 
-                # Опит за взимане на depth-to-color съответствие
-                try:
-                    globals.depth_to_color_frame = nuitrack.get_depth_to_color_frame()
-                except:
-                    pass
-                
-                # Обработка на скелетните данни
-                process_skeleton_data(skeleton_data)
-                
-                # Рисуване върху видео потока
-                if img_color.size:
-                    draw_simple_skeleton(img_color, skeleton_data, nuitrack)
-                    
-                    # 4) Изчисляване на изминалото време
-                    elapsed = time.time() - globals.session_start_time
-                    minutes = int(elapsed // 60)
-                    seconds = elapsed % 60
-                    
-                    # 5) Събиране на статус линии за показване върху видео
-                    status_lines = [f"Сесия: {minutes:02d}:{seconds:05.2f}"]
-
-                    # Статус само при незасечен скелет
-                    if not globals.current_user_skeleton:
-                        # Статус при калибриране
-                        if globals.calibration_active:
-                            elapsed_cal = time.time() - globals.calibration_start_time
-                            remaining_cal = max(0, 5 - elapsed_cal)
-                            status_lines.extend([
-                                f"КАЛИБРИРАНЕ: {remaining_cal:.1f} секунди остават"
-                            ])
-                        status_lines.append("Скелет: ТЪРСЕНЕ...")
-                                        
-                    # Статус при упражнение
-                    elif globals.exercise_active:
-                        step_data = globals.EXERCISE_JSON["steps"][globals.current_step]
-                        if globals.current_user_skeleton and globals.user_metrics:
-                            accuracy, details = check_relative_pose(
-                                globals.current_user_skeleton,
-                                step_data.get("required_poses", {}),
-                                step_data.get("target_angles", {}),
-                                step_data.get("tolerance", {"angle_tolerance": 20, "distance_tolerance": 0.2}),
-                                globals.user_metrics
-                            )
-                        else:
-                            accuracy = 0
-                        
-                        accuracy_display = get_accuracy_indicator(accuracy)
-                        
-                        status_lines.extend([
-                            f"{step_data['name']}",
-                            f"Форма: {accuracy_display}"
-                        ])
-                    
-                    # Статус при изчакване
-                    elif not globals.calibration_active:
-                        status_lines.append("Упражнение: В готовност за стартиране")
-                    
-                    # 6) Показване на всички статус линии върху екрана
-                    for i, line in enumerate(status_lines):
-                        y_pos = 30 + (i * 25)
-                        img_color = draw_text(img_color, line, (10, y_pos))
-                                        
-                    cv2.namedWindow('OpenCV - Nuitrack SDK', cv2.WINDOW_NORMAL)
-                    cv2.resizeWindow('OpenCV - Nuitrack SDK', 1024, 768)
-                    cv2.imshow('OpenCV - Nuitrack SDK', img_color)
+                with tracer.span("render", "pipeline"):
+                    with perf_monitor.span("overlay"):
+                        img_color = render_frame(analyzed, nuitrack)
+                    if img_color is not None:
+                        with perf_monitor.span("display"):
+                            cv2.imshow(WINDOW_NAME, img_color)
+                        perf_monitor.frame_displayed(analyzed.captured.capture_time)
+                        render_stats.tick()
                 
             except Exception as e:
                 print(f"Loop error: {e}")
             
         print("=== SESSION ENDED ===")
+        print(f"Dropped frames: capture->analysis={capture_queue.dropped}, analysis->render={render_queue.dropped}")
+        perf_monitor.log_summary()
         
     except Exception as e:
         print(f"Nuitrack error: {e}")
         messagebox.showerror("Error", f"Nuitrack failed: {e}")
     finally:
+        # Изчакване на етапите да приключат преди освобождаване на сензора
+        for stage in stages:
+            stage.join(timeout=1.0)
+        
+        if globals.session_recorder is not None:
+            globals.session_recorder.close()
+            globals.session_recorder = None
+        
         # Освобождаване на ресурси
         globals.nuitrack_instance = None
         try:
@@ -122,26 +254,9 @@ def run_nuitrack():
         except:
             pass
         cv2.destroyAllWindows()
-
-def update_timer_display():
-    """Обновява таймера и прогреса в отделен нишков процес (thread)."""
-    
-    while globals.session_running:
-        try:            
-            # Обновяване на прогреса:
-            #    - Ако е активна калибриране → обновяваме прогреса на калибрирането
-            #    - Ако е активно упражнение → обновяваме прогреса на упражнението
-            if globals.calibration_active:
-                update_calibration_progress()
-            elif globals.exercise_active:
-                update_exercise_progress()
-            
-            # Пауза между обновяванията, за да не натоварваме CPU
-            time.sleep(0.1)
         
-        except:
-            # При грешка прекратяваме нишката
-            break
+        # Запис на трасирането на сесията (ако е включено с NUITRACK_TRACE_FILE)
+        tracer.save()
 
 def get_accuracy_indicator(accuracy):
     """
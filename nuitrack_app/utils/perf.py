@@ -0,0 +1,178 @@
+import math
+import time
+from bisect import bisect_right
+
+import numpy as np
+
+from utils.trace import tracer
+
+import globals
+
+# Етапи на кадъра, които се измерват, в реда на изпълнение
+STAGE_SPANS = ("sensor_update", "skeleton", "smoothing", "scoring", "overlay", "display")
+# Изчакването на сензора се показва отделно от етапите на обработка
+SENSOR_SPAN = "sensor_update"
+# Време от прочитането на кадъра от сензора до показването му на екрана
+SENSOR_TO_DISPLAY = "sensor_to_display"
+# Оценка на времето от заявката за звуков сигнал до началото му: измерено изчакване и стартиране
+# плюс изчислен (не измерен) един буфер на миксера; при winsound - само времето на извикването
+CUE_LATENCY = "cue_latency_estimate"
+
+# Граници на хистограмите: логаритмични кошчета от 10 µs до 10 s (~19% ширина на кошче)
+HISTOGRAM_MIN = 1e-5
+HISTOGRAM_MAX = 10.0
+HISTOGRAM_BINS = 80
+
+# Тегло на новата стойност в плъзгащите се средни за HUD-а
+EWMA_ALPHA = 0.1
+
+# Клавиш за показване/скриване на HUD-а в OpenCV прозореца
+HUD_TOGGLE_KEY = ord('p')
+# Колко често се обновява текстът на HUD-а (s) - по-рядко, за да се чете и да не се рисува нов текст всеки кадър
+HUD_REFRESH_INTERVAL = 0.5
+
+# Общи граници на кошчетата за всички хистограми
+_EDGES = np.geomspace(HISTOGRAM_MIN, HISTOGRAM_MAX, HISTOGRAM_BINS - 1).tolist()
+
+class LatencyHistogram:
+    """
+    Хистограма на времена (в секунди) с фиксирани логаритмични кошчета.
+    Паметта се заделя веднъж - записът само увеличава брояч и обновява няколко числа.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.counts = np.zeros(HISTOGRAM_BINS, dtype=np.int64)
+        self.reset()
+
+    def reset(self):
+        self.counts.fill(0)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = 0.0  # Плъзгаща се средна за HUD-а
+
+    def record(self, seconds):
+        self.counts[bisect_right(_EDGES, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.recent = seconds if self.count == 1 else self.recent + EWMA_ALPHA * (seconds - self.recent)
+
+    def percentile(self, p):
+        """Приблизителен перцентил (горната граница на кошчето), в секунди."""
+        if not self.count:
+            return 0.0
+        rank = math.ceil(self.count * p / 100)
+        index = int(np.searchsorted(np.cumsum(self.counts), max(rank, 1)))
+        return min(_EDGES[index], self.max) if index < len(_EDGES) else self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+class _Span:
+    """Преизползваем контекст за измерване на един етап - `with perf_monitor.span("scoring"):`."""
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        self.histogram.record(end - self.start)
+        if tracer.enabled:
+            tracer.complete(self.histogram.name, self.start, end, "stage")
+
+class PerfMonitor:
+    """
+    Следи времената на етапите на кадъра, fps и закъснението от сензора до екрана.
+    Всеки етап се измерва само от една нишка, затова не са нужни заключвания.
+    """
+
+    def __init__(self):
+        self.histograms = {name: LatencyHistogram(name) for name in STAGE_SPANS + (SENSOR_TO_DISPLAY, CUE_LATENCY)}
+        self._spans = {name: _Span(histogram) for name, histogram in self.histograms.items()}
+        self.hud_enabled = False
+        self.reset()
+
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.reset()
+        self.fps = 0.0
+        self._frame_interval = 0.0
+        self._last_display = None
+        self._hud_text = ""
+        self._hud_updated = 0.0
+
+    def span(self, name):
+        return self._spans[name]
+
+    def record(self, name, seconds):
+        """Записва време, измерено извън `span` (напр. от аудио нишката)."""
+        self.histograms[name].record(seconds)
+
+    def frame_displayed(self, capture_time):
+        """Отбелязва показан кадър: закъснение от прочитането му от сензора и fps."""
+        now = time.perf_counter()
+        self.histograms[SENSOR_TO_DISPLAY].record(now - capture_time)
+        if self._last_display is not None:
+            # Средният интервал между кадрите, а не средното на 1/интервал, което надценява fps при неравномерни кадри
+            interval = now - self._last_display
+            self._frame_interval = interval if not self._frame_interval else self._frame_interval + EWMA_ALPHA * (interval - self._frame_interval)
+            self.fps = 1.0 / self._frame_interval if self._frame_interval > 0 else 0.0
+        self._last_display = now
+
+    def slowest_stage(self):
+        """Етапът на обработка (без изчакването на сензора) с най-голямо текущо средно време."""
+        return max((self.histograms[name] for name in STAGE_SPANS if name != SENSOR_SPAN), key=lambda h: h.recent)
+
+    def handle_key(self, key):
+        """Обработва клавиш от cv2.waitKey - превключва HUD-а."""
+        if key & 0xFF == HUD_TOGGLE_KEY:
+            self.hud_enabled = not self.hud_enabled
+
+    def hud_text(self):
+        """Текст за HUD-а: fps, изчакване на сензора, закъснение сензор→екран, най-бавният етап и оценката за звука."""
+        now = time.perf_counter()
+        if now - self._hud_updated >= HUD_REFRESH_INTERVAL:
+            slowest = self.slowest_stage()
+            sensor = self.histograms[SENSOR_SPAN].recent
+            latency = self.histograms[SENSOR_TO_DISPLAY].recent
+            self._hud_text = (f"FPS {self.fps:.1f} | сензор {sensor * 1000:.0f} ms | сензор→екран {latency * 1000:.0f} ms"
+                              f" | най-бавен: {slowest.name} {slowest.recent * 1000:.1f} ms")
+            cue = self.histograms[CUE_LATENCY]
+            if cue.count:
+                self._hud_text += f" | звук ~{cue.recent * 1000:.0f} ms (оценка)"
+            self._hud_updated = now
+        return self._hud_text
+
+    def summary(self):
+        """Обобщение в ms по етапи - за лога и отчетите."""
+        return {
+            name: {
+                "count": h.count,
+                "mean_ms": h.mean * 1000,
+                "p50_ms": h.percentile(50) * 1000,
+                "p95_ms": h.percentile(95) * 1000,
+                "p99_ms": h.percentile(99) * 1000,
+                "max_ms": h.max * 1000,
+            }
+            for name, h in self.histograms.items() if h.count
+        }
+
+    def log_summary(self):
+        for name, stats in self.summary().items():
+            globals.logger.info(
+                f"Perf {name}: n={stats['count']} mean={stats['mean_ms']:.2f}ms p50={stats['p50_ms']:.2f}ms "
+                f"p95={stats['p95_ms']:.2f}ms p99={stats['p99_ms']:.2f}ms max={stats['max_ms']:.2f}ms"
+            )
+
+# Глобален монитор на производителността
+perf_monitor = PerfMonitor()
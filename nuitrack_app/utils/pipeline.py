@@ -0,0 +1,109 @@
+import threading
+import time
+from collections import deque
+
+from utils.trace import tracer
+
+import globals
+
+class DropOldestQueue:
+    """
+    Ограничена опашка между етапите на обработката.
+    При пълна опашка най-старият кадър се изхвърля, за да не се бави етапът, който я пълни.
+    `on_drop` (ако е зададен) се извиква с всеки изхвърлен елемент.
+    """
+
+    def __init__(self, maxsize, on_drop=None):
+        self._items = deque(maxlen=maxsize)
+        self._not_empty = threading.Condition(threading.Lock())
+        self.on_drop = on_drop
+        self.dropped = 0  # Брой изхвърлени кадри
+
+    def put(self, item):
+        """Добавя елемент без да блокира; при пълна опашка изхвърля най-стария."""
+        dropped = None
+        with self._not_empty:
+            if len(self._items) == self._items.maxlen:
+                self.dropped += 1
+                dropped = self._items[0]
+            self._items.append(item)
+            self._not_empty.notify()
+        if dropped is not None and self.on_drop is not None:
+            self.on_drop(dropped)
+
+    def get(self, timeout=None):
+        """Взема най-стария елемент или връща None, ако няма такъв до изтичане на timeout."""
+        with self._not_empty:
+            if not self._items and not self._not_empty.wait_for(lambda: self._items, timeout):
+                return None
+            return self._items.popleft()
+
+    def clear(self):
+        with self._not_empty:
+            items = list(self._items)
+            self._items.clear()
+        if self.on_drop is not None:
+            for item in items:
+                self.on_drop(item)
+
+    def __len__(self):
+        return len(self._items)
+
+class StageStats:
+    """Следи пропускателната способност (кадри в секунда) на един етап."""
+
+    def __init__(self, name, report_interval=5.0):
+        self.name = name
+        self.report_interval = report_interval
+        self.frames = 0                 # Общ брой обработени кадри
+        self.fps = 0.0                  # Кадри в секунда за последния интервал
+        self._window_frames = 0
+        self._window_start = time.perf_counter()
+
+    def tick(self):
+        """Отбелязва обработен кадър и периодично преизчислява fps."""
+        self.frames += 1
+        self._window_frames += 1
+        now = time.perf_counter()
+        elapsed = now - self._window_start
+        if elapsed >= self.report_interval:
+            self.fps = self._window_frames / elapsed
+            self._window_frames = 0
+            self._window_start = now
+            globals.logger.info(f"Pipeline stage '{self.name}': {self.fps:.1f} fps ({self.frames} frames total)")
+
+class PipelineStage(threading.Thread):
+    """
+    Етап, работещ в собствена нишка: взема елементи от входната опашка, обработва ги
+    и подава резултата към изходната. Без входна опашка етапът сам генерира елементи (напр. сензор).
+    """
+
+    def __init__(self, name, work, input_queue=None, output_queue=None, poll_timeout=0.1):
+        super().__init__(name=f"pipeline-{name}", daemon=True)
+        self.work = work
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.poll_timeout = poll_timeout
+        self.stats = StageStats(name)
+
+    def run(self):
+        while globals.session_running:
+            try:
+                if self.input_queue is not None:
+                    item = self.input_queue.get(self.poll_timeout)
+                    if item is None:
+                        continue
+                    with tracer.span(self.stats.name, "pipeline"):
+                        result = self.work(item)
+                else:
+                    with tracer.span(self.stats.name, "pipeline"):
+                        result = self.work()
+
+                if result is None:
+                    continue
+                self.stats.tick()
+                if self.output_queue is not None:
+                    self.output_queue.put(result)
+
+            except Exception as e:
+                globals.logger.error(f"Pipeline stage '{self.stats.name}' error: {e}")
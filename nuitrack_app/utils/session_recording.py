@@ -0,0 +1,161 @@
+import os
+import struct
+import time
+
+import numpy as np
+
+from utils.skeleton_processing import JOINT_COUNT, MIN_JOINT_CONFIDENCE, SkeletonFrame
+
+import globals
+
+# Формат на файла (little-endian):
+#   заглавие (32 байта): magic, версия, флагове, брой стави, резерв, време на създаване, брой кадри
+#   следват записи с фиксиран размер - индексът за търсене е самото отместване:
+#   HEADER_SIZE + номер_на_кадър * размер_на_запис, а търсенето по време е двоично търсене по колоната timestamp
+MAGIC = b'MOBSKEL\0'
+VERSION = 1
+HEADER_FORMAT = '<8sHHHHdQ'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+FLAG_PROJECTION = 0x1
+
+# Разширение на файловете със записи
+RECORDING_EXTENSION = '.mskel'
+
+def record_dtype(with_projection):
+    """Структурата на един запис (кадър) във файла."""
+    fields = [
+        ('timestamp', '<f8'),
+        ('user_id', '<i4'),
+        ('reserved', '<u4'),
+        ('joints', '<f4', (JOINT_COUNT, 4)),
+    ]
+    if with_projection:
+        fields.append(('projection', '<f4', (JOINT_COUNT, 2)))
+    return np.dtype(fields)
+
+class SkeletonRecorder:
+    """
+    Записва скелетни кадри в компактен двоичен файл: време, ID на потребителя,
+    (20, 4) стави и по желание екранните проекции на ставите.
+    """
+
+    def __init__(self, path, with_projection=True):
+        self.path = path
+        self.with_projection = with_projection
+        self.frame_count = 0
+        self._record = np.zeros(1, dtype=record_dtype(with_projection))
+        self._file = open(path, 'wb')
+        self._write_header()
+
+    def _write_header(self):
+        flags = FLAG_PROJECTION if self.with_projection else 0
+        self._file.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, flags, JOINT_COUNT, 0, time.time(), self.frame_count))
+
+    def append(self, frame):
+        """Добавя кадър в края на файла, като преизползва един и същ буфер за записа."""
+        record = self._record[0]
+        record['timestamp'] = frame.timestamp
+        record['user_id'] = -1 if frame.user_id is None else frame.user_id
+        record['joints'] = frame.data
+        if self.with_projection:
+            record['projection'] = frame.projection
+        self._file.write(self._record.data)
+        self.frame_count += 1
+
+    def close(self):
+        """Записва броя кадри в заглавието и затваря файла."""
+        if self._file.closed:
+            return
+        self._file.seek(0)
+        self._write_header()
+        self._file.close()
+        globals.logger.info(f"Skeleton recording saved: {self.path} ({self.frame_count} frames)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class SkeletonRecordingReader:
+    """
+    Чете запис чрез memory map - кадрите се зареждат от диска едва при достъп до тях.
+    Файлове от прекъсната сесия (без обновено заглавие) се четат до последния цял запис.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+        if len(header) < HEADER_SIZE:
+            raise ValueError(f"Not a skeleton recording: {path}")
+
+        magic, version, flags, joint_count, _, self.created, _ = struct.unpack(HEADER_FORMAT, header)
+        if magic != MAGIC or version != VERSION or joint_count != JOINT_COUNT:
+            raise ValueError(f"Unsupported skeleton recording: {path}")
+
+        self.with_projection = bool(flags & FLAG_PROJECTION)
+        dtype = record_dtype(self.with_projection)
+        count = (os.path.getsize(path) - HEADER_SIZE) // dtype.itemsize
+        self.records = np.memmap(path, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(count,)) if count else np.zeros(0, dtype=dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def timestamps(self):
+        return self.records['timestamp']
+
+    @property
+    def joints(self):
+        """(N, 20, 4) изглед върху всички кадри - напр. за compute_all_angles върху цялата сесия."""
+        return self.records['joints']
+
+    def seek_time(self, timestamp):
+        """Индекс на първия кадър с време >= timestamp."""
+        return int(np.searchsorted(self.timestamps, timestamp))
+
+    def read_frame(self, index, frame=None):
+        """Зарежда кадър в SkeletonFrame (нов или подаден за преизползване)."""
+        record = self.records[index]
+        # SkeletonFrame е Mapping - празен кадър е falsy, затова сравнение с None
+        if frame is None:
+            frame = SkeletonFrame()
+        frame.data[:] = record['joints']
+        frame.valid[:] = frame.data[:, 3] > MIN_JOINT_CONFIDENCE
+        if self.with_projection:
+            frame.projection[:] = record['projection']
+        else:
+            frame.projection.fill(0)
+        user_id = int(record['user_id'])
+        frame.user_id = None if user_id < 0 else user_id
+        frame.timestamp = float(record['timestamp'])
+        return frame
+
+    def frames(self, start=0, stop=None, reuse=False):
+        """Връща кадрите последователно. При reuse=True се използва един и същ SkeletonFrame."""
+        frame = SkeletonFrame() if reuse else None
+        for index in range(start, len(self) if stop is None else min(stop, len(self))):
+            yield self.read_frame(index, frame)
+
+    def __iter__(self):
+        return self.frames()
+
+def start_session_recording(directory=None):
+    """
+    Стартира запис на сесията, ако е зададена директория (или NUITRACK_RECORD_DIR).
+    Връща записващия обект или None.
+    """
+    directory = directory or os.getenv("NUITRACK_RECORD_DIR")
+    if not directory:
+        return None
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, time.strftime("session_%Y%m%d_%H%M%S") + RECORDING_EXTENSION)
+    try:
+        recorder = SkeletonRecorder(path)
+    except OSError as e:
+        globals.logger.error(f"Could not start skeleton recording: {e}")
+        return None
+    globals.logger.info(f"Recording skeleton frames to {path}")
+    return recorder
@@ -0,0 +1,142 @@
+import numpy as np
+
+from utils.skeleton_processing import JOINT_COUNT, JointIndex
+
+# Капацитет на буфера в кадри - около 4 секунди при 30 fps
+HISTORY_CAPACITY = 128
+
+# Праг за неподвижност: средно отклонение на ставата от средната й позиция в прозореца (мм)
+STILLNESS_THRESHOLD_MM = 30.0
+
+class SkeletonHistory:
+    """
+    Кръгов буфер с последните кадри на скелета в предварително заделени непрекъснати масиви.
+
+    Записът на кадър е едно копиране на ред; скорост, ускорение, трептене и неподвижност се изчисляват
+    с NumPy върху произволен прозорец (последните `seconds` секунди или `frames` кадъра) само при нужда.
+    Буферът се пише и чете от нишката за анализ, затова не използва заключвания.
+    """
+
+    def __init__(self, capacity=HISTORY_CAPACITY):
+        self.capacity = capacity
+        self.positions = np.zeros((capacity, JOINT_COUNT, 3), dtype=np.float32)
+        self.valid = np.zeros((capacity, JOINT_COUNT), dtype=bool)
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.user_id = None
+        self.count = 0
+        self.head = 0  # Индекс на следващия запис
+
+    def clear(self):
+        self.count = 0
+        self.head = 0
+        self.user_id = None
+
+    def __len__(self):
+        return self.count
+
+    def append(self, frame):
+        """Записва скелетен кадър (SkeletonFrame) в буфера. Смяна на потребителя започва нова история."""
+        if frame.user_id != self.user_id:
+            self.clear()
+            self.user_id = frame.user_id
+        index = self.head
+        self.positions[index] = frame.data[:, :3]
+        self.valid[index] = frame.valid
+        self.timestamps[index] = frame.timestamp
+        self.head = (index + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def latest(self):
+        """Позициите и маската на последния кадър (изгледи в буфера) или None при празен буфер."""
+        if not self.count:
+            return None
+        index = self.head - 1
+        return self.positions[index], self.valid[index]
+
+    def _window_size(self, seconds, frames):
+        if frames is not None:
+            return max(0, min(frames, self.count))
+        if seconds is None:
+            return self.count
+        # Брой кадри с време не по-старо от `seconds` спрямо последния кадър
+        timestamps = self.timestamps[self._indices(self.count)]
+        return self.count - int(np.searchsorted(timestamps, timestamps[-1] - seconds, side='left')) if self.count else 0
+
+    def _indices(self, size):
+        return np.arange(self.head - size, self.head) % self.capacity
+
+    def window(self, seconds=None, frames=None):
+        """Позиции (n, 20, 3), маска (n, 20) и времена (n,) на прозореца в хронологичен ред."""
+        indices = self._indices(self._window_size(seconds, frames))
+        return self.positions[indices], self.valid[indices], self.timestamps[indices]
+
+    def velocity(self, seconds=None, frames=None):
+        """
+        Скорост на ставите между съседни кадри (мм/s) - масив (n-1, 20, 3) и маска на валидните стойности.
+        Стойност е валидна, ако ставата е засечена и в двата кадъра.
+        """
+        return _velocity(*self.window(seconds, frames))
+
+    def acceleration(self, seconds=None, frames=None):
+        """Ускорение на ставите (мм/s²) - масив (n-2, 20, 3) и маска на валидните стойности."""
+        positions, valid, timestamps = self.window(seconds, frames)
+        velocity, ok = _velocity(positions, valid, timestamps)
+        # Времето между средите на съседните интервали
+        dt = (timestamps[2:] - timestamps[:-2]) / 2
+        ok = (ok[1:] & ok[:-1]) & (dt > 0)[:, None]
+        acceleration = np.diff(velocity, axis=0) / np.where(dt > 0, dt, 1.0)[:, None, None]
+        return acceleration, ok
+
+    def speed(self, seconds=None, frames=None):
+        """Средна скорост на всяка става в прозореца (мм/s), NaN за стави без данни."""
+        velocity, ok = self.velocity(seconds, frames)
+        return _masked_mean(np.linalg.norm(velocity, axis=2), ok)
+
+    def jitter(self, seconds=None, frames=None):
+        """
+        Оценка на шума (трептенето) на всяка става в мм по ос от вторите разлики на позицията:
+        при бял шум със стандартно отклонение σ дисперсията на p[t+1] - 2p[t] + p[t-1] е 6σ² по всяка ос.
+        Плавното движение почти не влияе на оценката. NaN за стави без данни.
+        """
+        positions, valid, _ = self.window(seconds, frames)
+        second_diff = positions[2:] - 2 * positions[1:-1] + positions[:-2]
+        ok = valid[2:] & valid[1:-1] & valid[:-2]
+        return np.sqrt(_masked_mean(np.square(second_diff).sum(axis=2), ok) / 18.0)
+
+    def stillness(self, seconds=None, frames=None):
+        """Средно квадратично отклонение на всяка става от средната й позиция в прозореца (мм), NaN за стави без данни."""
+        positions, valid, _ = self.window(seconds, frames)
+        weights = valid[:, :, None]
+        counts = valid.sum(axis=0)
+        mean = (positions * weights).sum(axis=0) / np.maximum(counts, 1)[:, None]
+        deviation = np.square(positions - mean).sum(axis=2)
+        return np.sqrt(_masked_mean(deviation, valid))
+
+    def is_still(self, seconds, joints=None, threshold=STILLNESS_THRESHOLD_MM):
+        """
+        Дали ставите (по подразбиране всички засечени) са неподвижни през последните `seconds` секунди.
+        Буферът трябва да покрива целия прозорец.
+        """
+        if self.count < 2 or self.timestamps[self.head - 1] - self.timestamps[self._indices(self.count)[0]] < seconds:
+            return False
+        stillness = self.stillness(seconds)
+        if joints is not None:
+            stillness = stillness[[JointIndex[joint] if isinstance(joint, str) else joint for joint in joints]]
+        measured = stillness[~np.isnan(stillness)]
+        return bool(measured.size) and bool((measured < threshold).all())
+
+def _velocity(positions, valid, timestamps):
+    dt = np.diff(timestamps)
+    ok = (valid[1:] & valid[:-1]) & (dt > 0)[:, None]
+    velocity = np.diff(positions, axis=0) / np.where(dt > 0, dt, 1.0)[:, None, None]
+    return velocity, ok
+
+def _masked_mean(values, mask):
+    """Средна стойност по първата ос само на валидните елементи; NaN, където няма такива."""
+    counts = mask.sum(axis=0)
+    total = np.where(mask, values, 0.0).sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, total / counts, np.nan)
+
+# Глобална история на скелета на текущия потребител
+skeleton_history = SkeletonHistory()
@@ -1,80 +1,279 @@
 import math
+import threading
+import time
+from collections.abc import Mapping
+from enum import IntEnum
+
+import numpy as np
+
 import globals
 
+class JointIndex(IntEnum):
+    """Фиксирани индекси на ставите в реда, в който Nuitrack ги подава."""
+    HEAD = 0
+    NECK = 1
+    TORSO = 2
+    WAIST = 3
+    LEFT_COLLAR = 4
+    LEFT_SHOULDER = 5
+    LEFT_ELBOW = 6
+    LEFT_WRIST = 7
+    LEFT_HAND = 8
+    RIGHT_COLLAR = 9
+    RIGHT_SHOULDER = 10
+    RIGHT_ELBOW = 11
+    RIGHT_WRIST = 12
+    RIGHT_HAND = 13
+    LEFT_HIP = 14
+    LEFT_KNEE = 15
+    LEFT_ANKLE = 16
+    RIGHT_HIP = 17
+    RIGHT_KNEE = 18
+    RIGHT_ANKLE = 19
+
+JOINT_NAMES = tuple(joint.name for joint in JointIndex)
+JOINT_COUNT = len(JOINT_NAMES)
+
+# Колони в масива на кадъра
+X, Y, Z, CONFIDENCE = range(4)
+
+# Минимален confidence, над който ставата се счита за засечена
+MIN_JOINT_CONFIDENCE = 0.4
+
+# Максимален брой едновременно проследени потребители (колкото поддържа Nuitrack)
+MAX_USERS = 6
+
+# Дълбочина на опашката от анализа към рисуването (nuitrack_runner) - от нея зависи и размерът на пула с кадри
+RENDER_QUEUE_SIZE = 2
+
+# Стави, чиито координати се логват в дебъг режим
+_DEBUG_JOINTS = ("HEAD", "NECK", "TORSO", "RIGHT_SHOULDER", "RIGHT_ELBOW",
+                 "RIGHT_WRIST", "LEFT_SHOULDER", "LEFT_ELBOW", "LEFT_WRIST")
+
+class SkeletonFrame(Mapping):
+    """
+    Компактен скелетен кадър върху предварително заделен (20, 4) float32 масив (x, y, z, confidence).
+
+    `valid` е маска на засечените стави, а `projection` - екранните (x, y) координати от сензора. Кадърът се държи и като речник
+    {име на става: {"x", "y", "z", "confidence"}}, съдържащ само валидните стави,
+    за да продължат да работят модулите, които още ползват речниковия достъп.
+    """
+    __slots__ = ('data', 'valid', 'projection', 'user_id', 'timestamp')
+
+    def __init__(self):
+        self.data = np.zeros((JOINT_COUNT, 4), dtype=np.float32)
+        self.valid = np.zeros(JOINT_COUNT, dtype=bool)
+        self.projection = np.zeros((JOINT_COUNT, 2), dtype=np.float32)
+        self.user_id = None
+        self.timestamp = 0.0
+
+    @classmethod
+    def from_mapping(cls, skeleton):
+        """Създава кадър от речник {име на става: {"x", "y", "z", "confidence"}}."""
+        frame = cls()
+        for name, joint in skeleton.items():
+            if name not in JointIndex.__members__ or not joint:
+                continue
+            idx = JointIndex[name]
+            frame.data[idx] = (joint.get('x', 0), joint.get('y', 0), joint.get('z', 0), joint.get('confidence', 1.0))
+            frame.valid[idx] = True
+        return frame
+
+    def clear(self):
+        """Нулира кадъра без да заделя нова памет."""
+        self.data.fill(0)
+        self.valid.fill(False)
+        self.projection.fill(0)
+        self.user_id = None
+        self.timestamp = 0.0
+
+    def copy(self):
+        """Връща независимо копие на кадъра."""
+        frame = SkeletonFrame()
+        frame.data[:] = self.data
+        frame.valid[:] = self.valid
+        frame.projection[:] = self.projection
+        frame.user_id = self.user_id
+        frame.timestamp = self.timestamp
+        return frame
+
+    def position(self, joint):
+        """Връща (x, y, z) на ставата като изглед в масива или None, ако не е засечена."""
+        idx = JointIndex[joint] if isinstance(joint, str) else joint
+        return self.data[idx, :3] if self.valid[idx] else None
+
+    # --- Речников изглед ---
+    def __getitem__(self, name):
+        idx = JointIndex.__members__.get(name)
+        if idx is None or not self.valid[idx]:
+            raise KeyError(name)
+        x, y, z, confidence = self.data[idx].tolist()
+        return {"x": x, "y": y, "z": z, "confidence": confidence}
+
+    def __contains__(self, name):
+        idx = JointIndex.__members__.get(name)
+        return idx is not None and bool(self.valid[idx])
+
+    def __iter__(self):
+        return (JOINT_NAMES[i] for i in np.flatnonzero(self.valid))
+
+    def __len__(self):
+        return int(np.count_nonzero(self.valid))
+
+# Малък пул от кадри, които се преизползват циклично - така всеки кадър от сензора
+# се записва в съществуващ масив, вместо да създава 20 нови речника.
+# Всяко минаване на анализа взема следващия набор от MAX_USERS кадъра. Рисуването държи кадъра си (hold_frame)
+# от предаването до края на рисуването или до изхвърлянето му от опашката (release_frame), а наборите с държани
+# кадри се прескачат. В движение са най-много записваният в момента, до RENDER_QUEUE_SIZE чакащи в опашката
+# и рисуваният - ако все пак няма свободен набор (забавено рисуване), пулът се разширява вместо да презапише кадър.
+_FRAME_POOL_SETS = RENDER_QUEUE_SIZE + 2
+_frame_pool = [tuple(SkeletonFrame() for _ in range(MAX_USERS)) for _ in range(_FRAME_POOL_SETS)]
+_frame_pool_index = 0
+_held_frames = set()                # id на кадрите, които рисуването още държи
+_held_frames_lock = threading.Lock()
+
+def hold_frame(frame):
+    """Отбелязва кадъра като зает - наборът му няма да се презапише до release_frame."""
+    if frame is not None:
+        with _held_frames_lock:
+            _held_frames.add(id(frame))
+
+def release_frame(frame):
+    """Освобождава кадъра, задържан с hold_frame."""
+    if frame is not None:
+        with _held_frames_lock:
+            _held_frames.discard(id(frame))
+
+def release_all_frames():
+    """Освобождава всички задържани кадри (в началото на нова сесия)."""
+    with _held_frames_lock:
+        _held_frames.clear()
+
+def _next_pool_set():
+    """Връща следващия свободен набор от MAX_USERS кадъра от пула - кадрите се изчистват при запис."""
+    global _frame_pool_index
+    with _held_frames_lock:
+        for _ in range(len(_frame_pool)):
+            _frame_pool_index = (_frame_pool_index + 1) % len(_frame_pool)
+            frames = _frame_pool[_frame_pool_index]
+            if not any(id(frame) in _held_frames for frame in frames):
+                return frames
+
+        # Всички набори са заети - добавя нов
+        frames = tuple(SkeletonFrame() for _ in range(MAX_USERS))
+        _frame_pool.append(frames)
+        _frame_pool_index = len(_frame_pool) - 1
+    globals.logger.warning(f"Skeleton frame pool grown to {len(_frame_pool)} sets (render stage is holding every frame)")
+    return frames
+
+def frame_timestamp(data):
+    """Времето на кадъра в секунди - от сензора (микросекунди), ако е налично, иначе текущото."""
+    timestamp = getattr(data, 'timestamp', None)
+    return timestamp / 1e6 if timestamp else time.time()
+
 def process_skeleton_data(data, debug=False):
-    """Извличане на данни за скелета от Nuitrack"""
+    """
+    Извличане на данни за скелетите на всички видими потребители от Nuitrack.
+    Всички кадри се записват в globals.user_skeletons, а на основния потребител - в globals.current_user_skeleton.
+    """
     
     # Проверява дали има валидни данни за скелета
     if not data or not hasattr(data, 'skeletons') or not data.skeletons:
         # Ако няма данни, записва съобщение и изчиства текущия скелет
         globals.logger.debug("No skeleton data available")
         globals.current_user_skeleton = None
+        globals.user_skeletons = ()
         return
     
-    # Списък с имената на ставите, които се проследяват
-    joint_names = [
-        "HEAD", "NECK", "TORSO", "WAIST", "LEFT_COLLAR", "LEFT_SHOULDER",
-        "LEFT_ELBOW", "LEFT_WRIST", "LEFT_HAND", "RIGHT_COLLAR",
-        "RIGHT_SHOULDER", "RIGHT_ELBOW", "RIGHT_WRIST", "RIGHT_HAND",
-        "LEFT_HIP", "LEFT_KNEE", "LEFT_ANKLE", "RIGHT_HIP", "RIGHT_KNEE", "RIGHT_ANKLE"
-    ]
+    timestamp = frame_timestamp(data)
+    pool = _next_pool_set()
+    frames = tuple(_read_skeleton(skeleton, timestamp, frame) for skeleton, frame in zip(data.skeletons[:MAX_USERS], pool))
+    frame = select_primary_user(frames)
     
-    # Взема първия скелет от данните
-    skeleton = data.skeletons[0]
-    # Извлича данните за стави
-    joints_data = skeleton[1:] if isinstance(skeleton, (list, tuple)) and len(skeleton) > 0 else skeleton
+    # Ако дебъг режимът е активен, записва координатите на ключови стави
+    if debug:
+        for joint_name in _DEBUG_JOINTS:
+            idx = JointIndex[joint_name]
+            if frame.valid[idx]:
+                x, y, z, confidence = frame.data[idx]
+                globals.logger.debug(f"DETECTED: {joint_name} at ({x:.0f}, {y:.0f}, {z:.0f})mm, confidence={confidence:.2f}")
     
-    # Създава празен речник за текущия скелет
-    user_skeleton = {}
+    # Актуализира скелетите на потребителите и текущия (основен) скелет
+    globals.user_skeletons = frames
+    globals.current_user_skeleton = frame
+
+def select_primary_user(frames):
+    """
+    Избира основния потребител - този, който следва упражнението с гласови инструкции и калибриране.
+    Изборът е устойчив: основният остава същият, докато се вижда; иначе се избира най-близкият до центъра на кадъра.
+    """
+    for frame in frames:
+        if frame.user_id == globals.primary_user_id:
+            return frame
+
+    def distance_from_center(frame):
+        torso = frame.position(JointIndex.TORSO)
+        return abs(float(torso[0])) if torso is not None else float('inf')
+
+    frame = min(frames, key=distance_from_center)
+    if globals.primary_user_id is not None:
+        globals.logger.info(f"Primary user changed: {globals.primary_user_id} -> {frame.user_id}")
+    globals.primary_user_id = frame.user_id
+    return frame
+
+def _read_skeleton(skeleton, timestamp, frame):
+    """Записва скелета на един потребител в кадър от пула."""
+    # Извлича ID на потребителя и данните за стави
+    if isinstance(skeleton, (list, tuple)) and len(skeleton) > 0:
+        user_id, joints_data = skeleton[0], skeleton[1:]
+    else:
+        user_id, joints_data = None, skeleton
+    
+    # Записва в кадър от пула вместо да създава нов речник
+    frame.clear()
+    frame.user_id = user_id
+    frame.timestamp = timestamp
+    data_rows = frame.data
     
     # Обхожда всяка става от данните
     for i, joint in enumerate(joints_data):
-        # Ако индексът надвишава броя на имената на ставите, спира
-        if i >= len(joint_names):
+        # Ако индексът надвишава броя на ставите, спира
+        if i >= JOINT_COUNT:
             break
             
-        # Взема името на текущата става
-        joint_name = joint_names[i]
-        
         try:
             # Проверява формата на данните за ставата
             if hasattr(joint, 'real') and hasattr(joint, 'confidence'):
-                # Ако има 'real' координати и confidence, създава речник с координати
-                joint_data = {
-                    "x": float(joint.real[0]),
-                    "y": float(joint.real[1]),
-                    "z": float(joint.real[2]),
-                    "confidence": float(joint.confidence)
-                }
+                # Ако има 'real' координати и confidence, записва ги директно в реда на ставата
+                real = joint.real
+                data_rows[i, X] = real[0]
+                data_rows[i, Y] = real[1]
+                data_rows[i, Z] = real[2]
+                data_rows[i, CONFIDENCE] = joint.confidence
+                # Екранни координати, ако сензорът ги подава
+                projection = getattr(joint, 'projection', None)
+                if projection is not None and len(projection) >= 2:
+                    frame.projection[i, 0] = projection[0]
+                    frame.projection[i, 1] = projection[1]
             elif hasattr(joint, 'x'):
                 # Ако има само 'x' и 'y', използва z=1000 по подразбиране
-                joint_data = {
-                    "x": float(joint.x),
-                    "y": float(joint.y),
-                    "z": float(joint.z) if hasattr(joint, 'z') else 1000.0,
-                    "confidence": float(joint.confidence) if hasattr(joint, 'confidence') else 1.0
-                }
+                data_rows[i, X] = joint.x
+                data_rows[i, Y] = joint.y
+                data_rows[i, Z] = joint.z if hasattr(joint, 'z') else 1000.0
+                data_rows[i, CONFIDENCE] = joint.confidence if hasattr(joint, 'confidence') else 1.0
             else:
                 # Ако няма валидни данни за ставата, продължава към следващата
                 continue
-            
-            # Запазва данните само ако confidence е над 0.4
-            if joint_data['confidence'] > 0.4:
-                user_skeleton[joint_name] = joint_data
-                # Ако дебъг режимът е активен, записва координатите на ключови стави
-                if debug and joint_name in ["HEAD", "NECK", "TORSO", "RIGHT_SHOULDER", "RIGHT_ELBOW", 
-                                           "RIGHT_WRIST", "LEFT_SHOULDER", "LEFT_ELBOW", "LEFT_WRIST"]:
-                    globals.logger.debug(f"DETECTED: {joint_name} at ({joint_data['x']:.0f}, {joint_data['y']:.0f}, {joint_data['z']:.0f})mm, confidence={joint_data['confidence']:.2f}")
                 
         except Exception as e:
             # Ако възникне грешка при обработката, записва грешката и продължава
-            globals.logger.error(f"Error processing joint {joint_name}: {e}")
+            globals.logger.error(f"Error processing joint {JOINT_NAMES[i]}: {e}")
+            data_rows[i] = 0
             continue
     
-    # Запазва текущия скелет като предишен за следващото обновяване
-    globals.previous_user_skeleton = globals.current_user_skeleton.copy() if globals.current_user_skeleton else None
-    # Актуализира текущия скелет с новите данни
-    globals.current_user_skeleton = user_skeleton
+    # Валидни са само ставите с confidence над 0.4
+    np.greater(data_rows[:, CONFIDENCE], MIN_JOINT_CONFIDENCE, out=frame.valid)
+    return frame
 
 def normalize_skeleton(user_skeleton):
     """Нормализиране на скелетните данни спрямо торса."""
@@ -93,6 +292,16 @@ def normalize_skeleton(user_skeleton):
     
     return rel_skeleton
 
+def relative_positions(data, valid):
+    """
+    Позициите (x, y, z) спрямо торса като масив - вариантът на normalize_skeleton върху масивите на кадъра.
+    Приема (20, 4) за един потребител или (N, 20, 4) за N потребители; липсващите стави (и торсът) са 0,
+    както при .get(..., 0) върху речника.
+    """
+    xyz = np.asarray(data, dtype=np.float64)[..., :3]
+    torso = np.where(valid[..., JointIndex.TORSO, None], xyz[..., JointIndex.TORSO, :], 0.0)
+    return np.where(valid[..., None], xyz - torso[..., None, :], 0.0)
+
 def calculate_3d_distance(joint1, joint2):
     """Изчисляване на 3D разстояние между две точки"""
     # Проверява дали двете стави (joint1 и joint2) съществуват
@@ -0,0 +1,81 @@
+from types import MappingProxyType
+from typing import NamedTuple
+
+from exercises import ALL_EXERCISES
+from utils.calibration import calculate_tolerances
+from utils.check_angles import check_single_angle
+from utils.check_poses import POSE_RULES
+
+# Толеранси по подразбиране, ако стъпката не дефинира собствени
+DEFAULT_TOLERANCE = MappingProxyType({"angle_tolerance": 20, "distance_tolerance": 0.2})
+
+# Проверки за пози по име (правилата и съобщенията са в check_poses) - изпълнява ги груповата оценка в batch_scoring
+POSE_CHECKERS = POSE_RULES
+
+# Пози, които се проверяват само когато са изискани (False означава "без значение")
+_SKIP_WHEN_FALSE = ('arms_down', 'arms_forward')
+
+class PoseEvaluation(NamedTuple):
+    """Непроменим резултат от оценката на един кадър, споделян от HUD-а и логиката за задържане."""
+    accuracy: float
+    feedback: MappingProxyType
+    all_ok: bool
+    timestamp: float
+    step_index: int
+
+class StepPlan(NamedTuple):
+    """
+    Непроменима стъпка, компилирана за конкретен потребител - продължителност и праговете му за разстояния.
+    Самите проверки се изпълняват от batch_scoring (и за един потребител - като група от един).
+    """
+    name: str
+    duration: float
+    tolerances: MappingProxyType
+    tolerances_data: MappingProxyType
+
+def checked_poses(required_poses):
+    """Имената на позите от стъпката, които се проверяват, в реда на дефиницията."""
+    return tuple(
+        name for name in required_poses
+        if name in POSE_CHECKERS and not (name in _SKIP_WHEN_FALSE and not required_poses[name])
+    )
+
+def angle_feedback(angle_name, target, joints, angles, valid, tolerances):
+    """
+    Проверка на ъгъл за един потребител - (обратна връзка, точки, брой проверки), както check_single_angle.
+    Липсващите стави на познат ъгъл дават "Няма скелетни данни"; непознат или неизчислен ъгъл - "Not detected".
+    """
+    if joints.size and not valid[joints].all():
+        return {"ok": False, "msg": "✗ Няма скелетни данни"}, 0, 1
+    return check_single_angle(angle_name, target, angles, tolerances)
+
+def threshold_key(tolerances):
+    """Ключ на праговете за разстояния - зависят само от distance_tolerance."""
+    return f"{tolerances['distance_tolerance']:g}"
+
+def compile_thresholds(user_metrics, exercises=ALL_EXERCISES):
+    """Праговете за разстояния на потребителя за всички стъпки на упражненията - пазят се в профила му."""
+    keys = {threshold_key(DEFAULT_TOLERANCE)}
+    keys.update(threshold_key(step["tolerance"]) for exercise in exercises for step in exercise["steps"] if "tolerance" in step)
+    return {key: calculate_tolerances({"distance_tolerance": float(key)}, user_metrics) for key in sorted(keys)}
+
+def step_tolerances(tolerances, user_metrics, thresholds=None):
+    """Праговете за разстояния на стъпката - от компилираните прагове на потребителя, иначе се изчисляват."""
+    return (thresholds or {}).get(threshold_key(tolerances)) or calculate_tolerances(tolerances, user_metrics)
+
+def compile_step(step_data, user_metrics, thresholds=None):
+    """
+    Компилира стъпка от упражнение с фиксирани толеранси за потребителя.
+    Ако са подадени прагове от профила (compile_thresholds), те се ползват вместо да се изчисляват наново.
+    """
+    tolerances = MappingProxyType(dict(step_data.get("tolerance", DEFAULT_TOLERANCE)))
+    return StepPlan(
+        name=step_data.get("name", ""),
+        duration=step_data.get("duration_seconds", 0),
+        tolerances=tolerances,
+        tolerances_data=MappingProxyType(dict(step_tolerances(tolerances, user_metrics, thresholds)))
+    )
+
+def compile_exercise(exercise, user_metrics, thresholds=None):
+    """Компилира всички стъпки на упражнение за дадените метрики (и прагове) на потребителя."""
+    return tuple(compile_step(step, user_metrics, thresholds) for step in exercise["steps"])
@@ -0,0 +1,120 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+# Без зависимост от globals - модулът се ползва и от sound_manager и tts_manager, които globals импортира
+logger = logging.getLogger(__name__)
+
+# Път към файла за трасиране (Chrome trace-event JSON); без него трасирането е изключено
+TRACE_ENV = "NUITRACK_TRACE_FILE"
+
+# Максимален брой пазени събития - при препълване най-старите се изхвърлят
+MAX_TRACE_EVENTS = 500_000
+
+class _NullSpan:
+    """Празен контекст, когато трасирането е изключено - не заделя нищо."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class _TraceSpan:
+    __slots__ = ('recorder', 'name', 'category', 'args', 'start')
+
+    def __init__(self, recorder, name, category, args):
+        self.recorder = recorder
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.recorder.complete(self.name, self.start, time.perf_counter(), self.category, self.args)
+
+class TraceRecorder:
+    """
+    Събира времеви интервали от всички нишки и ги записва във формата на Chrome trace-event,
+    който се отваря в chrome://tracing или Perfetto. Включва се с NUITRACK_TRACE_FILE.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv(TRACE_ENV)
+        self.enabled = bool(self.path)
+        self._events = deque(maxlen=MAX_TRACE_EVENTS)
+        self._threads = {}
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def complete(self, name, start, end, category="frame", args=None):
+        """Добавя завършен интервал (времената са от time.perf_counter)."""
+        if self.enabled:
+            self._append(name, category, start, end - start, args)
+
+    def instant(self, name, category="frame", args=None):
+        """Добавя моментно събитие (напр. завършена стъпка)."""
+        if self.enabled:
+            self._append(name, category, time.perf_counter(), None, args)
+
+    def _append(self, name, category, start, duration, args):
+        thread = threading.current_thread()
+        self._threads.setdefault(thread.ident, thread.name)
+        self._events.append((name, category, start, duration, thread.ident, args))
+
+    def span(self, name, category="frame", args=None):
+        """Контекст за измерване на интервал: `with tracer.span("render"):`."""
+        return _TraceSpan(self, name, category, args) if self.enabled else _NULL_SPAN
+
+    def traced(self, name, category):
+        """Декоратор, който трасира всяко извикване на функцията."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with _TraceSpan(self, name, category, None):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _to_json_events(self):
+        pid = os.getpid()
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+            for tid, name in list(self._threads.items())
+        ]
+        for name, category, start, duration, tid, args in list(self._events):
+            event = {"name": name, "cat": category, "pid": pid, "tid": tid, "ts": (start - self._origin) * 1e6}
+            if duration is None:
+                event.update(ph="i", s="t")
+            else:
+                event.update(ph="X", dur=duration * 1e6)
+            if args:
+                event["args"] = args
+            events.append(event)
+        return events
+
+    def save(self, path=None):
+        """Записва събраните събития като JSON. Връща пътя или None, ако трасирането е изключено."""
+        path = path or self.path
+        if not self.enabled or not path:
+            return None
+        with self._lock:
+            events = self._to_json_events()
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+        logger.info(f"Trace with {len(events)} events written to {path}")
+        return path
+
+# Глобален обект за трасиране
+tracer = TraceRecorder()
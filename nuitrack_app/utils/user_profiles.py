@@ -0,0 +1,142 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import NamedTuple
+
+import globals
+
+# Път към базата с профили; по подразбиране до приложението
+PROFILE_DB_ENV = "NUITRACK_PROFILE_DB"
+PROFILE_DB_NAME = "user_profiles.sqlite3"
+
+# Кратка проверка на избран профил вместо пълно калибриране (s)
+PROFILE_VERIFY_DURATION = 1.0
+
+# Допустимо отклонение на измерените метрики от профила: относително, но не по-малко от PROFILE_DRIFT_MIN_MM
+PROFILE_DRIFT_RATIO = 0.05
+PROFILE_DRIFT_MIN_MM = 25.0
+
+# Метрики, по които се проверява профилът - същите, по които се следи сходимостта на калибрирането
+DRIFT_METRICS = ("height", "arm_length", "hip_width", "leg_length")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    name TEXT PRIMARY KEY,
+    user_metrics TEXT NOT NULL,
+    thresholds TEXT NOT NULL,
+    quality REAL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    last_used REAL NOT NULL
+)
+"""
+
+class UserProfile(NamedTuple):
+    """Запазен профил: метрики от калибриране и изчислените от тях прагове."""
+    name: str
+    user_metrics: dict
+    thresholds: dict
+    quality: float
+    created: float
+    updated: float
+
+def default_profile_path():
+    """Пътят до базата: NUITRACK_PROFILE_DB или файл до приложението (до .exe при компилирано приложение)."""
+    path = os.getenv(PROFILE_DB_ENV)
+    if path:
+        return path
+    if getattr(sys, 'frozen', False):
+        base_path = os.path.dirname(sys.executable)
+    else:
+        base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(base_path, PROFILE_DB_NAME)
+
+class ProfileStore:
+    """
+    Локално SQLite хранилище на профили по име на потребителя.
+    Връзката се отваря при първо използване и се споделя между нишките под заключване.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            self.path = self.path or default_profile_path()
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute(_SCHEMA)
+            self._connection.commit()
+        return self._connection
+
+    def names(self):
+        """Имената на профилите, последно използваните първи."""
+        with self._lock:
+            rows = self._connect().execute("SELECT name FROM profiles ORDER BY last_used DESC").fetchall()
+        return [name for name, in rows]
+
+    def load(self, name):
+        """Зарежда профил по име и отбелязва използването му. Връща None, ако няма такъв."""
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute(
+                "SELECT name, user_metrics, thresholds, quality, created, updated FROM profiles WHERE name = ?", (name,)
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE profiles SET last_used = ? WHERE name = ?", (time.time(), name))
+            connection.commit()
+        name, user_metrics, thresholds, quality, created, updated = row
+        return UserProfile(name, json.loads(user_metrics), json.loads(thresholds), quality, created, updated)
+
+    def save(self, name, user_metrics, thresholds, quality=None):
+        """Създава или обновява профил."""
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT INTO profiles (name, user_metrics, thresholds, quality, created, updated, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET user_metrics = excluded.user_metrics, thresholds = excluded.thresholds, "
+                "quality = excluded.quality, updated = excluded.updated, last_used = excluded.last_used",
+                (name, json.dumps(user_metrics), json.dumps(thresholds), quality, now, now, now)
+            )
+            connection.commit()
+        globals.logger.info(f"Profile '{name}' saved to {self.path}")
+
+    def delete(self, name):
+        with self._lock:
+            connection = self._connect()
+            connection.execute("DELETE FROM profiles WHERE name = ?", (name,))
+            connection.commit()
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+def apply_profile(profile):
+    """Прилага профила като текущо калибриране - без ново калибриране."""
+    globals.user_metrics = dict(profile.user_metrics)
+    globals.user_thresholds = profile.thresholds
+    globals.calibration_quality = profile.quality
+    globals.calibration_completed = True
+    globals.user_profile = profile.name
+    globals.logger.info(f"Profile '{profile.name}' applied: {globals.user_metrics}")
+
+def metrics_drift(reference, measured):
+    """Метриките, при които измереното се отклонява от профила повече от допустимото: {име: (профил, измерено)}."""
+    drift = {}
+    for name in DRIFT_METRICS:
+        expected, actual = reference[name], measured[name]
+        if abs(actual - expected) > max(PROFILE_DRIFT_RATIO * expected, PROFILE_DRIFT_MIN_MM):
+            drift[name] = (expected, actual)
+    return drift
+
+# Глобално хранилище на профили
+profile_store = ProfileStore()
@@ -4,59 +4,128 @@ import cv2
 import time
 import os
 import sys
+from collections import OrderedDict
 
-from utils.skeleton_processing import project_world_to_screen
+from utils.skeleton_processing import JointIndex, project_world_to_screen
 
 import globals
 
-def draw_text(img, text, pos, font_path=None, font_size=24, color=(255,255,255)):
-    # Уверете се, че работим с копие, за да избегнем промяна на оригинала
-    img_copy = img.copy()
-    
+# Максимален брой кеширани текстови спрайтове (LRU)
+TEXT_SPRITE_CACHE_SIZE = 128
+
+def _default_font_path():
+    """Път до ARIAL.TTF в режим на разработка и в компилираното .exe."""
     if getattr(sys, 'frozen', False):
         # Compiled .exe, PyInstaller copies ARIAL.TTF to _MEIPASS
-        base_path = sys._MEIPASS
-        font_path = font_path or os.path.join(base_path, "ARIAL.TTF")
-    else:
-        # Dev mode: ARIAL.TTF is outside utils folder
-        base_path = os.path.dirname(os.path.abspath(__file__))
-        font_path = font_path or os.path.join(base_path, '../ARIAL.TTF')
+        return os.path.join(sys._MEIPASS, "ARIAL.TTF")
+    # Dev mode: ARIAL.TTF is outside utils folder
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), '../ARIAL.TTF')
+
+class TextRenderer:
+    """
+    Рисува текст с черен контур чрез кеширани спрайтове.
+
+    Шрифтът се зарежда веднъж за всеки размер, а всеки текст се рендерира веднъж до
+    алфа маска и предварително умножен цвят. При рисуване спрайтът се смесва
+    само в областта на текста от BGR кадъра, без копия и конверсии на целия кадър.
+    """
+
+    def __init__(self, max_sprites=TEXT_SPRITE_CACHE_SIZE):
+        self.max_sprites = max_sprites
+        self._fonts = {}
+        self._sprites = OrderedDict()
+
+    def get_font(self, font_path, font_size):
+        """Зарежда шрифта от диска само при първа нужда."""
+        key = (font_path, font_size)
+        font = self._fonts.get(key)
+        if font is None:
+            try:
+                font = ImageFont.truetype(font_path, font_size)
+            except Exception as e:
+                print(f"Font loading failed: {e}, using default font")
+                font = ImageFont.load_default()
+            self._fonts[key] = font
+        return font
+
+    def get_sprite(self, text, font_path, font_size, color):
+        """Връща (отместване, 1 - алфа, предварително умножен BGR цвят) за текста, с LRU кеширане."""
+        key = (text, font_path, font_size, color)
+        sprite = self._sprites.get(key)
+        if sprite is not None:
+            self._sprites.move_to_end(key)
+            return sprite
+
+        sprite = self._render_sprite(text, self.get_font(font_path, font_size), font_size, color)
+        self._sprites[key] = sprite
+        if len(self._sprites) > self.max_sprites:
+            self._sprites.popitem(last=False)
+        return sprite
+
+    def _render_sprite(self, text, font, font_size, color):
+        # Черният контур е леко изместен - отместването зависи от размера на шрифта
+        outline_offset = max(1, font_size // 12)
+        left, top, right, bottom = font.getbbox(text)
+        left, top = max(0, left), max(0, top)
+        size = (max(1, right + outline_offset), max(1, bottom + outline_offset))
+
+        # Маски на основния текст и на контура
+        text_mask = Image.new('L', size, 0)
+        ImageDraw.Draw(text_mask).text((0, 0), text, font=font, fill=255)
+        outline_mask = Image.new('L', size, 0)
+        ImageDraw.Draw(outline_mask).text((outline_offset, outline_offset), text, font=font, fill=255)
+
+        text_alpha = np.asarray(text_mask, dtype=np.float32)[top:, left:, None] / 255.0
+        outline_alpha = np.asarray(outline_mask, dtype=np.float32)[top:, left:, None] / 255.0
+
+        # Текстът е върху контура: обща алфа и цвят, умножен по алфата на текста (контурът е черен)
+        alpha = text_alpha + outline_alpha * (1.0 - text_alpha)
+        color_bgr = np.array(color[::-1], dtype=np.float32)
+        premultiplied = text_alpha * color_bgr
+        return (left, top), 1.0 - alpha, premultiplied
+
+    def draw(self, img, text, pos, font_path=None, font_size=24, color=(255, 255, 255)):
+        """Рисува текста директно в img (BGR) и връща img."""
+        (dx, dy), inv_alpha, premultiplied = self.get_sprite(text, font_path or _default_font_path(), font_size, tuple(color))
+        blend_sprite(img, inv_alpha, premultiplied, pos[0] + dx, pos[1] + dy)
+        return img
+
+def blend_sprite(img, inv_alpha, premultiplied, x, y):
+    """Смесва спрайт (1 - алфа, предварително умножен цвят) в img на позиция (x, y), с изрязване по краищата."""
+    height, width = img.shape[:2]
+    sprite_h, sprite_w = inv_alpha.shape[:2]
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + sprite_w, width), min(y + sprite_h, height)
+    if x0 >= x1 or y0 >= y1:
+        return
 
-    try:
-        img_pil = Image.fromarray(cv2.cvtColor(img_copy, cv2.COLOR_BGR2RGB))
-        draw = ImageDraw.Draw(img_pil)
-        
-        try:
-            font = ImageFont.truetype(font_path, font_size)
-        except Exception as e:
-            print(f"Font loading failed: {e}, using default font")
-            font = ImageFont.load_default()
-        
-        # Начертайте черен контур (леко изместен)
-        outline_offset = max(1, font_size // 12)  # Регулирайте отместването според размера на шрифта
-        draw.text((pos[0] + outline_offset, pos[1] + outline_offset), text, font=font, fill=(0, 0, 0))
+    roi = img[y0:y1, x0:x1]
+    sy, sx = y0 - y, x0 - x
+    inv_alpha = inv_alpha[sy:sy + (y1 - y0), sx:sx + (x1 - x0)]
+    premultiplied = premultiplied[sy:sy + (y1 - y0), sx:sx + (x1 - x0)]
+    roi[:] = roi * inv_alpha + premultiplied
 
-        # Начертайте основния текст
-        draw.text(pos, text, font=font, fill=color)
+text_renderer = TextRenderer()
 
-        # Конвертирайте обратно във формат OpenCV
-        result = cv2.cvtColor(np.array(img_pil), cv2.COLOR_RGB2BGR)
-        return result
+def draw_text(img, text, pos, font_path=None, font_size=24, color=(255,255,255)):
+    """Рисува текст с черен контур върху img (BGR) и връща img. Цветът е в RGB."""
+    try:
+        return text_renderer.draw(img, text, pos, font_path, font_size, color)
         
     except Exception as e:
         print(f"draw_text error: {e}")
         # Резервен вариант с OpenCV текст, ако PIL се провали
-        cv2.putText(img_copy, text, pos, cv2.FONT_HERSHEY_SIMPLEX, font_size/24.0, color, 2)
-        return img_copy
+        cv2.putText(img, text, pos, cv2.FONT_HERSHEY_SIMPLEX, font_size/24.0, color, 2)
+        return img
 
-def draw_simple_skeleton(image, data, nuitrack):
+def draw_simple_skeleton(image, data, nuitrack, user_skeleton):
     """Начертава скелет върху видео потока с насоки за позата."""
     
     if not _has_skeleton_data(data):
         return
     
     _draw_all_skeletons(image, data)
-    _draw_ui_overlays(image, nuitrack)
+    _draw_ui_overlays(image, nuitrack, user_skeleton)
 
 def _has_skeleton_data(data):
     """Проверява дали са налични данни за скелета."""
@@ -128,11 +197,11 @@ def _is_valid_connection(joint_points, start_idx, end_idx):
             joint_points[end_idx] is not None)
 
 
-def _draw_ui_overlays(image, nuitrack):
+def _draw_ui_overlays(image, nuitrack, skeleton):
     """Начертава UI елементи и насоки за позата."""
     _draw_calibration_if_active(image)
-    _draw_distance_feedback_if_available(image)
-    _draw_exercise_guidance_if_active(image, nuitrack)
+    _draw_distance_feedback_if_available(image, skeleton)
+    _draw_exercise_guidance_if_active(image, nuitrack, skeleton)
 
 
 def _draw_calibration_if_active(image):
@@ -141,41 +210,36 @@ def _draw_calibration_if_active(image):
         draw_calibration_overlay(image)
 
 
-def _draw_distance_feedback_if_available(image):
+def _draw_distance_feedback_if_available(image, skeleton):
     """Начертава лента за обратна връзка за разстоянието."""
-    skeleton = globals.current_user_skeleton
-    
-    if not (skeleton and isinstance(skeleton, dict) and 'TORSO' in skeleton):
+    if not skeleton:
         return
         
-    torso_joint = skeleton.get('TORSO')
-    if torso_joint and isinstance(torso_joint, dict):
-        user_z = torso_joint.get('z', 1500)
-        draw_distance_feedback(image, user_z)
+    torso = skeleton.position(JointIndex.TORSO)
+    if torso is not None:
+        draw_distance_feedback(image, float(torso[2]))
 
 
-def _draw_exercise_guidance_if_active(image, nuitrack):
+def _draw_exercise_guidance_if_active(image, nuitrack, skeleton):
     """Начертава насочващи стрелки по време на упражнение."""
-    if not _should_draw_exercise_guidance():
+    if not _should_draw_exercise_guidance(skeleton):
         return
         
     current_step_data = globals.EXERCISE_JSON["steps"][globals.current_step]
     required_poses = current_step_data.get("required_poses", {})
     
-    _draw_pose_guidance_arrows(image, nuitrack, required_poses)
+    _draw_pose_guidance_arrows(image, nuitrack, skeleton, required_poses)
 
 
-def _should_draw_exercise_guidance():
+def _should_draw_exercise_guidance(skeleton):
     """Проверява дали трябва да се начертаят насоки за упражненията."""
     return (globals.exercise_active and 
             globals.current_step < len(globals.EXERCISE_JSON["steps"]) and 
-            globals.current_user_skeleton)
+            skeleton)
 
 
-def _draw_pose_guidance_arrows(image, nuitrack, required_poses):
+def _draw_pose_guidance_arrows(image, nuitrack, skeleton, required_poses):
     """Начертава стрелки за изискваните пози."""
-    skeleton = globals.current_user_skeleton
-    
     if "legs_apart" in required_poses:
         _draw_legs_apart_arrows(image, nuitrack, skeleton)
     
@@ -231,14 +295,12 @@ def _draw_head_tilt_arrow(image, nuitrack, skeleton, direction):
 
 def _get_joint_projection(joint_name, skeleton, nuitrack):
     """Взема координатите на прожекцията на екрана за дадена става."""
-    joint_data = skeleton.get(joint_name, {})
+    position = skeleton.position(joint_name)
     
-    if not joint_data:
+    if position is None:
         return None
         
-    x = joint_data.get('x', 0)
-    y = joint_data.get('y', 0)
-    z = joint_data.get('z', 0)
+    x, y, z = position.tolist()
     
     return project_world_to_screen(x, y, z, nuitrack)
 
@@ -252,15 +314,17 @@ def draw_calibration_overlay(image):
     height, width = image.shape[:2]
     # Изчислява изминалото време от началото на калибрирането
     elapsed_time = time.time() - globals.calibration_start_time
-    # Изчислява оставащото време (максимум 0, минимум 5 секунди)
-    remaining_time = max(0, 5 - elapsed_time)
+    # Изчислява оставащото време до най-голямата продължителност на текущото калибриране
+    calibrator = globals.calibrator
+    max_duration = calibrator.max_duration if calibrator is not None else 5
+    remaining_time = max(0, max_duration - elapsed_time)
     
-    # Създава копие на изображението за наслагването
-    overlay = image.copy()
-    # Рисува полупрозрачен правоъгълник върху цялото изображение
-    cv2.rectangle(overlay, (0, 0), (width, height), (0, 50, 100), -1)
-    # Комбинира оригиналното изображение с наслагването (70% оригинал, 30% наслагване)
-    cv2.addWeighted(overlay, 0.3, image, 0.7, 0, image)
+    # Полупрозрачно оцветяване (70% оригинал, 30% наслагване) само на панела зад обратното броене и лентата:
+    # смесва се областта от кадъра с кеширан едноцветен слой с нейния размер, а не целият кадър
+    x0, y0, x1, y1 = _calibration_panel(width, height)
+    roi = image[y0:y1, x0:x1]
+    tint = overlay_layers.get("calibration_tint", (x1 - x0, y1 - y0), _build_tint_layer)
+    cv2.addWeighted(tint, 0.3, roi, 0.7, 0, roi)
     
     # Голям текст за обратно броене
     # Формира текст с оставащото време за калибриране
@@ -303,66 +367,140 @@ def draw_calibration_overlay(image):
         # Рисува бял контур около лентата
         cv2.rectangle(image, (bar_x, bar_y), (bar_x + bar_width, bar_y + bar_height), (255, 255, 255), 2)
 
+# Диапазони за лентата за разстояние
+DISTANCE_MIN_DISPLAY = 1000   # 1.0m - минимално показвано разстояние
+DISTANCE_MAX_DISPLAY = 4500   # 4.5m - максимално показвано разстояние
+DISTANCE_MIN_VALID = 2500     # 2.5m - начало на валидната зона
+DISTANCE_MAX_VALID = 3000     # 3.0m - край на валидната зона
+DISTANCE_BAR_WIDTH = 400      # Ширина на лентата
+DISTANCE_BAR_HEIGHT = 20      # Височина на лентата
+
+# Цвят на оцветяването на кадъра по време на калибриране (BGR)
+CALIBRATION_TINT_COLOR = (0, 50, 100)
+
+# Панел с оцветяването: ширина и разстояние над и под средата на кадъра (текстът е в средата, лентата - 110 px под него)
+CALIBRATION_PANEL_WIDTH = 360
+CALIBRATION_PANEL_ABOVE = 80
+CALIBRATION_PANEL_BELOW = 150
+
+class OverlayLayerCache:
+    """
+    Кешира статичните части на наслагванията за всеки размер на кадъра.
+    Така при всеки кадър се рисуват само движещите се елементи (маркер, обратно броене, прогрес).
+    """
+
+    def __init__(self):
+        self._layers = {}
+
+    def get(self, name, frame_size, build):
+        """Връща кеширания слой или го създава с build(ширина, височина)."""
+        key = (name, frame_size)
+        layer = self._layers.get(key)
+        if layer is None:
+            layer = build(*frame_size)
+            self._layers[key] = layer
+        return layer
+
+overlay_layers = OverlayLayerCache()
+
+def _build_layer(x, y, width, height, draw):
+    """
+    Рисува статичен слой и връща (x, y, предварително умножен BGR спрайт, 255 - покритие).
+    Слоят се рисува върху черно платно (т.е. цветът вече е умножен по покритието),
+    а покритието се рисува отделно със същите примитиви в едноканална маска.
+    """
+    canvas = np.zeros((height, width, 3), dtype=np.uint8)
+    mask = np.zeros((height, width), dtype=np.uint8)
+    draw(canvas, mask, x, y)
+    inv_mask = cv2.cvtColor(255 - mask, cv2.COLOR_GRAY2BGR)
+    return x, y, canvas, inv_mask
+
+def _calibration_panel(width, height):
+    """Областта (x0, y0, x1, y1) зад обратното броене и лентата за прогрес, ограничена до кадъра."""
+    center_x, center_y = width // 2, height // 2
+    return (
+        max(0, center_x - CALIBRATION_PANEL_WIDTH // 2), max(0, center_y - CALIBRATION_PANEL_ABOVE),
+        min(width, center_x + CALIBRATION_PANEL_WIDTH // 2), min(height, center_y + CALIBRATION_PANEL_BELOW)
+    )
+
+def _build_tint_layer(width, height):
+    """Едноцветен слой с размера на панела за полупрозрачното оцветяване при калибриране."""
+    tint = np.empty((height, width, 3), dtype=np.uint8)
+    tint[:] = CALIBRATION_TINT_COLOR
+    return tint
+
+def blit_layer(image, layer):
+    """Композира предварително умножен слой само в неговата област от кадъра: кадър * (1 - покритие) + слой."""
+    x, y, premultiplied, inv_mask = layer
+    h, w = inv_mask.shape[:2]
+    roi = image[y:y + h, x:x + w]
+    cv2.multiply(roi, inv_mask, dst=roi, scale=1 / 255.0)
+    cv2.add(roi, premultiplied, dst=roi)
+
+def _distance_bar_geometry(width, height):
+    """Позиция на лентата и на валидната зона в пиксели."""
+    bar_x = (width - DISTANCE_BAR_WIDTH) // 2  # Центрира лентата хоризонтално
+    bar_y = height - 40  # Позиционира лентата близо до долния край на изображението
+    display_range = DISTANCE_MAX_DISPLAY - DISTANCE_MIN_DISPLAY
+    valid_start = int(((DISTANCE_MIN_VALID - DISTANCE_MIN_DISPLAY) / display_range) * DISTANCE_BAR_WIDTH)  # Начало на зелената зона
+    valid_end = int(((DISTANCE_MAX_VALID - DISTANCE_MIN_DISPLAY) / display_range) * DISTANCE_BAR_WIDTH)  # Край на зелената зона
+    return bar_x, bar_y, valid_start, valid_end
+
+def _build_distance_bar_layer(width, height):
+    """Статичната част на лентата за разстояние: сив фон, зелена зона и етикети."""
+    bar_x, bar_y, valid_start, valid_end = _distance_bar_geometry(width, height)
+    # Областта покрива лентата и етикетите над и под нея
+    layer_x, layer_y = max(0, bar_x - 25), max(0, bar_y - 20)
+    layer_w = min(width, bar_x + DISTANCE_BAR_WIDTH + 40) - layer_x
+    layer_h = min(height, bar_y + 40) - layer_y
+
+    def draw(canvas, mask, x0, y0):
+        bx, by = bar_x - x0, bar_y - y0
+        for target, white, grey, dark_green, green in ((canvas, (255, 255, 255), (50, 50, 50), (0, 100, 0), (0, 255, 0)),
+                                                       (mask, 255, 255, 255, 255)):
+            # Сива лента за целия диапазон (1m–4.5m)
+            cv2.rectangle(target, (bx, by), (bx + DISTANCE_BAR_WIDTH, by + DISTANCE_BAR_HEIGHT), grey, -1)
+            # Зелена зона за валидния диапазон (2.5m–3.0m)
+            cv2.rectangle(target, (bx + valid_start, by), (bx + valid_end, by + DISTANCE_BAR_HEIGHT), dark_green, -1)
+            # Текстови етикети за разстоянията
+            cv2.putText(target, "1m", (bx - 20, by + 35), cv2.FONT_HERSHEY_SIMPLEX, 0.4, white, 1)
+            cv2.putText(target, "2.5m", (bx + valid_start - 20, by - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.4, green, 1)
+            cv2.putText(target, "3.0m", (bx + valid_end - 20, by - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.4, green, 1)
+            cv2.putText(target, "4.5m", (bx + DISTANCE_BAR_WIDTH + 5, by + 35), cv2.FONT_HERSHEY_SIMPLEX, 0.4, white, 1)
+
+    return _build_layer(layer_x, layer_y, layer_w, layer_h, draw)
+
 def draw_distance_feedback(image, user_z):
     """Рисува лента за разположение на потребителя пред камерата с валидна зона 2.5m-3.0m пред камерата."""
 
     # Взема размерите на изображението (височина и ширина)
     height, width = image.shape[:2]
 
-    # Дефинира диапазони за разстоянията
-    min_display = 1000   # 1.0m - минимално показвано разстояние
-    max_display = 4500   # 4.5m - максимално показвано разстояние
-    min_valid = 2500     # 2.5m - начало на валидната зона
-    max_valid = 3000     # 3.0m - край на валидната зона
-
     # Определя цвета на маркера според разстоянието
-    if user_z < min_valid:
+    if user_z < DISTANCE_MIN_VALID:
         progress_color = (0, 0, 255)  # Червен (твърде близо)
-    elif user_z > max_valid:
+    elif user_z > DISTANCE_MAX_VALID:
         progress_color = (0, 165, 255)  # Оранжев (твърде далеч)
     else:
         progress_color = (0, 255, 0)  # Зелен (валидно разстояние)
 
-    # Настройки на лентата за визуализация
-    bar_width = 400  # Ширина на лентата
-    bar_height = 20  # Височина на лентата
-    bar_x = (width - bar_width) // 2  # Центрира лентата хоризонтално
-    bar_y = height - 40  # Позиционира лентата близо до долния край на изображението
-
-    # Рисува сива лента за целия диапазон (1m–4.5m)
-    cv2.rectangle(image, (bar_x, bar_y),
-                  (bar_x + bar_width, bar_y + bar_height),
-                  (50, 50, 50), -1)
+    # Статичната част (лента, зона, етикети) се рисува веднъж за размера на кадъра и само се композира
+    blit_layer(image, overlay_layers.get("distance_bar", (width, height), _build_distance_bar_layer))
 
-    # Рисува зелена зона за валидния диапазон (2.5m–3.0m)
-    valid_start = int(((min_valid - min_display) / (max_display - min_display)) * bar_width)  # Начало на зелената зона
-    valid_end = int(((max_valid - min_display) / (max_display - min_display)) * bar_width)  # Край на зелената зона
-    cv2.rectangle(image, (bar_x + valid_start, bar_y),
-                  (bar_x + valid_end, bar_y + bar_height),
-                  (0, 100, 0), -1)
+    bar_x, bar_y, _, _ = _distance_bar_geometry(width, height)
 
     # Изчислява позицията на маркера за текущото разстояние
-    if user_z < min_display:
+    if user_z < DISTANCE_MIN_DISPLAY:
         current_pos = 0  # Ако е твърде близо, маркерът е в началото
-    elif user_z > max_display:
-        current_pos = bar_width  # Ако е твърде далеч, маркерът е в края
+    elif user_z > DISTANCE_MAX_DISPLAY:
+        current_pos = DISTANCE_BAR_WIDTH  # Ако е твърде далеч, маркерът е в края
     else:
         # Пропорционално изчисляване на позицията в лентата
-        current_pos = int(((user_z - min_display) / (max_display - min_display)) * bar_width)
+        current_pos = int(((user_z - DISTANCE_MIN_DISPLAY) / (DISTANCE_MAX_DISPLAY - DISTANCE_MIN_DISPLAY)) * DISTANCE_BAR_WIDTH)
 
     # Определя координатата на маркера по X
-    marker_x = bar_x + min(max(current_pos, 0), bar_width)
+    marker_x = bar_x + min(max(current_pos, 0), DISTANCE_BAR_WIDTH)
     # Рисува запълнен кръг за текущото разстояние
-    cv2.circle(image, (marker_x, bar_y + bar_height // 2), 12, progress_color, -1)
+    cv2.circle(image, (marker_x, bar_y + DISTANCE_BAR_HEIGHT // 2), 12, progress_color, -1)
     # Рисува бял контур около кръга за по-добра видимост
-    cv2.circle(image, (marker_x, bar_y + bar_height // 2), 12, (255, 255, 255), 2)
-
-    # Добавя текстови етикети за разстоянията
-    cv2.putText(image, "1m", (bar_x - 20, bar_y + 35),
-                cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)  # Етикет за 1m
-    cv2.putText(image, "2.5m", (bar_x + valid_start - 20, bar_y - 5),
-                cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 255, 0), 1)  # Етикет за начало на валидната зона
-    cv2.putText(image, "3.0m", (bar_x + valid_end - 20, bar_y - 5),
-                cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 255, 0), 1)  # Етикет за край на валидната зона
-    cv2.putText(image, "4.5m", (bar_x + bar_width + 5, bar_y + 35),
-                cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)  # Етикет за 4.5m
\ No newline at end of file
+    cv2.circle(image, (marker_x, bar_y + DISTANCE_BAR_HEIGHT // 2), 12, (255, 255, 255), 2)